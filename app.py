@@ -3,9 +3,10 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import CSRFProtect
 import os
 import ssl
+import threading
 from urllib.parse import quote_plus
 from sqlalchemy import create_engine, text
-from datetime import timedelta
+from datetime import datetime, timedelta
 import stripe
 from application import create_app
 from application.boundaries.platform_boundary import platform_bp
@@ -14,6 +15,78 @@ from application.boundaries.main_boundary import main_bp
 
 from database.models import Base
 
+_background_services_lock = threading.Lock()
+
+def start_background_services(app):
+    """Start this process's background threads, once per process
+
+    Gallery warmup, the recognition job workers, the write-behind journal
+    and the class finalizer. Threads are not inherited by a fork, so a
+    process forked after this ran replaces the copies it inherited with
+    its own.
+    """
+    if app.config.get('background_services_pid') == os.getpid():
+        return
+    with _background_services_lock:
+        if app.config.get('background_services_pid') == os.getpid():
+            return
+        app.config['background_services_pid'] = os.getpid()
+        _start_background_services(app)
+
+def _start_background_services(app):
+    if app.config['FACIAL_WARMUP_ON_BOOT']:
+        app.config['facial_recognition'].start_warmup(app)
+
+    # Asynchronous /recognize requests wait here for a worker thread
+    from application.controls.recognition_jobs import RecognitionJobQueue
+    app.config['recognition_jobs'] = RecognitionJobQueue(
+        workers=app.config['FACIAL_JOB_WORKERS'],
+        max_queue=app.config['FACIAL_JOB_QUEUE'],
+        result_ttl=app.config['FACIAL_JOB_RESULT_TTL'],
+        logger=app.logger
+    )
+
+    # Write-behind check-ins: acknowledged once journaled, replayed on boot
+    if app.config['ATTENDANCE_WRITE_BEHIND']:
+        import atexit
+        from application.controls.attendance_control import AttendanceControl
+        from application.controls.attendance_journal import AttendanceJournal
+        from application.controls.enrolment_cache import EnrolmentCache
+        # Check-ins are only journaled for enrolled students; rosters are cached
+        app.config['enrolment_cache'] = EnrolmentCache(
+            lambda class_id: AttendanceControl.get_enrolled_student_ids(class_id),
+            ttl=app.config['ATTENDANCE_ENROLMENT_CACHE_TTL']
+        )
+        journal = AttendanceJournal(
+            app.config['ATTENDANCE_JOURNAL_DIR'],
+            writer=lambda events: AttendanceControl.write_journal_events(app, events),
+            flush_interval=app.config['ATTENDANCE_FLUSH_INTERVAL_MS'] / 1000,
+            flush_batch=app.config['ATTENDANCE_FLUSH_BATCH'],
+            max_attempts=app.config['ATTENDANCE_FLUSH_MAX_ATTEMPTS'],
+            logger=app.logger
+        )
+        journal.start()
+        atexit.register(journal.shutdown)
+        app.config['attendance_journal'] = journal
+
+    # Ended classes are completed and unrecorded students marked absent
+    if app.config['ATTENDANCE_FINALIZE_ENABLED']:
+        from application.controls.class_finalizer import ClassFinalizer
+        if app.config['ATTENDANCE_FINALIZE_SINCE']:
+            finalize_since = datetime.fromisoformat(app.config['ATTENDANCE_FINALIZE_SINCE'])
+        else:
+            # Without a cutoff only classes ending after this boot are finalized;
+            # set one so classes that end while the app is down are not missed
+            finalize_since = datetime.now()
+            app.logger.warning("ATTENDANCE_FINALIZE_SINCE is not set; finalizing classes ending after this boot only")
+        class_finalizer = ClassFinalizer(
+            app,
+            since=finalize_since,
+            grace=timedelta(minutes=app.config['ATTENDANCE_FINALIZE_GRACE_MINUTES'])
+        )
+        class_finalizer.start()
+        app.config['class_finalizer'] = class_finalizer
+
 def create_flask_app(config_name='default'):
     """Factory function to create Flask application"""
     app = Flask(__name__)
@@ -92,12 +165,74 @@ def create_flask_app(config_name='default'):
     # Add facial recognition config
     app.config['FACIAL_DATA_DIR'] = './AttendanceAI/data/'
     app.config['FACIAL_RECOGNITION_THRESHOLD'] = 70
+    app.config['FACIAL_COMPACT_THRESHOLD'] = 500  # Appended samples before background compaction
+    app.config['FACIAL_GALLERY_SOURCE'] = os.getenv('FACIAL_GALLERY_SOURCE', 'file')  # 'file' or 'database'
+    app.config['FACIAL_CLASS_INDEX_TTL'] = 600  # Seconds to keep a class sub-index once the class has ended
+    app.config['FACIAL_GALLERY_POLL_SECONDS'] = int(os.getenv('FACIAL_GALLERY_POLL_SECONDS', '0'))  # 0 = reload on notification only
+    app.config['FACIAL_SHARD_BY_INSTITUTION'] = os.getenv('FACIAL_SHARD_BY_INSTITUTION', 'false').lower() == 'true'  # Bounds memory in database mode only
+    app.config['FACIAL_SHARD_MAX_BYTES'] = int(os.getenv('FACIAL_SHARD_MAX_BYTES', str(512 * 1024 * 1024)))  # Resident shard budget per worker
+    app.config['FACIAL_SHARD_MAX_COUNT'] = int(os.getenv('FACIAL_SHARD_MAX_COUNT', '32'))
+    app.config['FACIAL_PROJECTION_ENABLED'] = os.getenv('FACIAL_PROJECTION_ENABLED', 'false').lower() == 'true'  # Needs fit-pca first
+    app.config['FACIAL_INDEX_BACKEND'] = os.getenv('FACIAL_INDEX_BACKEND', 'brute')  # 'brute', 'balltree' or 'ivfpq'
+    app.config['FACIAL_IVF_NLIST'] = int(os.getenv('FACIAL_IVF_NLIST', '0'))  # 0 = 4 * sqrt(samples)
+    app.config['FACIAL_IVF_NPROBE'] = int(os.getenv('FACIAL_IVF_NPROBE', '8'))
+    app.config['FACIAL_PQ_SUBQUANTIZERS'] = int(os.getenv('FACIAL_PQ_SUBQUANTIZERS', '16'))
+    app.config['FACIAL_DETECTOR'] = os.getenv('FACIAL_DETECTOR', 'haar')  # 'haar', 'lbp' or 'dnn'
+    app.config['FACIAL_DETECTOR_MODEL'] = os.getenv('FACIAL_DETECTOR_MODEL', '')  # Defaults to the standard file in FACIAL_DATA_DIR
+    app.config['FACIAL_DETECTOR_CONFIG'] = os.getenv('FACIAL_DETECTOR_CONFIG', '')  # DNN network description, e.g. deploy.prototxt
+    app.config['FACIAL_DNN_CONFIDENCE'] = float(os.getenv('FACIAL_DNN_CONFIDENCE', '0.5'))
+    app.config['FACIAL_DETECT_REDUCTION'] = int(os.getenv('FACIAL_DETECT_REDUCTION', '2'))  # Detect on a 1/n size decode: 1, 2, 4 or 8
+    app.config['FACIAL_DETECT_SCALE_FACTOR'] = float(os.getenv('FACIAL_DETECT_SCALE_FACTOR', '1.3'))
+    app.config['FACIAL_DETECT_MIN_NEIGHBORS'] = 5
+    app.config['FACIAL_MIN_FACE_SIZE'] = int(os.getenv('FACIAL_MIN_FACE_SIZE', '48'))  # Smallest face in full-resolution pixels
+    app.config['FACIAL_RECOGNITION_WORKERS'] = int(os.getenv('FACIAL_RECOGNITION_WORKERS', '0'))  # Worker processes per app process; 0 = recognize on the request thread
+    app.config['FACIAL_RECOGNITION_QUEUE'] = int(os.getenv('FACIAL_RECOGNITION_QUEUE', '0'))  # Waiting requests before rejecting; 0 = 4 per worker
+    app.config['FACIAL_RECOGNITION_TIMEOUT'] = float(os.getenv('FACIAL_RECOGNITION_TIMEOUT', '10'))
+    app.config['FACIAL_JOB_WORKERS'] = int(os.getenv('FACIAL_JOB_WORKERS', '4'))  # Threads serving asynchronous /recognize jobs
+    app.config['FACIAL_JOB_QUEUE'] = int(os.getenv('FACIAL_JOB_QUEUE', '256'))
+    app.config['FACIAL_JOB_RESULT_TTL'] = 300  # Seconds a finished job's result can still be fetched
+    app.config['FACIAL_JOB_STREAM_SECONDS'] = 60
+    app.config['FACIAL_TRACK_MAX_AGE'] = float(os.getenv('FACIAL_TRACK_MAX_AGE', '2.0'))  # Seconds a face can vanish before its stream track ends
+    app.config['FACIAL_STREAM_MAX_ATTEMPTS'] = 3  # Classifications per track while it stays below the threshold
+    app.config['FACIAL_SNAPSHOT_MAX_IMAGES'] = 5  # Photos per classroom snapshot
+    app.config['FACIAL_RESULT_CACHE_SIZE'] = int(os.getenv('FACIAL_RESULT_CACHE_SIZE', '256'))  # Recent /recognize results reused for near-identical kiosk frames; 0 = off
+    app.config['FACIAL_RESULT_CACHE_TTL'] = float(os.getenv('FACIAL_RESULT_CACHE_TTL', '30'))
+    app.config['FACIAL_RESULT_CACHE_TOLERANCE'] = 16  # Grey levels any 32x32 thumbnail cell may differ by
+    app.config['ATTENDANCE_WRITE_BEHIND'] = os.getenv('ATTENDANCE_WRITE_BEHIND', 'false').lower() == 'true'  # Journal check-ins locally, write in batches
+    app.config['ATTENDANCE_JOURNAL_DIR'] = os.getenv('ATTENDANCE_JOURNAL_DIR', './AttendanceAI/journal/')
+    app.config['ATTENDANCE_FLUSH_INTERVAL_MS'] = int(os.getenv('ATTENDANCE_FLUSH_INTERVAL_MS', '500'))
+    app.config['ATTENDANCE_FLUSH_BATCH'] = int(os.getenv('ATTENDANCE_FLUSH_BATCH', '500'))  # Waiting check-ins that trigger an early flush
+    app.config['ATTENDANCE_FLUSH_MAX_ATTEMPTS'] = int(os.getenv('ATTENDANCE_FLUSH_MAX_ATTEMPTS', '10'))  # Failed writes before a segment is moved to dead-*.log
+    app.config['ATTENDANCE_ENROLMENT_CACHE_TTL'] = 300  # Seconds a class roster is trusted before journaling a check-in
+    app.config['ATTENDANCE_FINALIZE_ENABLED'] = os.getenv('ATTENDANCE_FINALIZE_ENABLED', 'false').lower() == 'true'  # Complete ended classes, unrecorded students absent
+    app.config['ATTENDANCE_FINALIZE_SINCE'] = os.getenv('ATTENDANCE_FINALIZE_SINCE', '')  # ISO datetime; only classes ending after it are finalized
+    app.config['ATTENDANCE_FINALIZE_GRACE_MINUTES'] = int(os.getenv('ATTENDANCE_FINALIZE_GRACE_MINUTES', '10'))  # After end_time
+    app.config['IDEMPOTENCY_MAX_ENTRIES'] = int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', '10000'))  # Stored responses for Idempotency-Key retries
+    app.config['IDEMPOTENCY_TTL'] = int(os.getenv('IDEMPOTENCY_TTL', '86400'))
+    app.config['IDEMPOTENCY_DB_BACKED'] = os.getenv('IDEMPOTENCY_DB_BACKED', 'false').lower() == 'true'  # Shared across processes and restarts
+    app.config['FACIAL_WARMUP_ON_BOOT'] = os.getenv('FACIAL_WARMUP_ON_BOOT', 'true').lower() == 'true'  # Else warmed on first use
 
-    # Initialize facial recognition control
+    # The one facial recognition control every route uses; the gallery is
+    # loaded in the background so boot is not blocked
     from application.controls.facial_recognition_control import FacialRecognitionControl
-    fr_control = FacialRecognitionControl()
-    fr_control.initialize(app)  # Optional: initialize on startup
-    app.config['facial_recognition'] = fr_control
+    app.config['facial_recognition'] = FacialRecognitionControl()
+
+    # Background threads do not survive a fork, so each process starts its
+    # own: here, unless this is the debug reloader's watcher process (it
+    # never serves requests), and again on the first request of a process
+    # forked after this point, e.g. a preloading server's workers
+    if not (app.debug and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'):
+        start_background_services(app)
+    app.before_request(lambda: start_background_services(app))
+
+    # Responses replayed to client retries carrying the same Idempotency-Key
+    from application.controls.idempotency import IdempotencyStore
+    app.config['idempotency_store'] = IdempotencyStore(
+        max_entries=app.config['IDEMPOTENCY_MAX_ENTRIES'],
+        ttl=app.config['IDEMPOTENCY_TTL'],
+        db_backed=app.config['IDEMPOTENCY_DB_BACKED'],
+        logger=app.logger
+    )
 
     # Register the facial recognition blueprint
     from application.boundaries.facial_recognition_boundary import facial_recognition_bp
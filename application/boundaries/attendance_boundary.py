@@ -2,6 +2,7 @@
 from flask import Blueprint, request, jsonify, session, current_app
 from application.controls.auth_control import requires_roles, authenticate_user
 from application.controls.attendance_control import AttendanceControl
+from application.controls.idempotency import idempotent
 from application.boundaries.dev_actions import register_action
 from datetime import datetime, date
 import functools
@@ -24,8 +25,12 @@ def verify_attendance_auth():
 
 @attendance_bp.route('/mark', methods=['POST'])
 @verify_attendance_auth()
+@idempotent('attendance.mark')
 def mark_attendance():
-    """Mark attendance for a student in a class"""
+    """Mark attendance for a student in a class
+    
+    A retry with the same Idempotency-Key gets the first response back.
+    """
     user_id = session.get('user_id')
     user_role = session.get('role')
     
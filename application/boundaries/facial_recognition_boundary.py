@@ -1,13 +1,91 @@
 # application/boundaries/facial_recognition_boundary.py
-from flask import Blueprint, request, jsonify, session, current_app
+from flask import Blueprint, request, jsonify, session, current_app, url_for, Response
 from application.controls.auth_control import AuthControl
-from application.controls.facial_recognition_control import FacialRecognitionControl
 from application.controls.attendance_control import AttendanceControl
+from application.controls.idempotency import idempotent
 import base64
-import io
+import json
+import mmap
+import time
+from tempfile import SpooledTemporaryFile
 
 facial_recognition_bp = Blueprint('facial_recognition', __name__)
-fr_control = FacialRecognitionControl()
+
+def get_recognizer():
+    """The app-wide FacialRecognitionControl created in app.py"""
+    return current_app.config['facial_recognition']
+
+def recognizer_unavailable(fr_control):
+    """503 response while the gallery is still loading; starts loading if nobody has
+    
+    start_warmup is a no-op while this process is already warming, and
+    restarts a warmup a forked worker inherited without its thread.
+    """
+    fr_control.start_warmup(current_app._get_current_object())
+    response = jsonify({
+        'success': False,
+        'error': 'Facial recognition is warming up, please retry shortly',
+        'status': fr_control.status
+    })
+    response.headers['Retry-After'] = '2'
+    return response, 503
+
+def read_image_request():
+    """Image buffer and the other request fields, for any supported upload style
+    
+    - raw ``image/*`` or ``application/octet-stream`` body, fields in the
+      query string: the body is read straight into one buffer
+    - ``multipart/form-data`` with an ``image`` file part: an upload still
+      spooled in memory is read out of it (one small copy); one already on
+      disk is mapped read-only
+    - JSON with a base64 ``image`` field, kept for existing clients
+    
+    The returned buffer goes to cv2.imdecode without further copies.
+    
+    Returns:
+        Tuple of (image buffer or None, dict of fields)
+    """
+    mimetype = request.mimetype
+    if mimetype.startswith('image/') or mimetype == 'application/octet-stream':
+        return read_request_body(), request.args.to_dict()
+    
+    if mimetype == 'multipart/form-data':
+        fields = {**request.args.to_dict(), **request.form.to_dict()}
+        upload = request.files.get('image')
+        if upload is None:
+            return None, fields
+        stream = upload.stream
+        if hasattr(stream, 'getbuffer'):
+            return stream.getbuffer(), fields
+        if isinstance(stream, SpooledTemporaryFile) and not stream._rolled:
+            # fileno() would roll a small upload over to a temporary file
+            return stream.read(), fields
+        try:
+            return mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ), fields
+        except (AttributeError, OSError, ValueError):
+            return stream.read(), fields
+    
+    data = request.get_json(silent=True) or {}
+    image_base64 = data.get('image')
+    if not image_base64:
+        return None, data
+    return base64.b64decode(image_base64.split(',')[1] if ',' in image_base64 else image_base64), data
+
+def read_request_body():
+    """Read the raw request body into a single preallocated buffer"""
+    length = request.content_length
+    if not length:
+        return request.get_data(cache=False) or None
+    
+    buffer = bytearray(length)
+    view = memoryview(buffer)
+    received = 0
+    while received < length:
+        count = request.stream.readinto(view[received:])
+        if not count:
+            break
+        received += count
+    return view[:received] if received else None
 
 @facial_recognition_bp.route('/initialize', methods=['POST'])
 def initialize_facial_recognition():
@@ -28,11 +106,12 @@ def initialize_facial_recognition():
             'error': 'Permission denied'
         }), 403
     
-    if fr_control.initialize(current_app):
+    fr_control = get_recognizer()
+    if fr_control.initialize(current_app._get_current_object()):
         return jsonify({
             'success': True,
             'message': 'Facial recognition initialized',
-            'samples_loaded': len(fr_control.labels)
+            'samples_loaded': fr_control.sample_count
         })
     else:
         return jsonify({
@@ -40,9 +119,56 @@ def initialize_facial_recognition():
             'error': 'Failed to initialize facial recognition'
         }), 500
 
+@facial_recognition_bp.route('/reload', methods=['POST'])
+def reload_facial_recognition():
+    """Change notification: rebuild the index if the shared gallery changed"""
+    auth_result = AuthControl.verify_session(current_app, session)
+    
+    if not auth_result['success']:
+        return jsonify({
+            'success': False,
+            'error': 'Authentication required'
+        }), 401
+    
+    user_info = auth_result['user']
+    if user_info.get('user_type') not in ['admin', 'lecturer', 'institution_admin']:
+        return jsonify({
+            'success': False,
+            'error': 'Permission denied'
+        }), 403
+    
+    fr_control = get_recognizer()
+    if not fr_control.is_initialized:
+        return jsonify({
+            'success': False,
+            'error': 'Facial recognition not initialized'
+        }), 400
+    
+    try:
+        reloaded = fr_control.refresh_if_changed()
+        return jsonify({
+            'success': True,
+            'reloaded': reloaded,
+            'samples_loaded': fr_control.sample_count
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @facial_recognition_bp.route('/recognize', methods=['POST'])
+@idempotent('facial_recognition.recognize')
 def recognize_face():
-    """Recognize face from uploaded image and mark attendance"""
+    """Recognize face from uploaded image and mark attendance
+    
+    Accepts a raw image body or multipart upload (class_id in the query
+    string or form), or JSON with a base64 image. With ``async=1`` or a
+    ``Prefer: respond-async`` header the frame is queued and a job id is
+    returned at once (202); poll /jobs/<job_id> or stream
+    /jobs/<job_id>/events for the outcome. A retry with the same
+    Idempotency-Key gets the first response (or the same job id) back.
+    """
     auth_result = AuthControl.verify_session(current_app, session)
     
     if not auth_result['success']:
@@ -51,92 +177,334 @@ def recognize_face():
             'error': 'Authentication required'
         }), 401
     
-    data = request.get_json() or {}
+    try:
+        image_data, data = read_image_request()
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid image data'
+        }), 400
     
-    # Get image data (base64 encoded)
-    image_base64 = data.get('image')
-    session_id = data.get('session_id')
+    # Older clients send the class as session_id
+    class_id = data.get('class_id') or data.get('session_id')
     
-    if not image_base64:
+    if image_data is None:
         return jsonify({
             'success': False,
             'error': 'Image data is required'
         }), 400
     
-    if not session_id:
+    if not class_id:
         return jsonify({
             'success': False,
-            'error': 'Session ID is required'
+            'error': 'Class ID is required'
         }), 400
     
     try:
-        # Decode base64 image
-        image_data = base64.b64decode(image_base64.split(',')[1] if ',' in image_base64 else image_base64)
-        
-        # Recognize face
-        recognition_result = fr_control.recognize_face_from_image(image_data)
+        class_id = int(class_id)
+    except (TypeError, ValueError):
+        return jsonify({
+            'success': False,
+            'error': 'Invalid class ID'
+        }), 400
+    
+    fr_control = get_recognizer()
+    if not fr_control.is_initialized:
+        return recognizer_unavailable(fr_control)
+    
+    institution_id = session.get('institution_id')
+    if wants_async(data):
+        app = current_app._get_current_object()
+        # The upload buffer does not outlive the request
+        image_bytes = bytes(image_data)
+        job_id = get_job_queue().submit(
+            lambda: run_in_app_context(app, recognize_and_mark, fr_control, image_bytes, class_id, institution_id),
+            owner=session.get('user_id')
+        )
+        if job_id is None:
+            response = jsonify({
+                'success': False,
+                'error': 'Too many recognitions queued, please retry shortly'
+            })
+            response.headers['Retry-After'] = '2'
+            return response, 503
+        poll_url = url_for('facial_recognition.get_recognition_job', job_id=job_id)
+        response = jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status': 'queued',
+            'poll_url': poll_url,
+            'events_url': url_for('facial_recognition.stream_recognition_job', job_id=job_id)
+        })
+        response.headers['Location'] = poll_url
+        return response, 202
+    
+    payload, status_code = recognize_and_mark(fr_control, image_data, class_id, institution_id)
+    response = jsonify(payload)
+    if status_code == 503:
+        # Recognition workers are busy or timed out; ask the client to back off
+        response.headers['Retry-After'] = '2'
+    return response, status_code
+
+def wants_async(data):
+    """Whether the client asked for a job id instead of waiting for the result"""
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        return True
+    return str(data.get('async', '')).lower() in ('1', 'true', 'yes')
+
+def get_job_queue():
+    """The app-wide RecognitionJobQueue created in app.py"""
+    return current_app.config['recognition_jobs']
+
+def run_in_app_context(app, func, *args):
+    with app.app_context():
+        return func(*args)
+
+def recognize_and_mark(fr_control, image_data, class_id, institution_id):
+    """Recognize the best face in the frame and mark the student present
+    
+    Returns:
+        Tuple of (response payload, HTTP status)
+    """
+    try:
+        # Recognize face against the students enrolled in this class only
+        recognition_result = fr_control.recognize_face_from_image(
+            image_data, class_id=class_id, institution_id=institution_id, use_cache=True
+        )
         
         if not recognition_result['success']:
-            return jsonify(recognition_result), 400
+            if recognition_result.get('saturated'):
+                return recognition_result, 503
+            return recognition_result, 400
         
         # Get the highest confidence recognition
         recognitions = recognition_result.get('recognitions', [])
         if not recognitions:
-            return jsonify({
+            return {
                 'success': False,
                 'error': 'No faces recognized'
-            }), 400
+            }, 400
         
         best_recognition = max(recognitions, key=lambda r: r['confidence'])
         
-        # If confidence is too low, require manual verification
-        if best_recognition['confidence'] < 70:  # Threshold
-            return jsonify({
+        # If confidence is below the configured threshold, or the face is
+        # outside the student's acceptance radius, require manual verification
+        if not fr_control.is_confident(best_recognition):
+            return {
                 'success': False,
                 'error': 'Low confidence recognition',
                 'suggested_name': best_recognition['name'],
                 'confidence': best_recognition['confidence'],
                 'requires_verification': True
-            }), 400
+            }, 400
         
-        # Mark attendance
+        # Samples enrolled without an account cannot be checked in
         student_id = best_recognition.get('student_id')
-        if not student_id:
-            # Try to extract from name or use the name itself
-            student_id = best_recognition['name']
+        if student_id is None:
+            return {
+                'success': False,
+                'error': 'Recognized face is not linked to a student account',
+                'suggested_name': best_recognition['name'],
+                'confidence': best_recognition['confidence'],
+                'requires_verification': True
+            }, 400
         
-        attendance_result = AttendanceControl.mark_attendance(
+        # Enrolment check and upsert in one statement
+        attendance_result = AttendanceControl.check_in(
             current_app,
-            session_id=session_id,
-            student_id=student_id,
-            status='present',
-            marked_by='system',
-            captured_image_path=f"data:image/jpeg;base64,{image_base64[:100]}..."  # Store partial
+            class_id=class_id,
+            student_id=student_id
         )
         
         if attendance_result['success']:
-            return jsonify({
+            return {
                 'success': True,
                 'message': f'Attendance marked for {best_recognition["name"]}',
                 'recognition': best_recognition,
                 'attendance': attendance_result
-            })
+            }, 200
         else:
-            return jsonify({
+            return {
                 'success': False,
                 'error': attendance_result.get('error', 'Failed to mark attendance'),
                 'recognition': best_recognition
-            }), 400
+            }, 400
             
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }, 500
+
+@facial_recognition_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_recognition_job(job_id):
+    """Poll an asynchronous recognition job
+    
+    ``result`` holds what /recognize would have returned once ``status`` is
+    'done' or 'failed'.
+    """
+    auth_result = AuthControl.verify_session(current_app, session)
+    
+    if not auth_result['success']:
+        return jsonify({
+            'success': False,
+            'error': 'Authentication required'
+        }), 401
+    
+    job = get_job_queue().get(job_id, owner=session.get('user_id'))
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found'
+        }), 404
+    
+    return jsonify({'success': True, **job})
+
+@facial_recognition_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_recognition_job(job_id):
+    """Server-sent events for a recognition job: one event per status change
+    
+    The stream ends after the 'done' or 'failed' event, or after
+    FACIAL_JOB_STREAM_SECONDS without one.
+    """
+    auth_result = AuthControl.verify_session(current_app, session)
+    
+    if not auth_result['success']:
+        return jsonify({
+            'success': False,
+            'error': 'Authentication required'
+        }), 401
+    
+    job_queue = get_job_queue()
+    owner = session.get('user_id')
+    if job_queue.get(job_id, owner=owner) is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found'
+        }), 404
+    
+    stream_seconds = current_app.config.get('FACIAL_JOB_STREAM_SECONDS', 60)
+    
+    def get_events():
+        deadline = time.monotonic() + stream_seconds
+        seen_status = None
+        while time.monotonic() < deadline:
+            job = job_queue.wait(job_id, seen_status, timeout=deadline - time.monotonic(), owner=owner)
+            if job is None or job['status'] == seen_status:
+                return
+            seen_status = job['status']
+            yield f"event: {seen_status}\ndata: {json.dumps(job)}\n\n"
+            if seen_status in ('done', 'failed'):
+                return
+    
+    response = Response(get_events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@facial_recognition_bp.route('/stream/<stream_id>/frame', methods=['POST'])
+def recognize_stream_frame(stream_id):
+    """Kiosk stream mode: track faces across frames and check each person in once
+
+    Send frames from one camera under the same stream_id (any client-chosen
+    name). Faces already tracked reuse their recognition; a confident
+    track is marked present once and then reported as already checked in
+    until it leaves the frame.
+    """
+    auth_result = AuthControl.verify_session(current_app, session)
+
+    if not auth_result['success']:
+        return jsonify({
+            'success': False,
+            'error': 'Authentication required'
+        }), 401
+
+    try:
+        image_data, data = read_image_request()
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid image data'
+        }), 400
+
+    class_id = data.get('class_id') or data.get('session_id')
+
+    if image_data is None:
+        return jsonify({
+            'success': False,
+            'error': 'Image data is required'
+        }), 400
+
+    if not class_id:
+        return jsonify({
+            'success': False,
+            'error': 'Class ID is required'
+        }), 400
+
+    try:
+        class_id = int(class_id)
+    except (TypeError, ValueError):
+        return jsonify({
+            'success': False,
+            'error': 'Invalid class ID'
+        }), 400
+
+    fr_control = get_recognizer()
+    if not fr_control.is_initialized:
+        return recognizer_unavailable(fr_control)
+
+    # Stream names are per user so two kiosks cannot share tracks by accident
+    stream_key = f"{session.get('user_id')}:{stream_id}"
+    try:
+        result = fr_control.recognize_stream_frame(
+            stream_key, image_data, class_id=class_id, institution_id=session.get('institution_id')
+        )
+        if not result['success']:
+            return jsonify(result), 400
+
+        result['stream_id'] = stream_id
+        for track in result['tracks']:
+            track['already_checked_in'] = track['checked_in']
+            recognition = track['recognition']
+            if (track['checked_in'] or not recognition or recognition['student_id'] is None
+                    or not fr_control.is_confident(recognition)):
+                continue
+
+            attendance_result = AttendanceControl.check_in(
+                current_app,
+                class_id=class_id,
+                student_id=recognition['student_id']
+            )
+            track['attendance'] = attendance_result
+            if attendance_result['success']:
+                fr_control.mark_track_checked_in(stream_key, track['track_id'], attendance_result)
+                track['checked_in'] = True
+
+        return jsonify(result)
+
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+@facial_recognition_bp.route('/stream/<stream_id>', methods=['DELETE'])
+def end_stream(stream_id):
+    """Forget a stream's tracks when the kiosk closes"""
+    auth_result = AuthControl.verify_session(current_app, session)
+
+    if not auth_result['success']:
+        return jsonify({
+            'success': False,
+            'error': 'Authentication required'
+        }), 401
+
+    ended = get_recognizer().stream_trackers.drop(f"{session.get('user_id')}:{stream_id}")
+    return jsonify({'success': True, 'ended': ended})
+
 @facial_recognition_bp.route('/register', methods=['POST'])
 def register_face():
-    """Register a new face for a student"""
+    """Register a new face for a student (raw, multipart or base64 JSON upload)"""
     auth_result = AuthControl.verify_session(current_app, session)
     
     if not auth_result['success']:
@@ -145,10 +513,15 @@ def register_face():
             'error': 'Authentication required'
         }), 401
     
-    data = request.get_json() or {}
+    try:
+        image_data, data = read_image_request()
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid image data'
+        }), 400
     
     student_id = data.get('student_id')
-    image_base64 = data.get('image')
     student_name = data.get('student_name')
     
     if not student_id:
@@ -157,18 +530,21 @@ def register_face():
             'error': 'Student ID is required'
         }), 400
     
-    if not image_base64:
+    if image_data is None:
         return jsonify({
             'success': False,
             'error': 'Image data is required'
         }), 400
     
+    fr_control = get_recognizer()
+    if not fr_control.is_initialized:
+        return recognizer_unavailable(fr_control)
+    
     try:
-        # Decode base64 image
-        image_data = base64.b64decode(image_base64.split(',')[1] if ',' in image_base64 else image_base64)
-        
         # Register face
-        result = fr_control.register_new_face(student_id, image_data, student_name)
+        result = fr_control.register_new_face(
+            student_id, image_data, student_name, institution_id=session.get('institution_id')
+        )
         
         return jsonify(result)
         
@@ -189,9 +565,8 @@ def get_facial_recognition_status():
             'error': 'Authentication required'
         }), 401
     
-    return jsonify({
-        'success': True,
-        'initialized': fr_control.is_initialized,
-        'samples_loaded': len(fr_control.labels) if fr_control.is_initialized else 0,
-        'model_ready': fr_control.knn_model is not None
-    })
\ No newline at end of file
+    status = get_recognizer().get_status()
+    journal = current_app.config.get('attendance_journal')
+    if journal is not None:
+        status['attendance_journal'] = journal.stats()
+    return jsonify({'success': True, **status})
\ No newline at end of file
@@ -3,6 +3,7 @@ from application.controls.auth_control import AuthControl, requires_roles
 from application.controls.attendance_control import AttendanceControl
 from application.controls.class_control import ClassControl
 from application.controls.course_control import CourseControl
+from application.controls.idempotency import idempotent
 from application.entities2.classes import ClassModel
 from application.entities2.course import CourseModel
 from application.entities2.user import UserModel
@@ -11,6 +12,7 @@ from application.entities2.venue import VenueModel
 from application.controls.announcement_control import AnnouncementControl
 from application.controls.lecturer_control import LecturerControl
 from datetime import datetime, date, timedelta
+import base64
 import calendar
 from database.base import get_session
 from database.models import AttendanceRecord, Venue
@@ -569,6 +571,7 @@ def generate_lecturer_monthly_calendar(target_date, lecturer_id, course_filter=N
 
 @lecturer_bp.route('/api/attendance/mark', methods=['POST'])
 @requires_roles('lecturer')
+@idempotent('lecturer.attendance.mark')
 def mark_attendance_api():
     """API endpoint to mark attendance for a student"""
     try:
@@ -625,35 +628,90 @@ def batch_mark_attendance():
             
             if not class_obj or class_obj.lecturer_id != get_lecturer_id():
                 return jsonify({'success': False, 'error': 'Unauthorized access'}), 403
-            
-            results = []
-            for item in attendance_data:
-                student_id = item.get('student_id')
-                status = item.get('status', 'present')
-                notes = item.get('notes')
-                
-                if student_id:
-                    result = AttendanceControl.mark_attendance(
-                        current_app,
-                        class_id,
-                        student_id,
-                        status,
-                        'lecturer',
-                        get_lecturer_id(),
-                        notes
-                    )
-                    results.append(result)
-            
-            return jsonify({
-                'success': True,
-                'message': f'Attendance marked for {len(results)} students',
-                'results': results
-            })
+        
+        # Whole roster in one multi-row upsert
+        result = AttendanceControl.mark_attendance_batch(
+            current_app,
+            class_id,
+            attendance_data,
+            get_lecturer_id()
+        )
+        if not result['success']:
+            return jsonify(result), 500
+        
+        result['message'] = f"Attendance marked for {result['marked']} students"
+        return jsonify(result)
             
     except Exception as e:
         current_app.logger.error(f"Error in batch attendance: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@lecturer_bp.route('/api/attendance/<int:class_id>/snapshot', methods=['POST'])
+@requires_roles('lecturer')
+def classroom_snapshot_api(class_id):
+    """Mark attendance for everyone recognised in one or a few classroom photos
+    
+    Accepts multipart ``images`` files (or a single ``image``), or JSON with
+    a base64 ``images`` list. Returns the class roster split into present,
+    unknown and missing.
+    """
+    try:
+        with get_session() as db_session:
+            class_obj = ClassModel(db_session).get_by_id(class_id)
+            if not class_obj or class_obj.lecturer_id != get_lecturer_id():
+                return jsonify({'success': False, 'error': 'Unauthorized access'}), 403
+        
+        if request.mimetype == 'multipart/form-data':
+            photos = [upload.read() for upload in request.files.getlist('images') + request.files.getlist('image')]
+        else:
+            data = request.get_json(silent=True) or {}
+            photos = [
+                base64.b64decode(image.split(',')[1] if ',' in image else image)
+                for image in data.get('images', [])
+            ]
+        
+        if not photos:
+            return jsonify({'success': False, 'error': 'At least one photo is required'}), 400
+        max_photos = current_app.config.get('FACIAL_SNAPSHOT_MAX_IMAGES', 5)
+        if len(photos) > max_photos:
+            return jsonify({'success': False, 'error': f'At most {max_photos} photos per snapshot'}), 400
+        
+        fr_control = current_app.config['facial_recognition']
+        if not fr_control.is_initialized:
+            return jsonify({'success': False, 'error': 'Facial recognition is warming up, please retry shortly'}), 503
+        
+        recognitions, photo_summary = [], []
+        for photo_index, photo in enumerate(photos):
+            # Classroom photos of one room look alike to the result cache
+            # even when different students are in view, so never reuse one
+            result = fr_control.recognize_face_from_image(
+                photo, class_id=class_id, institution_id=get_institution_id(), use_cache=False
+            )
+            if not result['success']:
+                if result['error'] != 'No face detected':
+                    return jsonify(result), 503 if result.get('saturated') else 400
+                photo_summary.append({'photo': photo_index, 'faces': 0})
+                continue
+            photo_summary.append({'photo': photo_index, 'faces': result['face_count']})
+            for recognition in result['recognitions']:
+                recognitions.append({
+                    **recognition,
+                    'photo': photo_index,
+                    'accepted': fr_control.is_confident(recognition)
+                })
+        
+        result = AttendanceControl.mark_classroom_snapshot(
+            current_app, class_id, get_lecturer_id(), recognitions
+        )
+        if not result['success']:
+            return jsonify(result), 400
+        result['photos'] = photo_summary
+        return jsonify(result)
+    
+    except Exception as e:
+        current_app.logger.error(f"Error in classroom snapshot: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @lecturer_bp.route('/api/attendance/<int:class_id>')
 @requires_roles('lecturer')
 def get_class_attendance_api(class_id):
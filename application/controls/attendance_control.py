@@ -56,6 +56,324 @@ class AttendanceControl:
                 'error': str(e)
             }
     
+    @staticmethod
+    def check_in(app, class_id, student_id, status='present', marked_by='system'):
+        """Mark a recognised student in one statement, if enrolled in the class
+        
+        The fast path for recognition check-ins: the enrolment check and the
+        upsert are a single round trip, and the result is built without
+        reading the record back. In write-behind mode enrolment is checked
+        against the cached class roster, then the check-in is only appended
+        to the attendance journal and written later in a batch, so the
+        result carries ``queued`` instead of an attendance_id. Students
+        unenrolled before the flush are dropped then.
+        """
+        journal = app.config.get('attendance_journal')
+        try:
+            if journal is not None:
+                if not app.config['enrolment_cache'].is_enrolled(int(class_id), int(student_id)):
+                    return {
+                        'success': False,
+                        'error': 'Student is not enrolled in this class',
+                        'not_enrolled': True
+                    }
+                journal.append(class_id, student_id, status=status, marked_by=marked_by)
+                return {
+                    'success': True,
+                    'queued': True,
+                    'status': status,
+                    'message': f'Attendance queued as {status}'
+                }
+            
+            with get_session() as db_session:
+                attendance_model = AttendanceRecordModel(db_session)
+                attendance_id, updated = attendance_model.check_in(
+                    class_id, student_id, status=status, marked_by=marked_by
+                )
+                
+                if attendance_id is None:
+                    return {
+                        'success': False,
+                        'error': 'Student is not enrolled in this class',
+                        'not_enrolled': True
+                    }
+                
+                return {
+                    'success': True,
+                    'attendance_id': attendance_id,
+                    'status': status,
+                    'message': f'Attendance updated to {status}' if updated else f'Attendance marked as {status}'
+                }
+                
+        except Exception as e:
+            app.logger.error(f"Error checking in student: {e}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    @staticmethod
+    def get_enrolled_student_ids(class_id):
+        """User ids of the students enrolled in a class"""
+        with get_session() as db_session:
+            return ClassModel(db_session).get_enrolled_student_ids(class_id)
+    
+    @staticmethod
+    def write_journal_events(app, events):
+        """Write a flushed batch of journaled check-ins, one upsert per class
+        
+        Events keep their original check-in time; when a student appears
+        more than once in a class, the latest event wins. A record that a
+        lecturer marked, or that was recorded after the event, is kept.
+        Events for students not enrolled in the class are dropped with a
+        warning.
+        """
+        by_class = {}
+        for event in events:
+            by_class.setdefault(event['class_id'], []).append(event)
+        
+        try:
+            with get_session() as db_session:
+                class_model = ClassModel(db_session)
+                attendance_model = AttendanceRecordModel(db_session)
+                written = 0
+                for class_id, class_events in by_class.items():
+                    enrolled_ids = set(class_model.get_enrolled_student_ids(class_id))
+                    rows = [
+                        {
+                            'student_id': event['student_id'],
+                            'status': event['status'],
+                            'marked_by': event['marked_by'],
+                            'recorded_at': datetime.fromisoformat(event['recorded_at'])
+                        }
+                        for event in class_events
+                        if event['student_id'] in enrolled_ids
+                    ]
+                    if len(rows) < len(class_events):
+                        app.logger.warning(
+                            f"Dropped {len(class_events) - len(rows)} journaled check-ins for students "
+                            f"not enrolled in class {class_id}"
+                        )
+                    written += len(attendance_model.bulk_upsert(class_id, rows, replay=True))
+                
+                return {'success': True, 'written': written}
+                
+        except Exception as e:
+            app.logger.error(f"Error writing journaled attendance: {e}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    @staticmethod
+    def finalize_ended_classes(app, ended_after, ended_before=None, limit=200):
+        """Complete classes that have ended and mark their unrecorded students absent
+        
+        Only classes ending after ``ended_after`` are touched, so classes
+        from before the finalizer was switched on keep their records as they
+        are. Set-wise: one INSERT ... SELECT creates the absent records for
+        every due class, and one UPDATE marks them completed, in one
+        transaction.
+        
+        Returns:
+            Dict with the finalized class ids and the absent records created
+        """
+        try:
+            with get_session() as db_session:
+                class_model = ClassModel(db_session)
+                class_ids = class_model.lock_ended_unfinalized(
+                    ended_before or datetime.now(), ended_after, limit=limit
+                )
+                absent = AttendanceRecordModel(db_session).mark_absent_unrecorded(class_ids)
+                class_model.mark_completed(class_ids)
+                db_session.commit()
+                
+                return {
+                    'success': True,
+                    'class_ids': class_ids,
+                    'absent_marked': absent
+                }
+                
+        except Exception as e:
+            app.logger.error(f"Error finalizing ended classes: {e}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    @staticmethod
+    def get_next_class_end(app, ended_after):
+        """End time of the next class ending after ``ended_after`` still to be finalized, or None"""
+        try:
+            with get_session() as db_session:
+                return ClassModel(db_session).get_next_unfinalized_end(ended_after)
+        except Exception as e:
+            app.logger.error(f"Error reading next class end: {e}")
+            return None
+    
+    @staticmethod
+    def mark_attendance_batch(app, class_id, attendance, lecturer_id=None):
+        """Mark a lecturer's batch of students in one multi-row upsert
+        
+        Args:
+            class_id: The class
+            attendance: Items with student_id, and optionally status and notes
+            lecturer_id: Lecturer marking the batch
+        
+        Returns:
+            Dict with ``results``, one per submitted item in order: the
+            record's attendance_id and outcome ('created' or 'updated'), or
+            an error for items without a student, with an unknown status or
+            for students not enrolled in the class
+        """
+        statuses = ('present', 'absent', 'late', 'excused')
+        try:
+            with get_session() as db_session:
+                enrolled_ids = set(ClassModel(db_session).get_enrolled_student_ids(class_id))
+                
+                results, rows = [], []
+                for item in attendance:
+                    student_id = item.get('student_id')
+                    status = item.get('status', 'present')
+                    try:
+                        student_id = int(student_id) if student_id else None
+                    except (TypeError, ValueError):
+                        student_id = None
+                    
+                    if student_id is None:
+                        results.append({'success': False, 'error': 'Student ID is required'})
+                    elif status not in statuses:
+                        results.append({'success': False, 'student_id': student_id, 'error': f'Invalid status: {status}'})
+                    elif student_id not in enrolled_ids:
+                        results.append({'success': False, 'student_id': student_id,
+                                        'error': 'Student is not enrolled in this class'})
+                    else:
+                        results.append(None)
+                        rows.append({
+                            'student_id': student_id,
+                            'status': status,
+                            'marked_by': 'lecturer',
+                            'lecturer_id': lecturer_id,
+                            'notes': item.get('notes')
+                        })
+                
+                outcomes = {
+                    outcome['student_id']: outcome
+                    for outcome in AttendanceRecordModel(db_session).bulk_upsert(class_id, rows)
+                }
+                
+                row_iter = iter(rows)
+                for i, result in enumerate(results):
+                    if result is None:
+                        outcome = outcomes[next(row_iter)['student_id']]
+                        verb = 'marked as' if outcome['outcome'] == 'created' else 'updated to'
+                        results[i] = {'success': True, **outcome, 'message': f"Attendance {verb} {outcome['status']}"}
+                
+                return {
+                    'success': True,
+                    'marked': len(outcomes),
+                    'results': results
+                }
+                
+        except Exception as e:
+            app.logger.error(f"Error in batch attendance: {e}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    @staticmethod
+    def mark_classroom_snapshot(app, class_id, lecturer_id, recognitions):
+        """Mark every enrolled student recognised in classroom photos present at once
+        
+        Args:
+            class_id: The class
+            lecturer_id: Lecturer who took the photos
+            recognitions: Recognitions from all photos, each with ``photo``
+                (its index) and ``accepted`` (confident enough to mark)
+        
+        Returns:
+            Dict with the roster: ``present`` (recognised now, or already
+            marked present/late/excused earlier), ``unknown`` (faces that
+            were not confident, not enrolled, or a second face in the same
+            photo matched to the same student) and ``missing`` (enrolled,
+            not seen)
+        """
+        try:
+            with get_session() as db_session:
+                class_model = ClassModel(db_session)
+                attendance_model = AttendanceRecordModel(db_session)
+                
+                if not class_model.get_by_id(class_id):
+                    return {'success': False, 'error': 'Class not found'}
+                enrolled_ids = set(class_model.get_enrolled_student_ids(class_id))
+                names = UserModel(db_session).get_names_by_ids(enrolled_ids)
+                existing = {record.student_id: record.status for record in attendance_model.get_by_class(class_id)}
+                
+                # Best face per enrolled student across all photos
+                best, unknown = {}, []
+                for recognition in sorted(recognitions, key=lambda r: r['confidence'], reverse=True):
+                    face = {
+                        'photo': recognition['photo'],
+                        'bbox': recognition['bbox'],
+                        'suggested_name': recognition['name'],
+                        'confidence': recognition['confidence']
+                    }
+                    student_id = recognition['student_id']
+                    if not recognition['accepted']:
+                        unknown.append({**face, 'reason': 'low_confidence'})
+                    elif student_id not in enrolled_ids:
+                        unknown.append({**face, 'reason': 'not_enrolled'})
+                    elif student_id in best:
+                        # Overlapping photos show the same student more than once
+                        if best[student_id]['photo'] == face['photo']:
+                            unknown.append({**face, 'reason': 'duplicate'})
+                    else:
+                        best[student_id] = face
+                
+                # Students already marked keep their status
+                kept = ('present', 'late', 'excused')
+                rows = [
+                    {
+                        'student_id': student_id,
+                        'status': 'present',
+                        'marked_by': 'lecturer',
+                        'lecturer_id': lecturer_id,
+                        'notes': 'Classroom snapshot'
+                    }
+                    for student_id in best
+                    if existing.get(student_id) not in kept
+                ]
+                written = attendance_model.bulk_upsert(class_id, rows)
+                
+                present, missing = [], []
+                for student_id in sorted(enrolled_ids, key=lambda sid: names.get(sid, '')):
+                    entry = {'student_id': student_id, 'name': names.get(student_id, 'Unknown')}
+                    status = existing.get(student_id) if existing.get(student_id) in kept else 'present'
+                    if student_id in best:
+                        present.append({**entry, **best[student_id], 'status': status, 'source': 'snapshot'})
+                    elif existing.get(student_id) in kept:
+                        present.append({**entry, 'status': existing[student_id], 'source': 'existing'})
+                    else:
+                        missing.append(entry)
+                
+                return {
+                    'success': True,
+                    'class_id': class_id,
+                    'marked': len(written),
+                    'enrolled': len(enrolled_ids),
+                    'present': present,
+                    'unknown': unknown,
+                    'missing': missing
+                }
+        
+        except Exception as e:
+            app.logger.error(f"Error marking classroom snapshot: {e}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
     @staticmethod
     def get_class_attendance(app, class_id):
         """Get attendance records for a specific class"""
@@ -0,0 +1,213 @@
+# application/controls/attendance_journal.py
+import glob
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+
+class AttendanceJournal:
+    """Write-behind buffer of check-ins backed by a local append-only journal.
+
+    ``append`` writes the event as one JSON line and fsyncs before returning,
+    so a check-in can be acknowledged without a database round trip. A
+    background thread flushes every ``flush_interval`` seconds, or as soon
+    as ``flush_batch`` events are waiting: it seals the active journal into
+    a segment file (new appends go to a fresh journal), hands the segment's
+    events to ``writer`` and deletes the segment once ``writer`` reports
+    success. A failed flush leaves the segment for the next attempt, with
+    the wait between attempts doubling up to ``max_retry_interval``. A
+    segment that fails ``max_attempts`` times in a row is renamed to
+    ``dead-*.log`` and skipped so later segments are written; rename it
+    back to ``segment-*.log`` to replay it.
+
+    Each process appends to its own ``journal-<pid>.log``. On ``start``,
+    segments left over from a crash, and journals of processes that are no
+    longer running, are replayed before new events are taken. Writes are
+    upserts, so replaying a segment that was written just before a crash is
+    harmless.
+    """
+
+    def __init__(self, directory, writer, flush_interval=0.5, flush_batch=500, max_attempts=10,
+                 max_retry_interval=30.0, logger=None):
+        self.directory = directory
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.max_attempts = max_attempts
+        self.max_retry_interval = max_retry_interval
+        self.logger = logger
+        self._path = os.path.join(directory, f'journal-{os.getpid()}.log')
+        self._file = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._appended = 0
+        self._flushed = 0
+        self._batches = 0
+        self._failures = 0
+        self._attempts = {}
+        self._dead_lettered = 0
+        self._last_flush_ms = None
+
+    def start(self):
+        """Replay anything left from an earlier run, then start flushing"""
+        os.makedirs(self.directory, exist_ok=True)
+        for path in glob.glob(os.path.join(self.directory, 'journal-*.log')):
+            if path == self._path or not self._is_running(path):
+                self._seal(path)
+        self._flush_segments()
+        self._file = open(self._path, 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self._run, name='attendance-journal', daemon=True)
+        self._thread.start()
+
+    def append(self, class_id, student_id, status='present', marked_by='system'):
+        """Durably record a check-in and return its event"""
+        event = {
+            'class_id': int(class_id),
+            'student_id': int(student_id),
+            'status': status,
+            'marked_by': marked_by,
+            'recorded_at': datetime.utcnow().isoformat()
+        }
+        line = json.dumps(event) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._pending += 1
+            self._appended += 1
+            if self._pending >= self.flush_batch:
+                self._wakeup.set()
+        return event
+
+    def flush(self):
+        """Seal the active journal and write every waiting segment now"""
+        with self._lock:
+            if self._pending:
+                self._file.close()
+                self._seal(self._path)
+                self._file = open(self._path, 'a', encoding='utf-8')
+                self._pending = 0
+        self._flush_segments()
+
+    def shutdown(self):
+        """Stop the flusher and write what is left"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            if os.path.getsize(self._path) == 0:
+                os.remove(self._path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self._pending,
+                'appended': self._appended,
+                'flushed': self._flushed,
+                'batches': self._batches,
+                'failures': self._failures,
+                'dead_lettered': self._dead_lettered,
+                'last_flush_ms': self._last_flush_ms
+            }
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self._retry_interval())
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Attendance journal flush failed: {e}")
+
+    def _seal(self, path):
+        """Rename a journal to a segment awaiting flush"""
+        if os.path.getsize(path) == 0:
+            return
+        segment = os.path.join(self.directory, f'segment-{time.time_ns()}-{os.getpid()}.log')
+        os.replace(path, segment)
+
+    def _flush_segments(self):
+        with self._flush_lock:
+            for segment in sorted(glob.glob(os.path.join(self.directory, 'segment-*.log'))):
+                events = self._read(segment)
+                if events is None:
+                    continue
+                started = time.perf_counter()
+                result = self.writer(events) if events else {'success': True}
+                if not result['success']:
+                    self._failures += 1
+                    attempts = self._attempts.get(segment, 0) + 1
+                    if self.logger:
+                        self.logger.error(
+                            f"Attendance journal segment {segment} not written "
+                            f"(attempt {attempts} of {self.max_attempts}): {result.get('error')}"
+                        )
+                    if attempts < self.max_attempts:
+                        # Later segments wait, so events are written in order
+                        self._attempts[segment] = attempts
+                        return
+                    self._dead_letter(segment)
+                    continue
+                self._attempts.pop(segment, None)
+                self._last_flush_ms = round((time.perf_counter() - started) * 1000, 1)
+                self._flushed += len(events)
+                self._batches += 1
+                try:
+                    os.remove(segment)
+                except FileNotFoundError:
+                    pass  # Replayed and removed by another process at the same time
+
+    def _dead_letter(self, segment):
+        """Set aside a segment that keeps failing so the others can be written"""
+        self._attempts.pop(segment, None)
+        dead = os.path.join(self.directory, 'dead-' + os.path.basename(segment)[len('segment-'):])
+        try:
+            os.replace(segment, dead)
+        except FileNotFoundError:
+            return
+        self._dead_lettered += 1
+        if self.logger:
+            self.logger.error(f"Attendance journal segment moved to {dead} after {self.max_attempts} failed writes")
+    
+    def _retry_interval(self):
+        """Seconds until the next flush, backing off while a segment keeps failing"""
+        attempts = max(list(self._attempts.values()), default=0)
+        return min(self.flush_interval * 2 ** attempts, max(self.max_retry_interval, self.flush_interval))
+    
+    def _read(self, segment):
+        """Events of a segment, skipping a line torn by a crash mid-append"""
+        events = []
+        try:
+            with open(segment, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        if self.logger:
+                            self.logger.warning(f"Skipping torn line in attendance journal {segment}")
+        except FileNotFoundError:
+            return None
+        return events
+
+    @staticmethod
+    def _is_running(path):
+        """Whether the process that owns a journal file is still alive"""
+        try:
+            os.kill(int(os.path.basename(path)[len('journal-'):-len('.log')]), 0)
+        except (ValueError, ProcessLookupError):
+            return False
+        except PermissionError:
+            return True
+        return True
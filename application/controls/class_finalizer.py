@@ -0,0 +1,76 @@
+# application/controls/class_finalizer.py
+import threading
+from datetime import datetime, timedelta
+
+from application.controls.attendance_control import AttendanceControl
+
+
+class ClassFinalizer:
+    """Background thread that finalizes each class once its end time passes.
+
+    It sleeps until the earliest end time (plus ``grace``) of a class not
+    yet completed, capped at ``max_sleep`` seconds so newly scheduled
+    classes are noticed, then calls
+    ``AttendanceControl.finalize_ended_classes``: the class becomes
+    completed and every enrolled student without a record is marked absent.
+    Each process may run one; due classes are locked with SKIP LOCKED, so
+    they are finalized once.
+
+    Classes that ended on or before ``since`` are never touched, so turning
+    the finalizer on does not rewrite the history of past classes.
+    """
+
+    def __init__(self, app, since, grace=timedelta(minutes=10), max_sleep=300, batch=200):
+        self.app = app
+        self.since = since
+        self.grace = grace
+        self.max_sleep = max_sleep
+        self.batch = batch
+        self._stopped = threading.Event()
+        self._thread = None
+        self._finalized = 0
+        self._absent_marked = 0
+        self._last_run = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='class-finalizer', daemon=True)
+        self._thread.start()
+
+    def run_once(self):
+        """Finalize every class due now"""
+        while True:
+            result = AttendanceControl.finalize_ended_classes(
+                self.app, self.since, ended_before=datetime.now() - self.grace, limit=self.batch
+            )
+            self._last_run = datetime.now()
+            if not result['success']:
+                return result
+            self._finalized += len(result['class_ids'])
+            self._absent_marked += result['absent_marked']
+            if result['class_ids']:
+                self.app.logger.info(
+                    f"Finalized {len(result['class_ids'])} classes, {result['absent_marked']} students marked absent"
+                )
+            if len(result['class_ids']) < self.batch:
+                return result
+
+    def shutdown(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        return {
+            'finalized': self._finalized,
+            'absent_marked': self._absent_marked,
+            'last_run': self._last_run.isoformat() if self._last_run else None
+        }
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.run_once()
+            next_end = AttendanceControl.get_next_class_end(self.app, self.since)
+            delay = self.max_sleep
+            if next_end is not None:
+                delay = min(delay, max((next_end + self.grace - datetime.now()).total_seconds(), 1))
+            self._stopped.wait(delay)
@@ -0,0 +1,61 @@
+# application/controls/enrolment_cache.py
+import threading
+import time
+from collections import OrderedDict
+
+
+class EnrolmentCache:
+    """Enrolled student ids per class, for checks that cannot afford a query each.
+
+    A class's roster is loaded with ``loader(class_id)`` on first use and
+    kept for ``ttl`` seconds, at most ``max_entries`` classes, least
+    recently used first out. A student missing from a cached roster causes
+    one reload before the answer is no, so a student enrolled since the
+    roster was loaded is still accepted.
+    """
+
+    def __init__(self, loader, ttl=300.0, max_entries=1024):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._rosters = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._loads = 0
+
+    def is_enrolled(self, class_id, student_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._rosters.get(class_id)
+            if entry is not None and entry[1] > now and student_id in entry[0]:
+                self._rosters.move_to_end(class_id)
+                self._hits += 1
+                return True
+        return student_id in self._load(class_id)
+
+    def invalidate(self, class_id=None):
+        """Drop one class's roster, or every roster"""
+        with self._lock:
+            if class_id is None:
+                self._rosters.clear()
+            else:
+                self._rosters.pop(class_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'classes': len(self._rosters),
+                'max_entries': self.max_entries,
+                'hits': self._hits,
+                'loads': self._loads
+            }
+
+    def _load(self, class_id):
+        roster = frozenset(self.loader(class_id))
+        with self._lock:
+            self._rosters[class_id] = (roster, time.monotonic() + self.ttl)
+            self._rosters.move_to_end(class_id)
+            while len(self._rosters) > self.max_entries:
+                self._rosters.popitem(last=False)
+            self._loads += 1
+        return roster
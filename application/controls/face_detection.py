@@ -0,0 +1,250 @@
+# application/controls/face_detection.py
+import argparse
+import os
+from abc import ABC, abstractmethod
+import time
+
+import cv2
+import numpy as np
+
+# Model files looked up in FACIAL_DATA_DIR unless a path is configured
+HAAR_CASCADE_FILE = 'haarcascade_frontalface_default.xml'
+LBP_CASCADE_FILE = 'lbpcascade_frontalface_improved.xml'
+DNN_MODEL_FILE = 'res10_300x300_ssd_iter_140000.caffemodel'
+DNN_CONFIG_FILE = 'deploy.prototxt'
+
+# Where LBP_CASCADE_FILE can be downloaded; pip builds of OpenCV only ship Haar cascades
+LBP_CASCADE_URL = ('https://github.com/opencv/opencv/raw/4.x/data/lbpcascades/'
+                   'lbpcascade_frontalface_improved.xml')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+# imdecode flags that decode straight to a 1/n size grayscale image
+REDUCED_GRAYSCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+# The same for detectors that need colour
+REDUCED_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+class FaceDetector(ABC):
+    """Finds face boxes in a decoded frame.
+
+    ``detect`` takes a grayscale or BGR image, as given by ``color``, and
+    returns an (n, 4) int array of x, y, w, h boxes in that image's pixels,
+    ignoring faces smaller than ``min_size`` pixels on a side.
+    """
+
+    name = None
+    # Whether detect() wants a BGR frame; grayscale otherwise
+    color = False
+
+    @abstractmethod
+    def detect(self, image, min_size=1):
+        pass
+
+
+class CascadeDetector(FaceDetector):
+    """OpenCV cascade classifier: Haar (the original detector) or LBP.
+
+    LBP cascades use integer features and are usually several times faster
+    than Haar, at some cost in recall on poorly lit or rotated faces.
+    """
+
+    def __init__(self, path, scale_factor=1.3, min_neighbors=5, name='haar'):
+        self.name = name
+        self.cascade = cv2.CascadeClassifier(path)
+        if self.cascade.empty():
+            raise FileNotFoundError(f"Cascade file not found or invalid: {path}")
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+
+    def detect(self, image, min_size=1):
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        faces = self.cascade.detectMultiScale(
+            image, self.scale_factor, self.min_neighbors, minSize=(min_size, min_size)
+        )
+        return np.asarray(faces, dtype=int).reshape(-1, 4)
+
+
+class DNNDetector(FaceDetector):
+    """OpenCV DNN single-shot face detector loaded from a local model file.
+
+    Expects an SSD-style network whose output rows are (image, class,
+    confidence, x1, y1, x2, y2) with relative coordinates, such as OpenCV's
+    res10 300x300 Caffe model or its TensorFlow export. The frame is resized
+    to ``input_size`` before inference, so cost does not depend on the
+    upload size.
+    """
+
+    name = 'dnn'
+    color = True
+
+    def __init__(self, model_path, config_path=None, confidence=0.5, input_size=300,
+                 mean=(104.0, 177.0, 123.0)):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"DNN face model not found: {model_path}")
+        self.net = cv2.dnn.readNet(model_path, config_path or '')
+        self.confidence = confidence
+        self.input_size = input_size
+        self.mean = mean
+
+    def detect(self, image, min_size=1):
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        height, width = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(
+            image, 1.0, (self.input_size, self.input_size), self.mean, swapRB=False, crop=False
+        )
+        self.net.setInput(blob)
+        detections = self.net.forward().reshape(-1, 7)
+        detections = detections[detections[:, 2] >= self.confidence]
+
+        corners = np.clip(detections[:, 3:7], 0, 1) * np.array([width, height, width, height])
+        boxes = np.rint(corners).astype(int)
+        boxes[:, 2:] -= boxes[:, :2]
+        keep = (boxes[:, 2] >= min_size) & (boxes[:, 3] >= min_size)
+        return boxes[keep]
+
+
+DETECTORS = {
+    'haar': CascadeDetector,
+    'lbp': CascadeDetector,
+    'dnn': DNNDetector,
+}
+
+
+def make_detector(name, data_dir, model_path=None, config_path=None, scale_factor=1.3,
+                  min_neighbors=5, confidence=0.5):
+    """Build a face detector by name (see DETECTORS).
+
+    Model files default to the standard file names in ``data_dir``;
+    ``model_path`` and ``config_path`` override them.
+    """
+    if name not in DETECTORS:
+        raise ValueError(f"Unknown face detector: {name}")
+    if name == 'dnn':
+        return DNNDetector(
+            model_path or os.path.join(data_dir, DNN_MODEL_FILE),
+            config_path or os.path.join(data_dir, DNN_CONFIG_FILE),
+            confidence=confidence
+        )
+    default_file = HAAR_CASCADE_FILE if name == 'haar' else LBP_CASCADE_FILE
+    return CascadeDetector(
+        model_path or find_cascade(default_file, data_dir),
+        scale_factor=scale_factor, min_neighbors=min_neighbors, name=name
+    )
+
+
+def find_cascade(file_name, data_dir):
+    """Path of a cascade file in ``data_dir``, else in OpenCV's own data.
+
+    Raises:
+        FileNotFoundError: if neither has it
+    """
+    candidates = [os.path.join(data_dir, file_name)]
+    cv2_data = getattr(getattr(cv2, 'data', None), 'haarcascades', None)
+    if cv2_data:
+        candidates.append(os.path.join(cv2_data, file_name))
+        # Source builds install LBP cascades next to the Haar ones
+        candidates.append(os.path.join(os.path.dirname(os.path.normpath(cv2_data)), 'lbpcascades', file_name))
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    hint = f" Download it from {LBP_CASCADE_URL}." if file_name == LBP_CASCADE_FILE else ''
+    raise FileNotFoundError(
+        f"Cascade file {file_name} not found in {data_dir} or OpenCV's data directory.{hint}"
+    )
+
+
+def detection_report(images, detectors, reduction=1, min_face=48):
+    """Throughput and miss rate of each detector over the same decoded images.
+
+    Every image is expected to show at least one face; an image where a
+    detector finds none counts as a miss. Images are decoded once up front
+    at 1/``reduction`` size so only detection is timed.
+
+    Args:
+        images: list of encoded image buffers
+        detectors: list of FaceDetector
+        reduction: 1, 2, 4 or 8, as FACIAL_DETECT_REDUCTION
+        min_face: smallest face in full-resolution pixels
+
+    Returns:
+        List of dicts with name, images, detections, miss_rate, mean_ms,
+        images_per_second and detections_per_second
+    """
+    gray_flag = REDUCED_GRAYSCALE_FLAGS[reduction]
+    color_flag = REDUCED_COLOR_FLAGS[reduction]
+    decoded = {}
+    for color in {detector.color for detector in detectors}:
+        frames = [cv2.imdecode(np.frombuffer(data, np.uint8), color_flag if color else gray_flag)
+                  for data in images]
+        decoded[color] = [frame for frame in frames if frame is not None]
+    min_size = max(1, round(min_face / reduction))
+
+    report = []
+    for detector in detectors:
+        frames = decoded[detector.color]
+        detections, misses = 0, 0
+        started = time.perf_counter()
+        for frame in frames:
+            found = len(detector.detect(frame, min_size))
+            detections += found
+            misses += found == 0
+        elapsed = time.perf_counter() - started
+        report.append({
+            'name': detector.name,
+            'images': len(frames),
+            'detections': detections,
+            'miss_rate': round(misses / max(len(frames), 1), 4),
+            'mean_ms': round(elapsed * 1000 / max(len(frames), 1), 3),
+            'images_per_second': round(len(frames) / max(elapsed, 1e-9), 1),
+            'detections_per_second': round(detections / max(elapsed, 1e-9), 1)
+        })
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare face detectors on a folder of images that each contain a face'
+    )
+    parser.add_argument('image_dir')
+    parser.add_argument('--data-dir', default='./AttendanceAI/data/',
+                        help='Directory holding the cascade and DNN model files')
+    parser.add_argument('--detectors', default='haar,lbp,dnn')
+    parser.add_argument('--reduction', type=int, default=2, choices=(1, 2, 4, 8))
+    parser.add_argument('--min-face', type=int, default=48)
+    args = parser.parse_args()
+
+    names = sorted(os.listdir(args.image_dir))
+    images = []
+    for file_name in names:
+        if file_name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(args.image_dir, file_name), 'rb') as f:
+                images.append(f.read())
+    if not images:
+        parser.error(f'no images found in {args.image_dir}')
+
+    detectors = []
+    for name in args.detectors.split(','):
+        try:
+            detectors.append(make_detector(name.strip(), args.data_dir))
+        except (FileNotFoundError, ValueError, cv2.error) as e:
+            print(f"skipping {name}: {e}")
+
+    print(f"{len(images)} images at 1/{args.reduction} size, min face {args.min_face}px")
+    print(f"{'detector':<10}{'mean ms':>10}{'images/s':>10}{'dets/s':>10}{'dets':>8}{'miss rate':>11}")
+    for row in detection_report(images, detectors, args.reduction, args.min_face):
+        print(f"{row['name']:<10}{row['mean_ms']:>10}{row['images_per_second']:>10}"
+              f"{row['detections_per_second']:>10}{row['detections']:>8}{row['miss_rate']:>11.1%}")
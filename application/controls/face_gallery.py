@@ -0,0 +1,632 @@
+# application/controls/face_gallery.py
+import argparse
+import json
+import os
+import pickle
+import re
+import shutil
+import struct
+import threading
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialised within one process
+    fcntl = None
+
+GALLERY_FORMAT_VERSION = 1
+
+# Compacted gallery as loaded from disk.
+#   faces: (n, dim) uint8 matrix, memory-mapped read-only
+#   names: unique label strings; codes: per-row index into names
+#   user_ids: per-row int32 user id (-1 when unknown)
+#   sq_norms: per-row squared L2 norms, so the index never has to scan faces
+#   radii: per-label acceptance radius after prototype compaction, or None
+Gallery = namedtuple('Gallery', ['faces', 'names', 'codes', 'user_ids', 'sq_norms', 'radii'],
+                     defaults=(None,))
+
+_LEGACY_ID_PATTERN = re.compile(r'\(ID:\s*(\d+)\)')
+
+
+def user_id_from_label(label):
+    """Extract the user id from a legacy "Name (ID: 123)" label, or -1"""
+    match = _LEGACY_ID_PATTERN.search(str(label))
+    return int(match.group(1)) if match else -1
+
+
+# facial_data.face_encoding layout: magic, sample count, dim, then the
+# zlib-compressed (count, dim) uint8 sample matrix. AFD2 blobs hold
+# prototypes and add the student's acceptance radius to the header.
+_ENCODING_MAGIC = b'AFD1'
+_ENCODING_HEADER = struct.Struct('<4sII')
+_PROTOTYPE_MAGIC = b'AFD2'
+_PROTOTYPE_HEADER = struct.Struct('<4sIId')
+
+
+def encode_face_samples(samples, radius=None):
+    """Pack one student's (count, dim) uint8 samples into a compressed blob"""
+    samples = np.ascontiguousarray(samples, dtype=np.uint8)
+    if samples.ndim == 1:
+        samples = samples.reshape(1, -1)
+    if radius is None:
+        header = _ENCODING_HEADER.pack(_ENCODING_MAGIC, samples.shape[0], samples.shape[1])
+    else:
+        header = _PROTOTYPE_HEADER.pack(_PROTOTYPE_MAGIC, samples.shape[0], samples.shape[1], radius)
+    return header + zlib.compress(samples.tobytes(), 6)
+
+
+def _unpack_encoding_header(blob):
+    magic = bytes(blob[:4])
+    if magic == _ENCODING_MAGIC:
+        _, count, dim = _ENCODING_HEADER.unpack_from(blob)
+        return count, dim, None, _ENCODING_HEADER.size
+    if magic == _PROTOTYPE_MAGIC:
+        _, count, dim, radius = _PROTOTYPE_HEADER.unpack_from(blob)
+        return count, dim, radius, _PROTOTYPE_HEADER.size
+    raise ValueError("Unrecognised face encoding")
+
+
+def decode_face_samples(blob, dim=None):
+    """Unpack a blob written by encode_face_samples into a (count, dim) uint8 array"""
+    count, blob_dim, _, header_size = _unpack_encoding_header(blob)
+    if dim is not None and blob_dim != dim:
+        raise ValueError(f"Face encoding dim {blob_dim} does not match expected {dim}")
+    raw = zlib.decompress(memoryview(blob)[header_size:])
+    return np.frombuffer(raw, dtype=np.uint8).reshape(count, blob_dim)
+
+
+def decode_face_radius(blob):
+    """Acceptance radius stored in a prototype blob, or None for plain samples"""
+    return _unpack_encoding_header(blob)[2]
+
+
+def row_sq_norms(rows):
+    rows = np.asarray(rows, dtype=np.float64)
+    return np.einsum('ij,ij->i', rows, rows)
+
+
+class FaceGalleryStore:
+    """Append-only, memory-mappable on-disk store for the face gallery.
+
+    Format version 1 keeps the compacted gallery as three files:
+
+    - ``gallery_v1.npy``: the (n, dim) uint8 face matrix, opened with
+      ``np.load(mmap_mode='r')`` so every worker process shares one
+      page-cache copy and cold start does not read the matrix at all
+    - ``gallery_v1_labels.npz``: label names, per-row label codes, per-row
+      user ids and per-row squared norms
+    - ``gallery.json``: manifest with the format version, dim and row count
+
+    New samples are appended to a raw segment file (one fixed-size uint8 row
+    per sample) with a matching JSON line, so enrolling a face never rewrites
+    the whole gallery. Once the segment grows past ``compact_threshold`` rows
+    it is folded into a new version-1 file set on a background thread.
+
+    Appends, compaction and segment repair hold an exclusive ``flock`` on
+    ``gallery.lock`` as well as a thread lock, so worker processes sharing
+    ``data_dir`` never interleave a row with another's label or fold the
+    segments from a stale base.
+    """
+
+    MANIFEST_FILE = 'gallery.json'
+    LOCK_FILE = 'gallery.lock'
+    MATRIX_FILE = 'gallery_v1.npy'
+    SIDECAR_FILE = 'gallery_v1_labels.npz'
+    LEGACY_FACES_FILE = 'faces_data.pkl'
+    LEGACY_NAMES_FILE = 'names.pkl'
+    FACES_SEGMENT = 'faces_segment.bin'
+    NAMES_SEGMENT = 'names_segment.jsonl'
+    COMPACTING_SUFFIX = '.compacting'
+    EMBEDDINGS_FILE = 'gallery_v1_pca.npy'
+    EMBEDDINGS_SIDECAR_FILE = 'gallery_v1_pca_rows.npz'
+    FULL_MATRIX_FILE = 'gallery_v1_full.npy'
+    FULL_SIDECAR_FILE = 'gallery_v1_full_labels.npz'
+
+    def __init__(self, data_dir, dim=50 * 50 * 3, compact_threshold=500, logger=None):
+        self.data_dir = data_dir
+        self.dim = dim
+        self.compact_threshold = compact_threshold
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        self._compaction_thread = None
+
+    def _path(self, name):
+        return os.path.join(self.data_dir, name)
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold the store's thread lock and its cross-process file lock"""
+        os.makedirs(self.data_dir, exist_ok=True)
+        with self._lock, open(self._path(self.LOCK_FILE), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def exists(self):
+        return os.path.exists(self._path(self.MANIFEST_FILE))
+
+    def has_legacy_pickles(self):
+        return (os.path.exists(self._path(self.LEGACY_FACES_FILE)) and
+                os.path.exists(self._path(self.LEGACY_NAMES_FILE)))
+
+    def load(self):
+        """Load the compacted gallery and the samples still waiting in segments.
+
+        Returns:
+            Tuple of (Gallery, pending faces array, pending labels list,
+            pending user ids list)
+        """
+        with self._exclusive():
+            self._repair_segment()
+            base = self._load_compacted()
+
+            faces, labels, user_ids = [], [], []
+            # A segment left behind by an interrupted compaction is replayed first
+            for suffix in (self.COMPACTING_SUFFIX, ''):
+                seg_faces, seg_labels, seg_ids = self._read_segment(suffix)
+                faces.append(seg_faces)
+                labels.extend(seg_labels)
+                user_ids.extend(seg_ids)
+        return base, np.concatenate(faces, axis=0), labels, user_ids
+
+    def append(self, sample, label, user_id=None):
+        """Durably append one flattened sample and its label to the segment"""
+        row = np.ascontiguousarray(sample, dtype=np.uint8).reshape(self.dim)
+        record = {'label': label, 'user_id': int(user_id) if user_id is not None else -1}
+
+        with self._exclusive():
+            # Label goes last so a torn write never leaves a label without its row
+            with open(self._path(self.FACES_SEGMENT), 'ab') as f:
+                f.write(row.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._path(self.NAMES_SEGMENT), 'a', encoding='utf-8') as w:
+                w.write(json.dumps(record) + '\n')
+                w.flush()
+                os.fsync(w.fileno())
+            # Counted from the file, which every worker appends to
+            segment_rows = os.path.getsize(self._path(self.FACES_SEGMENT)) // self.dim
+            should_compact = segment_rows >= self.compact_threshold
+
+        if should_compact:
+            self.compact_async()
+
+    def compact_async(self):
+        """Fold the segment into the compacted gallery on a background thread"""
+        with self._compaction_lock:
+            if self._compaction_thread and self._compaction_thread.is_alive():
+                return
+            self._compaction_thread = threading.Thread(
+                target=self._compact_logged, name='face-gallery-compaction', daemon=True
+            )
+            self._compaction_thread.start()
+
+    def compact(self):
+        """Merge all appended segments into a new version-1 file set"""
+        with self._exclusive():
+            return self._compact()
+
+    def _compact(self):
+        # Rotate the live segment; a leftover rotated segment is folded first
+        names = (self.FACES_SEGMENT, self.NAMES_SEGMENT)
+        if not any(os.path.exists(self._path(n + self.COMPACTING_SUFFIX)) for n in names):
+            for name in names:
+                if os.path.exists(self._path(name)):
+                    os.replace(self._path(name), self._path(name + self.COMPACTING_SUFFIX))
+
+        base = self._load_compacted()
+        seg_faces, seg_labels, seg_ids = self._read_segment(self.COMPACTING_SUFFIX)
+        labels = [base.names[code] for code in base.codes] + seg_labels
+        user_ids = np.concatenate([base.user_ids, np.asarray(seg_ids, dtype=np.int32)])
+        self.write(np.concatenate([base.faces, seg_faces], axis=0), labels, user_ids, base.radii)
+
+        for name in (self.FACES_SEGMENT, self.NAMES_SEGMENT):
+            rotated = self._path(name + self.COMPACTING_SUFFIX)
+            if os.path.exists(rotated):
+                os.remove(rotated)
+
+        return len(labels)
+
+    def compact_prototypes(self, max_prototypes=5):
+        """Replace every label's samples with a few prototypes and an acceptance radius.
+
+        Pending segments are folded in first. The full gallery is kept as
+        gallery_v1_full.npy / gallery_v1_full_labels.npz so the compaction can
+        be undone or re-run with different settings.
+
+        Returns:
+            Tuple of (full faces, full labels, prototype faces, prototype labels)
+        """
+        from application.controls.face_prototypes import compact_to_prototypes
+
+        with self._exclusive():
+            self._compact()
+            base = self._load_compacted()
+            labels = [base.names[code] for code in base.codes]
+            faces = np.asarray(base.faces)
+            proto_faces, proto_labels, proto_user_ids, radii = compact_to_prototypes(
+                faces, labels, base.user_ids, max_prototypes, base.radii
+            )
+
+            for source, archive in ((self.MATRIX_FILE, self.FULL_MATRIX_FILE),
+                                    (self.SIDECAR_FILE, self.FULL_SIDECAR_FILE)):
+                shutil.copyfile(self._path(source), self._path(archive + '.tmp'))
+                os.replace(self._path(archive + '.tmp'), self._path(archive))
+            self.write(proto_faces, proto_labels, proto_user_ids, radii)
+        return faces, labels, proto_faces, proto_labels
+
+    def write(self, faces, labels, user_ids=None, radii=None):
+        """Write a complete version-1 file set, replacing any existing one.
+
+        Each file is written under a temporary name and renamed into place, so
+        processes that still have the old matrix mapped keep reading it.
+        ``radii`` maps labels to acceptance radii after prototype compaction.
+        """
+        faces = np.asarray(faces, dtype=np.uint8).reshape(-1, self.dim)
+        if user_ids is None:
+            user_ids = [user_id_from_label(label) for label in labels]
+        names, codes = np.unique(np.asarray(labels, dtype=str), return_inverse=True)
+        os.makedirs(self.data_dir, exist_ok=True)
+
+        matrix_path = self._path(self.MATRIX_FILE)
+        matrix = np.lib.format.open_memmap(matrix_path + '.tmp.npy', mode='w+',
+                                           dtype=np.uint8, shape=faces.shape)
+        matrix[:] = faces
+        matrix.flush()
+        del matrix
+        os.replace(matrix_path + '.tmp.npy', matrix_path)
+
+        sidecar_path = self._path(self.SIDECAR_FILE)
+        with open(sidecar_path + '.tmp', 'wb') as f:
+            arrays = {}
+            if radii:
+                arrays['radii'] = np.array([radii.get(str(name), np.nan) for name in names], dtype=np.float64)
+            np.savez(f, names=names, codes=codes.astype(np.int32),
+                     user_ids=np.asarray(user_ids, dtype=np.int32),
+                     sq_norms=row_sq_norms(faces), **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(sidecar_path + '.tmp', sidecar_path)
+
+        manifest = {
+            'format_version': GALLERY_FORMAT_VERSION,
+            'dim': self.dim,
+            'dtype': 'uint8',
+            'count': len(faces),
+            'matrix': self.MATRIX_FILE,
+            'sidecar': self.SIDECAR_FILE,
+        }
+        manifest_path = self._path(self.MANIFEST_FILE)
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+    def convert_legacy(self):
+        """One-shot conversion of names.pkl / faces_data.pkl into format version 1.
+
+        The pickles are left in place. Segments appended before the conversion
+        are folded in and removed.
+        """
+        with open(self._path(self.LEGACY_NAMES_FILE), 'rb') as w:
+            labels = list(pickle.load(w))
+        with open(self._path(self.LEGACY_FACES_FILE), 'rb') as f:
+            faces = np.asarray(pickle.load(f), dtype=np.uint8).reshape(-1, self.dim)
+
+        # Fix mismatch
+        min_samples = min(len(faces), len(labels))
+        faces, labels = [faces[:min_samples]], labels[:min_samples]
+        user_ids = [user_id_from_label(label) for label in labels]
+
+        with self._exclusive():
+            self._repair_segment()
+            for suffix in (self.COMPACTING_SUFFIX, ''):
+                seg_faces, seg_labels, seg_ids = self._read_segment(suffix)
+                faces.append(seg_faces)
+                labels.extend(seg_labels)
+                user_ids.extend(seg_ids)
+
+            self.write(np.concatenate(faces, axis=0), labels, user_ids)
+            for name in (self.FACES_SEGMENT, self.NAMES_SEGMENT):
+                for suffix in (self.COMPACTING_SUFFIX, ''):
+                    if os.path.exists(self._path(name + suffix)):
+                        os.remove(self._path(name + suffix))
+        return len(labels)
+
+    def load_embeddings(self, projection, gallery):
+        """Projected rows of the compacted gallery, memory-mapped from a cache file.
+
+        Compaction only ever appends rows, so a cache written for an earlier
+        gallery is reused for its prefix and only the new rows are projected.
+        The cache is tied to the projection's fingerprint and checked against
+        the raw rows' squared norms, so a refit or rewritten gallery is
+        projected again from scratch.
+        """
+        count = len(gallery.faces)
+        if count == 0:
+            return np.empty((0, projection.dims), dtype=np.float32)
+
+        matrix_path = self._path(self.EMBEDDINGS_FILE)
+        sidecar_path = self._path(self.EMBEDDINGS_SIDECAR_FILE)
+        cached, reused = None, 0
+        if os.path.exists(matrix_path) and os.path.exists(sidecar_path):
+            with np.load(sidecar_path) as sidecar:
+                fingerprint = str(sidecar['fingerprint'])
+                source_sq_norms = sidecar['source_sq_norms']
+            cached = np.load(matrix_path, mmap_mode='r')
+            rows = min(len(cached), len(source_sq_norms))
+            if (fingerprint == projection.fingerprint and cached.shape[1] == projection.dims
+                    and rows <= count and np.array_equal(source_sq_norms[:rows], gallery.sq_norms[:rows])):
+                reused = rows
+        if reused == count:
+            return cached[:count]
+
+        # Temporary names are per process so concurrent workers do not collide
+        tmp_suffix = f'.{os.getpid()}.tmp'
+        matrix = np.lib.format.open_memmap(matrix_path + tmp_suffix + '.npy', mode='w+',
+                                           dtype=np.float32, shape=(count, projection.dims))
+        if reused:
+            matrix[:reused] = cached[:reused]
+        matrix[reused:] = projection.transform(gallery.faces[reused:])
+        matrix.flush()
+        del matrix, cached
+        os.replace(matrix_path + tmp_suffix + '.npy', matrix_path)
+
+        with open(sidecar_path + tmp_suffix, 'wb') as f:
+            np.savez(f, fingerprint=projection.fingerprint, source_sq_norms=gallery.sq_norms[:count])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(sidecar_path + tmp_suffix, sidecar_path)
+
+        if self.logger:
+            self.logger.info(f"Projected {count - reused} gallery samples ({reused} reused from cache)")
+        return np.load(matrix_path, mmap_mode='r')
+
+    def _load_compacted(self):
+        if not self.exists():
+            return Gallery(
+                faces=np.empty((0, self.dim), dtype=np.uint8),
+                names=[],
+                codes=np.empty(0, dtype=np.int32),
+                user_ids=np.empty(0, dtype=np.int32),
+                sq_norms=np.empty(0, dtype=np.float64),
+            )
+
+        with open(self._path(self.MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('format_version') != GALLERY_FORMAT_VERSION:
+            raise ValueError(f"Unsupported gallery format version: {manifest.get('format_version')}")
+        if manifest.get('dim') != self.dim:
+            raise ValueError(f"Gallery dim {manifest.get('dim')} does not match expected {self.dim}")
+
+        faces = np.load(self._path(manifest['matrix']), mmap_mode='r')
+        with np.load(self._path(manifest['sidecar'])) as sidecar:
+            names = sidecar['names'].tolist()
+            codes = sidecar['codes']
+            user_ids = sidecar['user_ids']
+            sq_norms = sidecar['sq_norms']
+            radii = None
+            if 'radii' in sidecar.files:
+                radii = {name: float(radius) for name, radius in zip(names, sidecar['radii'])
+                         if not np.isnan(radius)}
+
+        # Fix mismatch (e.g. a crash between renaming the matrix and the sidecar)
+        min_samples = min(len(faces), len(codes))
+        return Gallery(faces[:min_samples], names, codes[:min_samples],
+                       user_ids[:min_samples], sq_norms[:min_samples], radii)
+
+    def _compact_logged(self):
+        try:
+            total = self.compact()
+            if self.logger:
+                self.logger.info(f"Face gallery compacted ({total} samples)")
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Face gallery compaction failed: {e}")
+
+    def _read_segment(self, suffix=''):
+        faces_path = self._path(self.FACES_SEGMENT + suffix)
+        names_path = self._path(self.NAMES_SEGMENT + suffix)
+        if not (os.path.exists(faces_path) and os.path.exists(names_path)):
+            return np.empty((0, self.dim), dtype=np.uint8), [], []
+
+        labels, user_ids = [], []
+        with open(names_path, 'r', encoding='utf-8') as w:
+            for line in w:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # Torn trailing write
+                if isinstance(record, dict):
+                    labels.append(record['label'])
+                    user_ids.append(record.get('user_id', -1))
+                else:
+                    # Bare label lines written before user ids were recorded
+                    labels.append(record)
+                    user_ids.append(user_id_from_label(record))
+        faces = np.fromfile(faces_path, dtype=np.uint8)
+        faces = faces[:len(faces) // self.dim * self.dim].reshape(-1, self.dim)
+
+        min_samples = min(len(faces), len(labels))
+        return faces[:min_samples], labels[:min_samples], user_ids[:min_samples]
+
+    def _repair_segment(self):
+        """Trim a torn trailing write so later appends stay row-aligned"""
+        faces, labels, user_ids = self._read_segment()
+        faces_path = self._path(self.FACES_SEGMENT)
+        names_path = self._path(self.NAMES_SEGMENT)
+        if not (os.path.exists(faces_path) and os.path.exists(names_path)):
+            return
+
+        if os.path.getsize(faces_path) != len(faces) * self.dim:
+            os.truncate(faces_path, len(faces) * self.dim)
+        with open(names_path, 'r', encoding='utf-8') as w:
+            line_count = sum(1 for _ in w)
+        if line_count != len(labels):
+            with open(names_path, 'w', encoding='utf-8') as w:
+                w.writelines(json.dumps({'label': label, 'user_id': user_id}) + '\n'
+                             for label, user_id in zip(labels, user_ids))
+
+
+def push_to_database(store):
+    """Copy a file gallery into facial_data, one compressed row per user id.
+
+    Samples without a known user id are skipped. Existing rows for the same
+    users are replaced.
+    """
+    from database.base import get_session
+    from application.entities2.facial_data import FacialDataModel
+
+    gallery, pending_faces, pending_labels, pending_user_ids = store.load()
+    faces = np.concatenate([np.asarray(gallery.faces), pending_faces], axis=0)
+    labels = [gallery.names[code] for code in gallery.codes] + pending_labels
+    user_ids = np.concatenate([gallery.user_ids, np.asarray(pending_user_ids, dtype=np.int32)])
+    radii = gallery.radii or {}
+
+    pushed = 0
+    with get_session() as db_session:
+        facial_data_model = FacialDataModel(db_session)
+        for user_id in np.unique(user_ids[user_ids >= 0]):
+            rows = np.flatnonzero(user_ids == user_id)
+            samples = faces[rows]
+            radius = radii.get(labels[rows[0]])
+            facial_data_model.save_encoding(int(user_id), encode_face_samples(samples, radius), len(samples))
+            pushed += 1
+    return pushed
+
+
+def compact_database_prototypes(max_prototypes=5):
+    """Reduce every facial_data row to prototypes, storing the radius in the blob.
+
+    Returns:
+        Tuple of (users compacted, samples before, samples after)
+    """
+    from database.base import get_session
+    from application.entities2.facial_data import FacialDataModel
+    from application.controls.face_prototypes import select_prototypes
+
+    users = before = after = 0
+    with get_session() as db_session:
+        facial_data_model = FacialDataModel(db_session)
+        rows = [(user_id, face_encoding) for user_id, _, face_encoding, _
+                in facial_data_model.stream_active_encodings()]
+        for user_id, face_encoding in rows:
+            samples = decode_face_samples(face_encoding)
+            prototypes, radius = select_prototypes(samples, max_prototypes)
+            known = [r for r in (radius, decode_face_radius(face_encoding)) if r is not None]
+            radius = max(known) if known else None
+            facial_data_model.save_encoding(user_id, encode_face_samples(prototypes, radius), len(prototypes))
+            users += 1
+            before += len(samples)
+            after += len(prototypes)
+    return users, before, after
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Face gallery maintenance')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert_parser = subparsers.add_parser(
+        'convert', help='Convert names.pkl / faces_data.pkl into the memory-mapped format'
+    )
+    convert_parser.add_argument('data_dir', nargs='?', default='./AttendanceAI/data/')
+    push_parser = subparsers.add_parser(
+        'push-db', help='Copy the file gallery into the facial_data table'
+    )
+    push_parser.add_argument('data_dir', nargs='?', default='./AttendanceAI/data/')
+    pca_parser = subparsers.add_parser(
+        'fit-pca', help='Fit the eigenface projection used when FACIAL_PROJECTION_ENABLED is set'
+    )
+    pca_parser.add_argument('data_dir', nargs='?', default='./AttendanceAI/data/')
+    pca_parser.add_argument('--dims', type=int, default=128)
+    pca_parser.add_argument('--max-samples', type=int, default=5000)
+    proto_parser = subparsers.add_parser(
+        'compact-prototypes', help='Reduce each student to a few prototype samples and an acceptance radius'
+    )
+    proto_parser.add_argument('data_dir', nargs='?', default='./AttendanceAI/data/')
+    proto_parser.add_argument('--prototypes', type=int, default=5)
+    proto_parser.add_argument('--database', action='store_true',
+                              help='Compact the facial_data table instead of the file gallery')
+    bench_parser = subparsers.add_parser(
+        'benchmark-index', help='Recall-vs-latency report for each FACIAL_INDEX_BACKEND'
+    )
+    bench_parser.add_argument('data_dir', nargs='?', default='./AttendanceAI/data/')
+    bench_parser.add_argument('--queries', type=int, default=200)
+    bench_parser.add_argument('--k', type=int, default=5)
+    bench_parser.add_argument('--projected', action='store_true',
+                              help='Benchmark in the fitted eigenface space instead of raw pixels')
+    bench_parser.add_argument('--grow-to', type=int, default=0,
+                              help='Pad the gallery with jittered copies to simulate a larger one')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        store = FaceGalleryStore(args.data_dir)
+        total = store.convert_legacy()
+        print(f"Wrote {store.MATRIX_FILE} and {store.SIDECAR_FILE} ({total} samples) to {args.data_dir}")
+    elif args.command == 'push-db':
+        pushed = push_to_database(FaceGalleryStore(args.data_dir))
+        print(f"Saved face encodings for {pushed} users to facial_data")
+    elif args.command == 'fit-pca':
+        from application.controls.face_projection import PROJECTION_FILE, PCAProjection
+
+        store = FaceGalleryStore(args.data_dir)
+        gallery, pending_faces, _, _ = store.load()
+        faces = np.concatenate([np.asarray(gallery.faces), pending_faces], axis=0)
+        projection = PCAProjection.fit(faces, dims=args.dims, max_samples=args.max_samples)
+        projection.save(os.path.join(args.data_dir, PROJECTION_FILE))
+        print(f"Wrote {PROJECTION_FILE}: {projection.dims} components fitted on "
+              f"{min(len(faces), args.max_samples)} of {len(faces)} samples, "
+              f"{projection.explained_variance_ratio.sum():.1%} of variance retained, "
+              f"{store.dim} -> {projection.dims * 4} bytes per sample")
+    elif args.command == 'compact-prototypes':
+        if args.database:
+            users, before, after = compact_database_prototypes(args.prototypes)
+            print(f"Compacted {users} users in facial_data: {before} -> {after} samples")
+        else:
+            from application.controls.face_prototypes import compaction_report
+
+            store = FaceGalleryStore(args.data_dir)
+            faces, labels, proto_faces, proto_labels = store.compact_prototypes(args.prototypes)
+            report = compaction_report(faces, labels, proto_faces, proto_labels)
+            full, compact = report['full'], report['prototypes']
+            print(f"Wrote {store.MATRIX_FILE} ({compact['samples']} prototypes from {full['samples']} samples); "
+                  f"full gallery kept as {store.FULL_MATRIX_FILE}")
+            print(f"memory: {full['bytes'] / 2**20:.1f} MB -> {compact['bytes'] / 2**20:.2f} MB "
+                  f"({report['memory_reduction']}x smaller)")
+            print(f"query:  {full['mean_ms']} ms -> {compact['mean_ms']} ms ({report['speedup']}x faster)")
+            print(f"label agreement with the full gallery: {report['agreement']:.1%}")
+    elif args.command == 'benchmark-index':
+        from application.controls.face_index import index_report
+        from application.controls.face_projection import load_projection
+
+        store = FaceGalleryStore(args.data_dir)
+        gallery, pending_faces, _, _ = store.load()
+        faces = np.concatenate([np.asarray(gallery.faces), pending_faces], axis=0)
+        rng = np.random.default_rng(0)
+        if args.grow_to > len(faces):
+            extra = faces[rng.integers(0, len(faces), args.grow_to - len(faces))].astype(np.int16)
+            extra += rng.integers(-12, 13, extra.shape, dtype=np.int16)
+            faces = np.concatenate([faces, np.clip(extra, 0, 255).astype(np.uint8)])
+        queries = faces[rng.integers(0, len(faces), args.queries)].astype(np.int16)
+        queries = np.clip(queries + rng.integers(-8, 9, queries.shape, dtype=np.int16), 0, 255).astype(np.uint8)
+        if args.projected:
+            projection = load_projection(args.data_dir)
+            if projection is None:
+                parser.error('no projection fitted; run fit-pca first')
+            faces, queries = projection.transform(faces), projection.transform(queries)
+
+        backends = [('brute', 'brute', {}), ('balltree', 'balltree', {})]
+        backends += [(f'ivfpq nprobe={nprobe}', 'ivfpq', {'nprobe': nprobe, 'min_train_size': 0})
+                     for nprobe in (1, 4, 8, 16, 32)]
+        print(f"{len(faces)} samples x {faces.shape[1]} dims, {len(queries)} queries, k={args.k}")
+        print(f"{'backend':<18}{'build s':>10}{'recall':>10}{'mean ms':>10}{'p95 ms':>10}{'MB':>10}")
+        for row in index_report(faces, queries, backends, k=args.k):
+            print(f"{row['label']:<18}{row['build_seconds']:>10}{row['recall']:>10}"
+                  f"{row['mean_ms']:>10}{row['p95_ms']:>10}{row['nbytes'] / 2**20:>10.1f}")
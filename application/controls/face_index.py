@@ -0,0 +1,613 @@
+# application/controls/face_index.py
+import copy
+import threading
+import time
+
+import numpy as np
+
+# Rows upcast per block during a search, bounding the temporary copy
+_SEARCH_BLOCK_ROWS = 1024
+
+
+class BruteForceIndex:
+    """Exact Euclidean nearest-neighbour search over a growable sample matrix.
+
+    The index is a read-only base matrix (typically the memory-mapped
+    gallery, shared between worker processes) followed by a tail buffer that
+    doubles when full, so adding one face costs O(sample) amortised instead
+    of a full refit. Squared row norms are cached alongside so a query only
+    needs one matrix product.
+    """
+
+    def __init__(self, dim, dtype=np.uint8, capacity=1024, base=None, base_sq_norms=None):
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        if base is None:
+            base = np.empty((0, dim), dtype=self.dtype)
+        if base_sq_norms is None:
+            base_sq_norms = self._row_sq_norms(base)
+        self._base = base
+        self._base_sq_norms = np.asarray(base_sq_norms, dtype=np.float64)
+        self._data = np.empty((capacity, dim), dtype=self.dtype)
+        self._sq_norms = np.empty(capacity, dtype=np.float64)
+        self._count = 0
+        self._frozen = False
+
+    def __len__(self):
+        return len(self._base) + self._count
+
+    @property
+    def nbytes(self):
+        """Bytes held privately by this process (a memory-mapped base is shared)"""
+        private = self._base_sq_norms.nbytes + self._data.nbytes + self._sq_norms.nbytes
+        if not isinstance(self._base, np.memmap):
+            private += self._base.nbytes
+        return private
+
+    def prepare(self):
+        """Build any search structures up front (nothing to do for brute force)"""
+
+    def add(self, vectors):
+        """Append samples to the index in place"""
+        if self._frozen:
+            raise ValueError("Index snapshot is read-only")
+        vectors = np.asarray(vectors, dtype=self.dtype).reshape(-1, self.dim)
+        needed = self._count + len(vectors)
+        if needed > len(self._data):
+            self._grow(needed)
+
+        start, end = self._count, needed
+        self._data[start:end] = vectors
+        self._sq_norms[start:end] = self._row_sq_norms(self._data[start:end])
+        self._count = end
+
+    def snapshot(self):
+        """Read-only view of the rows present now.
+
+        The view shares buffers with this index instead of copying them.
+        Later adds only write past the view's row count, or into newly grown
+        buffers, so the view never changes and can be searched without locks.
+        """
+        view = copy.copy(self)
+        view._frozen = True
+        return view
+
+    def take(self, rows):
+        """Return (samples, squared norms) for the given global row numbers"""
+        rows = np.asarray(rows, dtype=np.intp)
+        base_count = len(self._base)
+        in_base = rows < base_count
+        samples = np.empty((len(rows), self.dim), dtype=self.dtype)
+        sq_norms = np.empty(len(rows), dtype=np.float64)
+        samples[in_base] = self._base[rows[in_base]]
+        sq_norms[in_base] = self._base_sq_norms[rows[in_base]]
+        samples[~in_base] = self._data[rows[~in_base] - base_count]
+        sq_norms[~in_base] = self._sq_norms[rows[~in_base] - base_count]
+        return samples, sq_norms
+
+    def search(self, queries, k=5):
+        """Return (distances, indices) of the k nearest samples for each query row"""
+        tail_count = self._count
+        base_count = len(self._base)
+        count = base_count + tail_count
+        if count == 0:
+            raise ValueError("Index is empty")
+        k = min(k, count)
+
+        queries = np.asarray(queries).reshape(-1, self.dim).astype(self._work_dtype)
+        q_sq_norms = self._row_sq_norms(queries)
+
+        # ||q - x||^2 = ||q||^2 - 2 q.x + ||x||^2, filled block by block
+        sq_dist = np.empty((len(queries), count), dtype=np.float64)
+        blocks = ((self._base, 0, base_count), (self._data, base_count, tail_count))
+        for rows, offset, row_count in blocks:
+            for start in range(0, row_count, _SEARCH_BLOCK_ROWS):
+                end = min(start + _SEARCH_BLOCK_ROWS, row_count)
+                block = rows[start:end].astype(self._work_dtype, copy=False)
+                sq_dist[:, offset + start:offset + end] = q_sq_norms[:, None] - 2.0 * (queries @ block.T)
+        sq_dist[:, :base_count] += self._base_sq_norms[None, :base_count]
+        sq_dist[:, base_count:] += self._sq_norms[None, :tail_count]
+        np.maximum(sq_dist, 0, out=sq_dist)
+
+        if k < count:
+            indices = np.argpartition(sq_dist, k - 1, axis=1)[:, :k]
+        else:
+            indices = np.broadcast_to(np.arange(count), sq_dist.shape).copy()
+        part = np.take_along_axis(sq_dist, indices, axis=1)
+        order = np.argsort(part, axis=1, kind='stable')
+        indices = np.take_along_axis(indices, order, axis=1)
+        distances = np.sqrt(np.take_along_axis(part, order, axis=1))
+        return distances, indices
+
+    @property
+    def _work_dtype(self):
+        # Integer pixels are upcast to float64 to keep ||q||^2 - 2q.x + ||x||^2 exact
+        return self.dtype if self.dtype.kind == 'f' else np.float64
+
+    def _row_sq_norms(self, rows):
+        rows = np.asarray(rows).astype(self._work_dtype, copy=False)
+        return np.einsum('ij,ij->i', rows, rows)
+
+    def _grow(self, needed):
+        capacity = max(needed, 2 * len(self._data))
+        data = np.empty((capacity, self.dim), dtype=self.dtype)
+        data[:self._count] = self._data[:self._count]
+        sq_norms = np.empty(capacity, dtype=np.float64)
+        sq_norms[:self._count] = self._sq_norms[:self._count]
+        self._data, self._sq_norms = data, sq_norms
+
+
+
+class BallTreeIndex:
+    """Exact search through a scikit-learn BallTree built over the samples.
+
+    Samples are kept in a BruteForceIndex (so the memory-mapped base is still
+    shared). The tree covers the rows present when it was last built; rows
+    added since are compared exactly and merged in, and ``add`` rebuilds the
+    tree once a block of them has built up. BallTree holds its own float64
+    copy of the data, so this backend is meant for projected embeddings
+    rather than raw 7500-dim crops.
+    """
+
+    def __init__(self, dim, dtype=np.uint8, capacity=1024, base=None, base_sq_norms=None, leaf_size=40):
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.leaf_size = leaf_size
+        self._store = BruteForceIndex(dim, dtype=dtype, capacity=capacity, base=base, base_sq_norms=base_sq_norms)
+        # (tree, rows it covers), replaced as a unit
+        self._tree = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._store)
+
+    @property
+    def nbytes(self):
+        tree = self._tree
+        tree_bytes = tree[1] * self.dim * 8 if tree is not None else 0
+        return self._store.nbytes + tree_bytes
+
+    def prepare(self):
+        """Build the tree over every current row"""
+        tree = self._tree
+        if len(self._store) and (tree is None or tree[1] != len(self._store)):
+            self._build_tree()
+
+    def add(self, vectors):
+        self._store.add(vectors)
+        built = self._tree[1] if self._tree is not None else 0
+        if len(self._store) - built >= _SEARCH_BLOCK_ROWS:
+            self._build_tree()
+
+    def take(self, rows):
+        return self._store.take(rows)
+
+    def snapshot(self):
+        """Read-only view sharing the current tree and samples"""
+        view = copy.copy(self)
+        view._store = self._store.snapshot()
+        return view
+
+    def search(self, queries, k=5):
+        count = len(self._store)
+        if count == 0:
+            raise ValueError("Index is empty")
+        k = min(k, count)
+        tree = self._tree
+        if tree is None:
+            return self._store.search(queries, k)
+
+        tree, tree_count = tree
+        queries = np.asarray(queries).reshape(-1, self.dim).astype(np.float64)
+        distances, indices = tree.query(queries, k=min(k, tree_count))
+        if tree_count < count:
+            distances, indices = _merge_exact_rows(self._store, queries, distances, indices, tree_count, count, k)
+        return distances, indices
+
+    def _build_tree(self):
+        from sklearn.neighbors import BallTree
+
+        with self._lock:
+            count = len(self._store)
+            samples, _ = self._store.take(np.arange(count))
+            self._tree = (BallTree(samples.astype(np.float64), leaf_size=self.leaf_size), count)
+
+
+class IVFPQIndex:
+    """Approximate search with an inverted file over product-quantised residuals.
+
+    Samples are clustered into ``nlist`` coarse cells with k-means; each
+    sample's residual from its cell centroid is split into ``m`` sub-vectors
+    and each sub-vector is stored as a one-byte code into a 256-entry
+    codebook. A query scans only the ``nprobe`` nearest cells using
+    precomputed sub-vector distance tables, then re-ranks the best
+    ``k * refine`` candidates with exact distances. Query cost therefore
+    grows with the size of the probed cells, not the whole gallery.
+
+    Training happens in ``prepare()``, or in ``add`` once ``min_train_size``
+    samples exist; until then searches are exact. Samples added after
+    training are compared exactly until a block of them has built up, then
+    encoded with the existing codebooks. Searches never modify the index.
+    """
+
+    def __init__(self, dim, dtype=np.uint8, capacity=1024, base=None, base_sq_norms=None,
+                 nlist=0, m=16, nprobe=8, refine=10, min_train_size=2048, train_size=20000, seed=0):
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.nlist = nlist
+        self.m = min(m, dim)
+        self.nprobe = nprobe
+        self.refine = refine
+        self.min_train_size = min_train_size
+        self.train_size = train_size
+        self.seed = seed
+        self._store = BruteForceIndex(dim, dtype=dtype, capacity=capacity, base=base, base_sq_norms=base_sq_norms)
+        self._lock = threading.Lock()
+        self._splits = np.array_split(np.arange(dim), self.m)
+        # (centroids, codebooks) once trained
+        self._quantizer = None
+        # (cell per row, codes per row, rows encoded, rows ordered by cell,
+        # cell offsets into that order), replaced as a unit
+        self._encoding = None
+
+    def __len__(self):
+        return len(self._store)
+
+    @property
+    def is_trained(self):
+        return self._quantizer is not None
+
+    @property
+    def nbytes(self):
+        quantizer, encoding = self._quantizer, self._encoding
+        trained = 0
+        if quantizer is not None:
+            centroids, codebooks = quantizer
+            trained = centroids.nbytes + sum(codebook.nbytes for codebook in codebooks)
+        if encoding is not None:
+            trained += sum(array.nbytes for array in (encoding[0], encoding[1], encoding[3], encoding[4]))
+        return self._store.nbytes + trained
+
+    def prepare(self):
+        """Train and encode every current row"""
+        if len(self._store) >= self.min_train_size:
+            with self._lock:
+                if not self.is_trained:
+                    self._train()
+                self._encode_pending()
+
+    def add(self, vectors):
+        self._store.add(vectors)
+        encoded = self._encoding[2] if self._encoding is not None else 0
+        if not self.is_trained and len(self._store) >= self.min_train_size:
+            self.prepare()
+        elif self.is_trained and len(self._store) - encoded >= _SEARCH_BLOCK_ROWS:
+            with self._lock:
+                self._encode_pending()
+
+    def take(self, rows):
+        return self._store.take(rows)
+
+    def snapshot(self):
+        """Read-only view sharing the current codebooks, codes and samples"""
+        view = copy.copy(self)
+        view._store = self._store.snapshot()
+        return view
+
+    def search(self, queries, k=5):
+        count = len(self._store)
+        quantizer, encoding = self._quantizer, self._encoding
+        if quantizer is None or encoding is None:
+            return self._store.search(queries, k)
+        centroids, codebooks = quantizer
+        _, codes, indexed, order, offsets = encoding
+        indexed = min(indexed, count)
+
+        k = min(k, count)
+        queries = np.asarray(queries).reshape(-1, self.dim).astype(np.float32)
+        distances = np.empty((len(queries), k), dtype=np.float64)
+        indices = np.empty((len(queries), k), dtype=np.intp)
+        nprobe = min(self.nprobe, len(centroids))
+        cell_dist = _sq_distances(queries, centroids)
+        probes = np.argpartition(cell_dist, nprobe - 1, axis=1)[:, :nprobe]
+
+        m_range = np.arange(self.m)
+        answered_exactly = np.zeros(len(queries), dtype=bool)
+        for qi, query in enumerate(queries):
+            cells = probes[qi]
+            # Distance tables for all probed cells at once: (nprobe, m, 256)
+            residuals = query[None, :] - centroids[cells]
+            tables = np.stack([
+                _sq_distances(residuals[:, split], codebook)
+                for split, codebook in zip(self._splits, codebooks)
+            ], axis=1)
+            rows = [order[offsets[cell]:offsets[cell + 1]] for cell in cells]
+            positions = np.repeat(np.arange(len(cells)), [len(r) for r in rows])
+            candidates = np.concatenate(rows)
+            approx = tables[positions[:, None], m_range[None, :], codes[candidates]].sum(axis=1)
+
+            shortlist = min(len(candidates), k * self.refine)
+            if shortlist < k:
+                # Probed cells hold too few samples; answer this query exactly
+                d, i = self._store.search(query[None, :], k)
+                distances[qi], indices[qi] = d[0], i[0]
+                answered_exactly[qi] = True
+                continue
+            best = candidates[np.argpartition(approx, shortlist - 1)[:shortlist]]
+            samples, sq_norms = self._store.take(best)
+            exact = sq_norms - 2.0 * (samples.astype(np.float64) @ query.astype(np.float64))
+            exact += float(query.astype(np.float64) @ query.astype(np.float64))
+            top = np.argsort(exact, kind='stable')[:k]
+            distances[qi] = np.sqrt(np.maximum(exact[top], 0))
+            indices[qi] = best[top]
+
+        # Samples added after the last encode are compared exactly
+        pending = ~answered_exactly
+        if indexed < count and pending.any():
+            distances[pending], indices[pending] = _merge_exact_rows(
+                self._store, queries[pending].astype(np.float64), distances[pending], indices[pending],
+                indexed, count, k
+            )
+        return distances, indices
+
+    def _train(self):
+        count = len(self._store)
+        rng = np.random.default_rng(self.seed)
+        rows = np.sort(rng.choice(count, min(count, self.train_size), replace=False))
+        sample, _ = self._store.take(rows)
+        sample = sample.astype(np.float32)
+
+        nlist = self.nlist or max(1, int(4 * np.sqrt(count)))
+        centroids = _kmeans(sample, min(nlist, len(sample)), rng)
+        residuals = sample - centroids[_sq_distances(sample, centroids).argmin(axis=1)]
+        codebooks = [
+            _kmeans(np.ascontiguousarray(residuals[:, split]), min(256, len(sample)), rng)
+            for split in self._splits
+        ]
+        self._quantizer = (centroids, codebooks)
+
+    def _encode_pending(self):
+        count = len(self._store)
+        centroids, codebooks = self._quantizer
+        if self._encoding is not None:
+            prev_assign, prev_codes, encoded = self._encoding[:3]
+        else:
+            prev_assign = np.empty(0, dtype=np.int32)
+            prev_codes = np.empty((0, self.m), dtype=np.uint8)
+            encoded = 0
+        if encoded == count:
+            return
+
+        rows = np.arange(encoded, count)
+        assign = np.empty(len(rows), dtype=np.int32)
+        codes = np.empty((len(rows), self.m), dtype=np.uint8)
+        for start in range(0, len(rows), _SEARCH_BLOCK_ROWS):
+            block_rows = rows[start:start + _SEARCH_BLOCK_ROWS]
+            block, _ = self._store.take(block_rows)
+            block = block.astype(np.float32)
+            cells = _sq_distances(block, centroids).argmin(axis=1)
+            residuals = block - centroids[cells]
+            assign[start:start + len(block_rows)] = cells
+            for j, (split, codebook) in enumerate(zip(self._splits, codebooks)):
+                codes[start:start + len(block_rows), j] = _sq_distances(residuals[:, split], codebook).argmin(axis=1)
+
+        assign = np.concatenate([prev_assign, assign])
+        codes = np.concatenate([prev_codes, codes])
+        order = np.argsort(assign, kind='stable')
+        offsets = np.searchsorted(assign[order], np.arange(len(centroids) + 1))
+        self._encoding = (assign, codes, count, order, offsets)
+
+
+def _merge_exact_rows(store, queries, distances, indices, start, stop, k):
+    """Merge exact distances to rows [start, stop) into per-query k-NN results"""
+    samples, sq_norms = store.take(np.arange(start, stop))
+    sq = (np.einsum('ij,ij->i', queries, queries)[:, None] - 2.0 * (queries @ samples.astype(np.float64).T)
+          + sq_norms[None, :])
+    merged_distances = np.concatenate([distances, np.sqrt(np.maximum(sq, 0))], axis=1)
+    merged_indices = np.concatenate([indices, np.broadcast_to(np.arange(start, stop), sq.shape)], axis=1)
+    order = np.argsort(merged_distances, axis=1, kind='stable')[:, :k]
+    return (np.take_along_axis(merged_distances, order, axis=1),
+            np.take_along_axis(merged_indices, order, axis=1))
+
+
+def _sq_distances(a, b):
+    """(len(a), len(b)) squared Euclidean distances between two float matrices"""
+    sq = np.einsum('ij,ij->i', a, a)[:, None] - 2.0 * (a @ b.T) + np.einsum('ij,ij->i', b, b)[None, :]
+    return np.maximum(sq, 0)
+
+
+def _kmeans(data, k, rng, iterations=10):
+    """Plain Lloyd k-means; empty clusters are re-seeded from random samples"""
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.concatenate([
+            _sq_distances(data[start:start + _SEARCH_BLOCK_ROWS], centroids).argmin(axis=1)
+            for start in range(0, len(data), _SEARCH_BLOCK_ROWS)
+        ])
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, data)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        centroids[empty] = data[rng.choice(len(data), int(empty.sum()))]
+    return centroids
+
+
+INDEX_BACKENDS = {
+    'brute': BruteForceIndex,
+    'balltree': BallTreeIndex,
+    'ivfpq': IVFPQIndex,
+}
+
+
+def make_index(backend, dim, **kwargs):
+    """Build a nearest-neighbour index by backend name (see INDEX_BACKENDS)"""
+    try:
+        index_class = INDEX_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown face index backend: {backend}")
+    return index_class(dim, **kwargs)
+
+
+def index_report(samples, queries, backends, k=5):
+    """Recall@k against exact search and per-query latency for each backend.
+
+    Args:
+        samples: (n, dim) gallery matrix to index
+        queries: (q, dim) query matrix
+        backends: list of (label, backend name, options dict)
+
+    Returns:
+        List of dicts with label, build_seconds, recall, mean_ms, p95_ms, nbytes
+    """
+    exact = BruteForceIndex(samples.shape[1], dtype=samples.dtype, capacity=0, base=samples)
+    _, truth = exact.search(queries, k)
+
+    report = []
+    for label, backend, options in backends:
+        started = time.perf_counter()
+        index = make_index(backend, samples.shape[1], dtype=samples.dtype, capacity=0, base=samples, **options)
+        index.prepare()
+        build_seconds = time.perf_counter() - started
+
+        latencies, hits = [], 0
+        for qi in range(len(queries)):
+            started = time.perf_counter()
+            _, found = index.search(queries[qi:qi + 1], k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits += len(np.intersect1d(found[0], truth[qi]))
+        report.append({
+            'label': label,
+            'build_seconds': round(build_seconds, 3),
+            'recall': round(hits / truth.size, 4),
+            'mean_ms': round(float(np.mean(latencies)), 3),
+            'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+            'nbytes': index.nbytes
+        })
+    return report
+
+class GalleryIndex:
+    """Nearest-neighbour index over face samples together with their labels and user ids.
+
+    Labels are stored as integer codes into ``names`` so a majority vote over
+    neighbours stays in NumPy. Codes and user ids live in buffers that double
+    when full, so enrolment stays O(sample) amortised like the index itself.
+    ``generation`` increases on every change, which lets derived caches tell
+    when they are stale. ``backend`` picks the neighbour search from
+    INDEX_BACKENDS, with ``backend_options`` passed to its constructor.
+    ``radii`` maps labels to the acceptance radius written by prototype
+    compaction.
+
+    ``snapshot()`` returns an immutable view for readers. The owner keeps
+    adding to this index and publishes a fresh snapshot after each change;
+    snapshots share buffers, so publishing is O(1).
+    """
+
+    def __init__(self, dim, dtype=np.uint8, base=None, base_sq_norms=None, names=(), codes=None, user_ids=None,
+                 capacity=1024, backend='brute', backend_options=None, radii=None):
+        self.dim = dim
+        self.radii = dict(radii or {})
+        self.backend = backend
+        self.samples = make_index(
+            backend, dim, dtype=dtype, capacity=capacity, base=base, base_sq_norms=base_sq_norms,
+            **(backend_options or {})
+        )
+        self.names = list(names)
+        self._name_codes = {name: code for code, name in enumerate(self.names)}
+        count = len(self.samples)
+        self._codes = np.asarray(codes if codes is not None else np.empty(0), dtype=np.intp)[:count]
+        self._user_ids = np.asarray(user_ids if user_ids is not None else np.empty(0), dtype=np.int64)[:count]
+        self._count = count
+        self.generation = 0
+        # Shared by every snapshot of this index, so caches can tell them apart from other indexes
+        self.lineage = object()
+        self._frozen = False
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def user_ids(self):
+        return self._user_ids[:self._count]
+
+    @property
+    def nbytes(self):
+        return self.samples.nbytes + self._codes.nbytes + self._user_ids.nbytes
+
+    def add(self, samples, labels, user_ids):
+        """Index new samples with their labels and user ids (-1 or None when unknown)"""
+        if self._frozen:
+            raise ValueError("Index snapshot is read-only")
+        samples = np.asarray(samples).reshape(-1, self.dim)
+        start, end = self._count, self._count + len(samples)
+        if end > len(self._codes):
+            capacity = max(end, 2 * len(self._codes))
+            codes = np.empty(capacity, dtype=np.intp)
+            codes[:start] = self._codes[:start]
+            grown_user_ids = np.empty(capacity, dtype=np.int64)
+            grown_user_ids[:start] = self._user_ids[:start]
+            self._codes, self._user_ids = codes, grown_user_ids
+
+        for i, label in enumerate(labels, start):
+            code = self._name_codes.get(label)
+            if code is None:
+                code = self._name_codes[label] = len(self.names)
+                self.names.append(label)
+            self._codes[i] = code
+        self._user_ids[start:end] = [-1 if user_id is None else int(user_id) for user_id in user_ids]
+
+        self.samples.add(samples)
+        self._count = end
+        self.generation += 1
+
+    def prepare(self):
+        """Build the backend's search structures ahead of the first query"""
+        self.samples.prepare()
+
+    def snapshot(self):
+        """Immutable view of the samples and labels indexed so far"""
+        view = copy.copy(self)
+        view.samples = self.samples.snapshot()
+        view.radii = dict(self.radii)
+        view._frozen = True
+        return view
+
+    def search(self, queries, k=5):
+        """Return (distances, indices) of the k nearest samples for each query row"""
+        return self.samples.search(queries, k)
+
+    def vote(self, indices):
+        """Majority vote over neighbour indices, one row per face.
+
+        Same as KNeighborsClassifier.predict with uniform weights, except that
+        ties go to the label enrolled first.
+
+        Returns:
+            Tuple of (labels list, user id array, column of the nearest
+            neighbour carrying the winning label) per row
+        """
+        codes = self._codes[indices]
+        votes = np.zeros((codes.shape[0], len(self.names)), dtype=np.int32)
+        np.add.at(votes, (np.arange(codes.shape[0])[:, None], codes), 1)
+        winners = votes.argmax(axis=1)
+
+        # User id of the first neighbour carrying the winning label
+        first = (codes == winners[:, None]).argmax(axis=1)
+        user_ids = self._user_ids[indices[np.arange(len(indices)), first]]
+        return [self.names[code] for code in winners], user_ids, first
+
+    def subset(self, user_ids, backend='brute', backend_options=None):
+        """Independent index over only the samples of the given users.
+
+        The subset is sized exactly; its tail buffer is only allocated if
+        samples are added to it later. Subsets default to exact search since
+        they are usually small (one class roster).
+        """
+        count = self._count
+        rows = np.flatnonzero(np.isin(self._user_ids[:count], list(user_ids)))
+        samples, sq_norms = self.samples.take(rows)
+        return GalleryIndex(
+            self.dim, dtype=self.samples.dtype, base=samples, base_sq_norms=sq_norms,
+            names=self.names, codes=self._codes[rows], user_ids=self._user_ids[rows], capacity=0,
+            backend=backend, backend_options=backend_options, radii=self.radii
+        )
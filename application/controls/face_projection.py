@@ -0,0 +1,97 @@
+# application/controls/face_projection.py
+import hashlib
+import os
+
+import numpy as np
+
+# Stored next to the gallery files in FACIAL_DATA_DIR
+PROJECTION_FILE = 'gallery_pca.npz'
+
+# Rows projected per block, bounding the float32 copy of raw pixels
+_TRANSFORM_BLOCK_ROWS = 4096
+
+
+class PCAProjection:
+    """Eigenface projection from raw 50x50x3 crops to a compact float32 embedding.
+
+    Fitted offline on the gallery (``python -m application.controls.face_gallery
+    fit-pca``) and applied to every gallery sample and query crop before the
+    nearest-neighbour search. With 128 components each sample takes 512
+    bytes instead of 7500, and a distance costs 128 multiply-adds instead of
+    7500. Components are orthonormal, so distances in the embedding
+    approximate pixel-space distances.
+    """
+
+    def __init__(self, mean, components, explained_variance_ratio=None):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        self.explained_variance_ratio = (
+            np.asarray(explained_variance_ratio, dtype=np.float64)
+            if explained_variance_ratio is not None else None
+        )
+        self.fingerprint = hashlib.sha1(self.components.tobytes()).hexdigest()[:16]
+
+    @property
+    def dims(self):
+        return self.components.shape[0]
+
+    @property
+    def input_dim(self):
+        return self.components.shape[1]
+
+    @classmethod
+    def fit(cls, samples, dims=128, max_samples=5000, seed=0):
+        """Fit the top ``dims`` principal components of the given (n, dim) samples.
+
+        At most ``max_samples`` rows, chosen at random, are used for the fit.
+        """
+        samples = np.asarray(samples)
+        if len(samples) < 2:
+            raise ValueError("At least two samples are needed to fit a projection")
+        if len(samples) > max_samples:
+            rows = np.sort(np.random.default_rng(seed).choice(len(samples), max_samples, replace=False))
+            samples = samples[rows]
+
+        data = samples.astype(np.float32)
+        mean = data.mean(axis=0)
+        data -= mean
+        _, singular_values, vt = np.linalg.svd(data, full_matrices=False)
+        dims = min(dims, vt.shape[0])
+        variance = singular_values.astype(np.float64) ** 2
+        return cls(mean, vt[:dims], variance[:dims] / variance.sum())
+
+    def transform(self, samples):
+        """Project (n, input_dim) or (input_dim,) samples to a (n, dims) float32 matrix"""
+        samples = np.asarray(samples).reshape(-1, self.input_dim)
+        embedded = np.empty((len(samples), self.dims), dtype=np.float32)
+        for start in range(0, len(samples), _TRANSFORM_BLOCK_ROWS):
+            end = min(start + _TRANSFORM_BLOCK_ROWS, len(samples))
+            block = samples[start:end].astype(np.float32) - self.mean
+            embedded[start:end] = block @ self.components.T
+        return embedded
+
+    def save(self, path):
+        """Write the projection atomically to an .npz file"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f, mean=self.mean, components=self.components,
+                explained_variance_ratio=(
+                    self.explained_variance_ratio if self.explained_variance_ratio is not None else np.empty(0)
+                )
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            ratio = data['explained_variance_ratio']
+            return cls(data['mean'], data['components'], ratio if len(ratio) else None)
+
+
+def load_projection(data_dir):
+    """Load the projection stored in a gallery directory, or None if it has not been fitted"""
+    path = os.path.join(data_dir, PROJECTION_FILE)
+    return PCAProjection.load(path) if os.path.exists(path) else None
@@ -0,0 +1,138 @@
+# application/controls/face_prototypes.py
+import time
+
+import numpy as np
+
+def _pairwise_distances(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    sq = np.einsum('ij,ij->i', a, a)[:, None] - 2.0 * (a @ b.T) + np.einsum('ij,ij->i', b, b)[None, :]
+    return np.sqrt(np.maximum(sq, 0))
+
+
+def select_prototypes(samples, max_prototypes=5, iterations=20):
+    """Summarise one student's samples as up to ``max_prototypes`` centroids.
+
+    Centroids come from k-means seeded farthest-point from the overall
+    medoid, and are rounded back to uint8 so they stay valid crops for every
+    gallery format and the eigenface projection. On our captures they match
+    new frames better than the same number of medoids do.
+
+    Returns:
+        Tuple of (prototypes as a uint8 array, acceptance radius) where the
+        radius is the largest distance from any of the samples to its
+        nearest prototype. A student with no more samples than prototypes
+        keeps the samples as they are and gets None: every sample is its
+        own prototype, so a radius of 0 would reject every new frame.
+    """
+    samples = np.asarray(samples, dtype=np.uint8).reshape(len(samples), -1)
+    if len(samples) <= max_prototypes:
+        return samples.copy(), None
+
+    data = samples.astype(np.float64)
+    distances = _pairwise_distances(data, data)
+    seeds = [int(distances.sum(axis=1).argmin())]
+    while len(seeds) < max_prototypes:
+        seeds.append(int(distances[:, seeds].min(axis=1).argmax()))
+    centroids = data[seeds]
+
+    for _ in range(iterations):
+        assignment = _pairwise_distances(data, centroids).argmin(axis=1)
+        updated = np.stack([
+            data[assignment == cluster].mean(axis=0) if np.any(assignment == cluster) else centroids[cluster]
+            for cluster in range(len(centroids))
+        ])
+        if np.allclose(updated, centroids):
+            break
+        centroids = updated
+
+    prototypes = np.clip(np.rint(centroids), 0, 255).astype(np.uint8)
+    radius = float(_pairwise_distances(data, prototypes).min(axis=1).max())
+    return prototypes, radius
+
+
+def compact_to_prototypes(faces, labels, user_ids, max_prototypes=5, radii=None):
+    """Reduce every label's samples to its prototypes.
+
+    Args:
+        faces: (n, dim) sample matrix
+        labels: per-row label list
+        user_ids: per-row user ids
+        max_prototypes: prototypes kept per label
+        radii: radii from an earlier compaction, by label; a label keeps the
+            larger of its old and new radius so re-compacting prototypes does
+            not shrink it. Labels with no radius either way get none
+
+    Returns:
+        Tuple of (faces, labels, user_ids, radii dict) for the compacted gallery
+    """
+    faces = np.asarray(faces)
+    labels = np.asarray(labels, dtype=str)
+    user_ids = np.asarray(user_ids)
+    radii = dict(radii or {})
+
+    proto_faces, proto_labels, proto_user_ids, new_radii = [], [], [], {}
+    # Labels in order of first appearance, so the tie-break in the vote is kept
+    _, first_rows = np.unique(labels, return_index=True)
+    for first_row in np.sort(first_rows):
+        label = str(labels[first_row])
+        prototypes, radius = select_prototypes(faces[labels == label], max_prototypes)
+        proto_faces.append(prototypes)
+        proto_labels.extend([label] * len(prototypes))
+        proto_user_ids.extend([user_ids[first_row]] * len(prototypes))
+        known = [r for r in (radius, radii.get(label)) if r is not None]
+        if known:
+            new_radii[label] = max(known)
+
+    if not proto_faces:
+        return faces[:0], [], user_ids[:0], new_radii
+    return np.concatenate(proto_faces), proto_labels, np.asarray(proto_user_ids), new_radii
+
+
+def compaction_report(faces, labels, proto_faces, proto_labels, queries=200, k=5, seed=0):
+    """Measure memory, query latency and label agreement before and after compaction.
+
+    Queries are jittered copies of random original samples; agreement is the
+    fraction whose nearest prototype carries the same label as the k-NN vote
+    over the full gallery.
+    """
+    from application.controls.face_index import GalleryIndex
+
+    rng = np.random.default_rng(seed)
+    query_rows = rng.integers(0, len(faces), queries)
+    query_faces = np.asarray(faces)[query_rows].astype(np.int16)
+    query_faces = np.clip(query_faces + rng.integers(-8, 9, query_faces.shape, dtype=np.int16), 0, 255)
+    query_faces = query_faces.astype(np.uint8)
+
+    results = {}
+    runs = (('full', faces, labels, k), ('prototypes', proto_faces, proto_labels, 1))
+    for name, gallery_faces, gallery_labels, neighbours in runs:
+        gallery_faces = np.asarray(gallery_faces)
+        names = list(dict.fromkeys(gallery_labels))
+        name_codes = {label: code for code, label in enumerate(names)}
+        index = GalleryIndex(
+            gallery_faces.shape[1], base=gallery_faces, capacity=0, names=names,
+            codes=[name_codes[label] for label in gallery_labels],
+            user_ids=np.full(len(gallery_labels), -1)
+        )
+        started = time.perf_counter()
+        for row in query_faces:
+            index.search(row[None, :], neighbours)
+        elapsed = (time.perf_counter() - started) * 1000 / len(query_faces)
+        _, indices = index.search(query_faces, neighbours)
+        results[name] = {
+            'samples': len(gallery_faces),
+            'bytes': int(gallery_faces.nbytes),
+            'mean_ms': round(elapsed, 3),
+            'votes': index.vote(indices)[0]
+        }
+
+    full, compact = results['full'], results['prototypes']
+    agreement = np.mean([a == b for a, b in zip(full.pop('votes'), compact.pop('votes'))])
+    return {
+        'full': full,
+        'prototypes': compact,
+        'memory_reduction': round(full['bytes'] / max(compact['bytes'], 1), 1),
+        'speedup': round(full['mean_ms'] / max(compact['mean_ms'], 1e-9), 1),
+        'agreement': round(float(agreement), 4)
+    }
@@ -0,0 +1,128 @@
+# application/controls/face_shards.py
+import threading
+import time
+from collections import OrderedDict
+
+
+class GalleryShardRegistry:
+    """Per-institution gallery indexes, loaded lazily and evicted LRU.
+
+    ``loader(institution_id)`` builds a GalleryIndex for one institution on
+    first use. Resident shards are kept in least-recently-used order and the
+    oldest ones are evicted whenever the total exceeds ``max_bytes`` or
+    ``max_shards``, so RAM per worker stays bounded however many tenants the
+    platform has. The shard that was just loaded is never evicted, even when
+    it alone is over budget.
+
+    ``invalidate`` bumps a generation per institution (and one for the whole
+    registry), so a load that was already running when its shard was
+    invalidated is handed to its caller but not kept.
+    """
+
+    def __init__(self, loader, max_bytes=512 * 1024 * 1024, max_shards=32, logger=None):
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.max_shards = max_shards
+        self.logger = logger
+        self._shards = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+        self._epoch = 0
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, institution_id):
+        """Return the institution's shard index, loading it on first use"""
+        with self._lock:
+            shard = self._shards.get(institution_id)
+            if shard is not None:
+                self._shards.move_to_end(institution_id)
+                shard['hits'] += 1
+                self.hits += 1
+                return shard['index']
+            self.misses += 1
+            # One loader per institution; concurrent misses wait on it
+            load_lock = self._loading.setdefault(institution_id, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                shard = self._shards.get(institution_id)
+                if shard is not None:
+                    return shard['index']
+                generation = self._generation(institution_id)
+
+            index = self.loader(institution_id)
+            with self._lock:
+                self._loading.pop(institution_id, None)
+                if self._generation(institution_id) != generation:
+                    # Invalidated mid-load: the next lookup loads it afresh
+                    return index
+                self._shards[institution_id] = {
+                    'index': index,
+                    'hits': 0,
+                    'loaded_at': time.time()
+                }
+                self._evict()
+            return index
+
+    def peek(self, institution_id):
+        """Return the shard if it is resident, without loading or counting a hit"""
+        with self._lock:
+            shard = self._shards.get(institution_id)
+            return shard['index'] if shard else None
+
+    def invalidate(self, institution_id=None):
+        """Drop one shard, or every shard when institution_id is None"""
+        with self._lock:
+            if institution_id is None:
+                self._shards.clear()
+                self._generations.clear()
+                self._epoch += 1
+            else:
+                self._shards.pop(institution_id, None)
+                self._generations[institution_id] = self._generations.get(institution_id, 0) + 1
+
+    @property
+    def resident_bytes(self):
+        return sum(shard['index'].nbytes for shard in self._shards.values())
+
+    def stats(self):
+        """Resident shards with their size and hit counts, plus registry-wide totals"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'resident_shards': len(self._shards),
+                'resident_bytes': self.resident_bytes,
+                'max_bytes': self.max_bytes,
+                'max_shards': self.max_shards,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'shards': [
+                    {
+                        'institution_id': institution_id,
+                        'samples': len(shard['index']),
+                        'bytes': shard['index'].nbytes,
+                        'hits': shard['hits'],
+                        'loaded_at': shard['loaded_at']
+                    }
+                    for institution_id, shard in self._shards.items()
+                ]
+            }
+
+    def _generation(self, institution_id):
+        return self._epoch, self._generations.get(institution_id, 0)
+
+    def _evict(self):
+        while len(self._shards) > 1 and (
+            len(self._shards) > self.max_shards or self.resident_bytes > self.max_bytes
+        ):
+            institution_id, shard = self._shards.popitem(last=False)
+            self.evictions += 1
+            if self.logger:
+                self.logger.info(
+                    f"Evicted face gallery shard for institution {institution_id} ({shard['index'].nbytes} bytes)"
+                )
@@ -0,0 +1,144 @@
+# application/controls/face_tracking.py
+import itertools
+import threading
+import time
+
+import numpy as np
+
+
+def box_iou(a, b):
+    """(len(a), len(b)) intersection-over-union of x, y, w, h boxes"""
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    ax2, ay2 = a[:, 0] + a[:, 2], a[:, 1] + a[:, 3]
+    bx2, by2 = b[:, 0] + b[:, 2], b[:, 1] + b[:, 3]
+    width = np.minimum(ax2[:, None], bx2[None, :]) - np.maximum(a[:, 0][:, None], b[:, 0][None, :])
+    height = np.minimum(ay2[:, None], by2[None, :]) - np.maximum(a[:, 1][:, None], b[:, 1][None, :])
+    intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0.0)
+
+
+class FaceTrack:
+    """One face followed across frames, with its cached recognition"""
+
+    def __init__(self, track_id, bbox, now):
+        self.track_id = track_id
+        self.bbox = bbox
+        self.first_seen = now
+        self.last_seen = now
+        self.frames = 1
+        self.recognition = None
+        self.attempts = 0
+        self.checked_in = False
+        self.attendance = None
+
+    def to_dict(self):
+        return {
+            'track_id': self.track_id,
+            'bbox': {'x': int(self.bbox[0]), 'y': int(self.bbox[1]), 'w': int(self.bbox[2]), 'h': int(self.bbox[3])},
+            'frames': self.frames,
+            'age_seconds': round(self.last_seen - self.first_seen, 2),
+            'recognition': self.recognition,
+            'checked_in': self.checked_in,
+            'attendance': self.attendance
+        }
+
+
+class FaceTracker:
+    """Matches face boxes in consecutive frames of one camera to tracks.
+
+    A box continues the track it overlaps most (IoU at least
+    ``iou_threshold``), or failing that the nearest track whose centre is
+    within ``centroid_ratio`` box widths, which covers low frame rates where
+    a moving face no longer overlaps its previous box. Matching is greedy
+    on the best pair first. Tracks not seen for ``max_age`` seconds end.
+    """
+
+    def __init__(self, iou_threshold=0.3, centroid_ratio=0.5, max_age=2.0):
+        self.iou_threshold = iou_threshold
+        self.centroid_ratio = centroid_ratio
+        self.max_age = max_age
+        self.tracks = {}
+        self.last_update = time.monotonic()
+        self._ids = itertools.count(1)
+
+    def update(self, boxes, now=None):
+        """Match this frame's boxes to tracks, starting tracks for new faces
+
+        Returns:
+            List of (track, is_new) in the order of ``boxes``
+        """
+        now = time.monotonic() if now is None else now
+        self.last_update = now
+        for track_id in [tid for tid, track in self.tracks.items() if now - track.last_seen > self.max_age]:
+            del self.tracks[track_id]
+
+        boxes = np.asarray(boxes, dtype=int).reshape(-1, 4)
+        tracks = list(self.tracks.values())
+        assigned = [None] * len(boxes)
+        if tracks and len(boxes):
+            previous = np.array([track.bbox for track in tracks])
+            scores = box_iou(boxes, previous)
+
+            # Centroid fallback, scored below any IoU match
+            centres = boxes[:, :2] + boxes[:, 2:] / 2
+            previous_centres = previous[:, :2] + previous[:, 2:] / 2
+            distance = np.linalg.norm(centres[:, None, :] - previous_centres[None, :, :], axis=2)
+            reach = self.centroid_ratio * np.maximum(boxes[:, 2][:, None], previous[:, 2][None, :])
+            near = (scores < self.iou_threshold) & (distance <= reach)
+            scores = np.where(scores >= self.iou_threshold, 1.0 + scores, 0.0)
+            scores[near] = 1.0 - distance[near] / np.maximum(reach[near], 1e-9)
+
+            for flat in np.argsort(-scores, axis=None):
+                row, col = np.unravel_index(flat, scores.shape)
+                if scores[row, col] <= 0:
+                    break
+                if assigned[row] is None and tracks[col] is not None:
+                    assigned[row] = tracks[col]
+                    tracks[col] = None
+
+        matches = []
+        for box, track in zip(boxes, assigned):
+            if track is None:
+                track = FaceTrack(next(self._ids), tuple(int(v) for v in box), now)
+                self.tracks[track.track_id] = track
+                matches.append((track, True))
+            else:
+                track.bbox = tuple(int(v) for v in box)
+                track.last_seen = now
+                track.frames += 1
+                matches.append((track, False))
+        return matches
+
+
+class StreamTrackerRegistry:
+    """FaceTracker per kiosk or camera stream, dropped once the stream goes idle"""
+
+    def __init__(self, idle_seconds=300, **tracker_options):
+        self.idle_seconds = idle_seconds
+        self.tracker_options = tracker_options
+        self._trackers = {}
+        self._lock = threading.Lock()
+
+    def get(self, stream_id):
+        """The stream's tracker and its lock, creating them on first use"""
+        now = time.monotonic()
+        with self._lock:
+            for sid in [sid for sid, (tracker, _) in self._trackers.items()
+                        if now - tracker.last_update > self.idle_seconds]:
+                del self._trackers[sid]
+            if stream_id not in self._trackers:
+                self._trackers[stream_id] = (FaceTracker(**self.tracker_options), threading.Lock())
+            return self._trackers[stream_id]
+
+    def drop(self, stream_id):
+        with self._lock:
+            return self._trackers.pop(stream_id, None) is not None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'streams': len(self._trackers),
+                'tracks': sum(len(tracker.tracks) for tracker, _ in self._trackers.values())
+            }
@@ -1,133 +1,420 @@
 # application/controls/facial_recognition_control.py
 import cv2
-import pickle
 import numpy as np
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
+import threading
 import time
+from application.controls.face_detection import (
+    REDUCED_COLOR_FLAGS, REDUCED_GRAYSCALE_FLAGS, make_detector
+)
+from application.controls.face_gallery import (
+    FaceGalleryStore, encode_face_samples, decode_face_samples, decode_face_radius
+)
+from application.controls.face_index import GalleryIndex
+from application.controls.face_projection import load_projection
+from application.controls.face_shards import GalleryShardRegistry
+from application.controls.face_tracking import StreamTrackerRegistry
+from application.controls.recognition_cache import RecognitionResultCache, frame_signature
+from application.controls.recognition_pool import RecognitionPool
+
+# Flattened 50x50 BGR face crop
+FACE_DIM = 50 * 50 * 3
 
 class FacialRecognitionControl:
-    """Control class for facial recognition operations"""
+    """Control class for facial recognition operations
+    
+    One instance is owned by the app (``app.config['facial_recognition']``)
+    and shared by every route. ``start_warmup`` loads the gallery on a
+    background thread at boot; ``status`` moves from 'cold' through
+    'warming' to 'ready' (or 'failed'). A process forked while the gallery
+    was still warming has no warmup thread, so it starts its own.
+    
+    With FACIAL_RECOGNITION_WORKERS set, recognitions run in a
+    RecognitionPool of worker processes instead of the request thread.
+    ``gallery_epoch`` counts gallery changes so the workers know when to
+    reload.
+    
+    ``recognize_stream_frame`` serves kiosks and cameras sending a stream
+    of frames: faces are tracked across frames and only new tracks are
+    classified.
+    """
     
     def __init__(self, app=None):
         self.app = app
-        self.knn_model = None
-        self.labels = []
-        self.faces_data = []
-        self.haar_cascade = None
+        # Readers use the published snapshot; only enrolment touches the writer
+        self.gallery_index = None
+        self._gallery_writer = None
+        self.gallery_epoch = 0
+        self.recognition_pool = None
+        self._write_lock = threading.Lock()
+        self.projection = None
+        self.index_backend = 'brute'
+        self.index_options = {}
+        self.gallery_shards = None
+        self.gallery_store = None
+        self.gallery_source = 'file'
+        self.gallery_version = None
+        self._poll_thread = None
+        self.detector = None
+        self.detect_reduction = 2
+        self.detect_min_face = 48
+        self._class_indexes = {}
+        self._class_indexes_lock = threading.Lock()
+        self.stream_trackers = StreamTrackerRegistry()
+        self.result_cache = None
+        self.stream_max_attempts = 3
         self.is_initialized = False
+        self.status = 'cold'
+        self.status_error = None
+        self.warmup_seconds = None
+        self._init_lock = threading.Lock()
+        self._warmup_thread = None
+        self._warmup_pid = None
+    
+    def start_warmup(self, app):
+        """Initialize on a background thread unless already ready or warming
         
+        Returns:
+            True if a warmup thread was started
+        """
+        if self._warmup_pid not in (None, os.getpid()) and self.status != 'ready':
+            # Forked mid-warmup: the thread (and any lock it held) stayed
+            # with the parent
+            self._init_lock = threading.Lock()
+            self.status = 'cold'
+        with self._init_lock:
+            if self.status in ('warming', 'ready'):
+                return False
+            self.app = app
+            self.status = 'warming'
+            self._warmup_pid = os.getpid()
+            self._warmup_thread = threading.Thread(
+                target=self.initialize, args=(app,), name='face-recognizer-warmup', daemon=True
+            )
+            self._warmup_thread.start()
+            return True
+    
+    @property
+    def is_ready(self):
+        return self.status == 'ready'
+    
+    def get_status(self):
+        """Readiness and gallery summary for the /status route"""
+        status = {
+            'status': self.status,
+            'ready': self.is_ready,
+            'initialized': self.is_initialized,
+            'samples_loaded': self.sample_count,
+            'warmup_seconds': self.warmup_seconds,
+            'model_ready': self.gallery_index is not None or self.gallery_shards is not None
+        }
+        if self.status_error:
+            status['error'] = self.status_error
+        if self.gallery_shards is not None:
+            status['shards'] = self.gallery_shards.stats()
+        if self.recognition_pool is not None:
+            status['recognition_pool'] = self.recognition_pool.stats()
+        status['streams'] = self.stream_trackers.stats()
+        if self.result_cache is not None:
+            status['result_cache'] = self.result_cache.stats()
+        return status
+    
     def initialize(self, app):
-        """Initialize the facial recognition system"""
-        try:
+        """Initialize the facial recognition system
+        
+        Safe to call from the warmup thread and a request at the same time;
+        the second caller waits and the gallery is loaded once per call.
+        """
+        with self._init_lock:
             self.app = app
+            self.status = 'warming'
+            self._warmup_pid = os.getpid()
+            started = time.perf_counter()
+            if self._load(app):
+                self.status, self.status_error = 'ready', None
+                self.warmup_seconds = round(time.perf_counter() - started, 3)
+                return True
+            self.status = 'failed'
+            return False
+    
+    def _load(self, app):
+        try:
             data_dir = app.config.get('FACIAL_DATA_DIR', './AttendanceAI/data/')
             
-            # Load Haar Cascade
-            cascade_path = os.path.join(data_dir, 'haarcascade_frontalface_default.xml')
-            self.haar_cascade = cv2.CascadeClassifier(cascade_path)
+            # Load the face detector (Haar cascade unless configured otherwise)
+            self.detector = make_detector(
+                app.config.get('FACIAL_DETECTOR', 'haar'), data_dir,
+                model_path=app.config.get('FACIAL_DETECTOR_MODEL') or None,
+                config_path=app.config.get('FACIAL_DETECTOR_CONFIG') or None,
+                scale_factor=app.config.get('FACIAL_DETECT_SCALE_FACTOR', 1.3),
+                min_neighbors=app.config.get('FACIAL_DETECT_MIN_NEIGHBORS', 5),
+                confidence=app.config.get('FACIAL_DNN_CONFIDENCE', 0.5)
+            )
             
-            if self.haar_cascade.empty():
-                raise FileNotFoundError("Haar Cascade XML file not found")
+            self.detect_reduction = app.config.get('FACIAL_DETECT_REDUCTION', 2)
+            if self.detect_reduction not in REDUCED_GRAYSCALE_FLAGS:
+                raise ValueError(f"FACIAL_DETECT_REDUCTION must be one of {sorted(REDUCED_GRAYSCALE_FLAGS)}")
+            self.detect_min_face = app.config.get('FACIAL_MIN_FACE_SIZE', 48)
             
-            # Load trained data
-            names_path = os.path.join(data_dir, 'names.pkl')
-            faces_path = os.path.join(data_dir, 'faces_data.pkl')
+            self.stream_trackers = StreamTrackerRegistry(max_age=app.config.get('FACIAL_TRACK_MAX_AGE', 2.0))
+            self.stream_max_attempts = app.config.get('FACIAL_STREAM_MAX_ATTEMPTS', 3)
             
-            with open(names_path, 'rb') as w:
-                self.labels = pickle.load(w)
+            cache_size = app.config.get('FACIAL_RESULT_CACHE_SIZE', 256)
+            self.result_cache = RecognitionResultCache(
+                max_entries=cache_size,
+                ttl=app.config.get('FACIAL_RESULT_CACHE_TTL', 30.0),
+                tolerance=app.config.get('FACIAL_RESULT_CACHE_TOLERANCE', 16)
+            ) if cache_size else None
             
-            with open(faces_path, 'rb') as f:
-                self.faces_data = pickle.load(f)
+            # Optional eigenface projection, fitted offline with fit-pca
+            self.projection = None
+            if app.config.get('FACIAL_PROJECTION_ENABLED', False):
+                self.projection = load_projection(data_dir)
+                if self.projection is None:
+                    self.app.logger.warning("FACIAL_PROJECTION_ENABLED is set but no projection has been fitted; using raw pixels")
             
-            # Fix mismatch
-            min_samples = min(len(self.faces_data), len(self.labels))
-            self.faces_data = self.faces_data[:min_samples]
-            self.labels = self.labels[:min_samples]
+            # Neighbour search backend for the gallery and institution shards
+            self.index_backend = app.config.get('FACIAL_INDEX_BACKEND', 'brute')
+            self.index_options = {}
+            if self.index_backend == 'ivfpq':
+                self.index_options = {
+                    'nlist': app.config.get('FACIAL_IVF_NLIST', 0),
+                    'nprobe': app.config.get('FACIAL_IVF_NPROBE', 8),
+                    'm': app.config.get('FACIAL_PQ_SUBQUANTIZERS', 16)
+                }
             
-            # Train KNN model
-            from sklearn.neighbors import KNeighborsClassifier
-            self.knn_model = KNeighborsClassifier(n_neighbors=5)
-            self.knn_model.fit(self.faces_data, self.labels)
+            # Load trained data from the configured source of truth
+            self.gallery_source = app.config.get('FACIAL_GALLERY_SOURCE', 'file')
+            shard_by_institution = app.config.get('FACIAL_SHARD_BY_INSTITUTION', False)
+            if self.gallery_source == 'database':
+                # With sharding, institutions are loaded on first use instead
+                if not shard_by_institution:
+                    self._load_from_database()
+            else:
+                self._load_from_files(data_dir)
+            
+            if shard_by_institution:
+                if self.gallery_source != 'database':
+                    self.app.logger.info("Institution shards in file mode are copied from the loaded gallery; they do not lower memory use")
+                self.gallery_shards = GalleryShardRegistry(
+                    self._load_institution_shard,
+                    max_bytes=app.config.get('FACIAL_SHARD_MAX_BYTES', 512 * 1024 * 1024),
+                    max_shards=app.config.get('FACIAL_SHARD_MAX_COUNT', 32),
+                    logger=app.logger
+                )
             
             self.is_initialized = True
             self.app.logger.info("Facial recognition system initialized successfully")
             
+            poll_seconds = app.config.get('FACIAL_GALLERY_POLL_SECONDS', 0)
+            if self.gallery_source == 'database' and poll_seconds and self._poll_thread is None:
+                self._poll_thread = threading.Thread(
+                    target=self._poll_database, args=(poll_seconds,), name='face-gallery-poll', daemon=True
+                )
+                self._poll_thread.start()
+            
+            workers = app.config.get('FACIAL_RECOGNITION_WORKERS', 0)
+            if workers and self.recognition_pool is None:
+                self._start_recognition_pool(app, workers)
+            
             return True
             
         except Exception as e:
+            self.status_error = str(e)
             self.app.logger.error(f"Failed to initialize facial recognition: {e}")
             return False
     
-    def recognize_face_from_image(self, image_data, student_id=None):
-        """Recognize face from image data"""
+    def recognize_face_from_image(self, image_data, student_id=None, class_id=None, institution_id=None,
+                                  use_cache=False):
+        """Recognize face from image data
+        
+        When class_id is given, only samples of students enrolled in that
+        class are searched. With institution sharding enabled, the search
+        runs against the institution's shard instead of the whole gallery.
+        Runs in the recognition pool when one is configured.
+        
+        With ``use_cache``, a near-identical frame for the same class and
+        gallery, such as a kiosk retry or a re-post after a network error,
+        gets the earlier result from the result cache without detection or
+        search; such results carry ``cached: True``. Only callers whose
+        frames show one face up close should pass it: two wide shots of the
+        same room match on the background even when different students are
+        in view.
+        """
         if not self.is_initialized:
             return {'success': False, 'error': 'Facial recognition not initialized'}
         
+        signature = None
+        if use_cache and self.result_cache is not None:
+            signature = frame_signature(image_data)
+            context = (class_id, institution_id, self.gallery_epoch)
+            cached = self.result_cache.get(context, signature)
+            if cached is not None:
+                return {**cached, 'cached': True}
+        
+        if self.recognition_pool is not None:
+            result = self.recognition_pool.recognize(
+                image_data, class_id=class_id, institution_id=institution_id, epoch=self.gallery_epoch
+            )
+        else:
+            result = self.recognize_in_process(image_data, class_id=class_id, institution_id=institution_id)
+        
+        # Transient failures (timeouts, a full queue, errors) are not cached
+        if signature is not None and (result['success'] or result.get('error') == 'No face detected'):
+            self.result_cache.put(context, signature, result)
+        return result
+    
+    def recognize_in_process(self, image_data, class_id=None, institution_id=None):
+        """Recognize faces on the calling thread (in a pool worker, or without a pool)"""
         try:
-            # Convert image data to numpy array
-            nparr = np.frombuffer(image_data, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            error, faces, frame = self._detect_faces(image_data)
+            if error:
+                return {'success': False, 'error': error}
             
-            if frame is None:
-                return {'success': False, 'error': 'Invalid image data'}
+            error, recognitions = self._classify_faces(faces, frame, class_id, institution_id)
+            if error:
+                return {'success': False, 'error': error}
             
-            # Convert to grayscale
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            
-            # Detect faces
-            faces = self.haar_cascade.detectMultiScale(gray, 1.3, 5)
+            return {
+                'success': True,
+                'recognitions': recognitions,
+                'face_count': len(faces)
+            }
             
-            if len(faces) == 0:
-                return {'success': False, 'error': 'No face detected'}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    def recognize_stream_frame(self, stream_id, image_data, class_id=None, institution_id=None):
+        """Recognize faces in one frame of a kiosk or camera stream
+        
+        Faces are matched to the stream's tracks from earlier frames. Only
+        new tracks, and tracks whose earlier recognitions were below
+        FACIAL_RECOGNITION_THRESHOLD (up to FACIAL_STREAM_MAX_ATTEMPTS
+        tries), are classified; the rest reuse the track's cached result, so
+        a known face costs detection only. Tracks end once their face has
+        been gone for FACIAL_TRACK_MAX_AGE seconds.
+        
+        Tracker state lives in this process, so stream frames are always
+        served here rather than in the recognition pool.
+        """
+        if not self.is_initialized:
+            return {'success': False, 'error': 'Facial recognition not initialized'}
+        
+        try:
+            error, faces, frame = self._detect_faces(image_data)
+            if error and error != 'No face detected':
+                return {'success': False, 'error': error}
             
-            # Process each detected face
-            recognitions = []
-            for (x, y, w, h) in faces:
-                crop_img = frame[y:y+h, x:x+w, :]
-                resized_img = cv2.resize(crop_img, (50, 50)).flatten().reshape(1, -1)
-                
-                # Predict
-                output = self.knn_model.predict(resized_img)
-                name = str(output[0])
+            tracker, lock = self.stream_trackers.get(stream_id)
+            with lock:
+                matches = tracker.update(faces if faces is not None else [])
+                pending = [i for i, (track, _) in enumerate(matches)
+                           if track.recognition is None
+                           or (not self.is_confident(track.recognition) and track.attempts < self.stream_max_attempts)]
+                if pending:
+                    error, recognitions = self._classify_faces(faces[pending], frame, class_id, institution_id)
+                    if error:
+                        return {'success': False, 'error': error}
+                    for i, recognition in zip(pending, recognitions):
+                        track = matches[i][0]
+                        track.recognition = recognition
+                        track.attempts += 1
                 
-                # Calculate confidence
-                distances, indices = self.knn_model.kneighbors(resized_img)
-                avg_distance = np.mean(distances)
-                confidence = max(0, 100 - avg_distance)  # Simple confidence calculation
-                
-                recognitions.append({
-                    'name': name,
-                    'confidence': round(confidence, 2),
-                    'bbox': {'x': int(x), 'y': int(y), 'w': int(w), 'h': int(h)},
-                    'student_id': self._get_student_id_by_name(name)
-                })
+                tracks = []
+                for i, (track, is_new) in enumerate(matches):
+                    entry = track.to_dict()
+                    entry.update(new_track=is_new, classified=i in pending)
+                    tracks.append(entry)
             
             return {
                 'success': True,
-                'recognitions': recognitions,
-                'face_count': len(faces)
+                'stream_id': stream_id,
+                'tracks': tracks,
+                'face_count': len(matches),
+                'classified': len(pending)
             }
             
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
-    def register_new_face(self, student_id, image_data, student_name=None):
+    def mark_track_checked_in(self, stream_id, track_id, attendance=None):
+        """Flag a stream track as checked in, so it is not marked again while it lasts"""
+        tracker, lock = self.stream_trackers.get(stream_id)
+        with lock:
+            track = tracker.tracks.get(track_id)
+            if track is None:
+                return False
+            track.checked_in = True
+            track.attendance = attendance
+            return True
+    
+    def is_confident(self, recognition):
+        """Whether a recognition is good enough to mark attendance without verification"""
+        threshold = self.app.config.get('FACIAL_RECOGNITION_THRESHOLD', 70) if self.app else 70
+        return recognition['confidence'] >= threshold and recognition.get('within_radius') is not False
+    
+    def _classify_faces(self, faces, frame, class_id=None, institution_id=None):
+        """Search the gallery for the given face boxes of a frame
+        
+        Returns:
+            Tuple of (error message or None, list of recognitions)
+        """
+        # Stack every face crop into one matrix so a single neighbour
+        # query serves all faces in the frame
+        crops = np.empty((len(faces), FACE_DIM), dtype=np.uint8)
+        for i, (x, y, w, h) in enumerate(faces):
+            crop_img = frame[y:y+h, x:x+w, :]
+            crops[i] = cv2.resize(crop_img, (50, 50)).reshape(-1)
+        
+        # One immutable snapshot serves the whole request, however many
+        # enrolments are published meanwhile
+        index = self._get_search_index(institution_id)
+        if index is None:
+            return 'No registered faces', None
+        if class_id is not None:
+            index = self._get_class_index(class_id, index)
+            if index is None:
+                return 'Class not found', None
+            if len(index) == 0:
+                return 'No registered faces for students in this class', None
+        elif len(index) == 0:
+            return 'No registered faces', None
+        
+        # Labels, distances and confidences all come from this one query.
+        # A prototype gallery holds a few centroids per student, so only
+        # the nearest one is used
+        distances, indices = index.search(self._embed(crops), k=1 if index.radii else 5)
+        names, user_ids, nearest = index.vote(indices)
+        confidences = np.maximum(0, 100 - distances.mean(axis=1))  # Simple confidence calculation
+        nearest_distances = distances[np.arange(len(faces)), nearest]
+        
+        recognitions = []
+        for (x, y, w, h), name, user_id, confidence, distance in zip(
+                faces, names, user_ids.tolist(), confidences, nearest_distances):
+            name = str(name)
+            recognition = {
+                'name': name,
+                'confidence': round(float(confidence), 2),
+                'bbox': {'x': int(x), 'y': int(y), 'w': int(w), 'h': int(h)},
+                # Samples enrolled without an account carry -1
+                'student_id': user_id if user_id >= 0 else None
+            }
+            # Prototype galleries carry a per-student acceptance radius,
+            # measured on raw pixels; projected distances are not comparable
+            radius = index.radii.get(name) if self.projection is None else None
+            if radius is not None:
+                recognition['within_radius'] = bool(distance <= radius)
+            recognitions.append(recognition)
+        return None, recognitions
+    
+    def register_new_face(self, student_id, image_data, student_name=None, institution_id=None):
         """Register a new face for a student"""
         try:
-            # Convert and process image
-            nparr = np.frombuffer(image_data, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            if frame is None:
-                return {'success': False, 'error': 'Invalid image data'}
-            
             # Detect and extract face
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = self.haar_cascade.detectMultiScale(gray, 1.3, 5)
-            
-            if len(faces) == 0:
-                return {'success': False, 'error': 'No face detected'}
+            error, faces, frame = self._detect_faces(image_data)
+            if error:
+                return {'success': False, 'error': error}
             
             # Take the largest face
             largest_face = max(faces, key=lambda rect: rect[2] * rect[3])
@@ -137,40 +424,315 @@ class FacialRecognitionControl:
             resized_img = cv2.resize(crop_img, (50, 50))
             flattened = resized_img.flatten()
             
-            # Save to training data
-            data_dir = self.app.config.get('FACIAL_DATA_DIR', './AttendanceAI/data/')
-            os.makedirs(data_dir, exist_ok=True)
-            
-            # Update faces data
-            self.faces_data = np.append(self.faces_data, [flattened], axis=0)
-            
-            # Update labels
+            # Persist the sample, then grow the index in place
             name_to_use = student_name or f"Student_{student_id}"
-            self.labels.append(name_to_use)
-            
-            # Save updated data
-            with open(os.path.join(data_dir, 'faces_data.pkl'), 'wb') as f:
-                pickle.dump(self.faces_data, f)
-            
-            with open(os.path.join(data_dir, 'names.pkl'), 'wb') as w:
-                pickle.dump(self.labels, w)
-            
-            # Retrain model
-            self.knn_model.fit(self.faces_data, self.labels)
+            if self.gallery_source == 'database':
+                # Label it the way a reload from facial_data would
+                name_to_use = self._save_sample_to_database(student_id, flattened)
+            else:
+                self.gallery_store.append(flattened, name_to_use, student_id)
+            embedded = self._embed(flattened)
+            with self._write_lock:
+                if self._gallery_writer is not None:
+                    self._gallery_writer.add(embedded, [name_to_use], [student_id])
+                    self.gallery_index = self._gallery_writer.snapshot()
+            if self.gallery_shards is not None:
+                # Resident shards are derived copies; drop the student's so
+                # the next lookup reloads with the new sample
+                self.gallery_shards.invalidate(institution_id)
+            self.gallery_epoch += 1
             
             return {
                 'success': True,
                 'message': f'Face registered for {name_to_use}',
-                'samples_collected': len(self.faces_data)
+                'samples_collected': self.sample_count
             }
             
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
-    def _get_student_id_by_name(self, name):
-        """Helper to extract student ID from recognized name"""
-        # This depends on how you name students in your training data
-        # Example: "John Doe (ID: 123)" -> extract 123
-        import re
-        match = re.search(r'\(ID:\s*(\d+)\)', name)
-        return match.group(1) if match else None
\ No newline at end of file
+    def _detect_faces(self, image_data):
+        """Detect faces on a reduced decode of the image.
+        
+        The image is decoded straight to 1/FACIAL_DETECT_REDUCTION size, in
+        grayscale unless the configured detector needs colour. The full
+        colour frame is only decoded once a face is found, and boxes are
+        mapped back to it so crops keep full resolution.
+        FACIAL_MIN_FACE_SIZE is in full-resolution pixels.
+        
+        Returns:
+            Tuple of (error message or None, (n, 4) full-resolution boxes,
+            colour frame)
+        """
+        buffer = np.frombuffer(image_data, np.uint8)
+        flags = REDUCED_COLOR_FLAGS if self.detector.color else REDUCED_GRAYSCALE_FLAGS
+        reduced = cv2.imdecode(buffer, flags[self.detect_reduction])
+        if reduced is None:
+            return 'Invalid image data', None, None
+        
+        min_size = max(1, round(self.detect_min_face / self.detect_reduction))
+        faces = self.detector.detect(reduced, min_size)
+        if len(faces) == 0:
+            return 'No face detected', None, None
+        
+        if self.detector.color and self.detect_reduction == 1:
+            frame = reduced
+        else:
+            frame = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        if frame is None:
+            return 'Invalid image data', None, None
+        
+        # The reduced decode rounds sizes up, so scale by the actual ratio
+        height, width = frame.shape[:2]
+        scale = np.array([width / reduced.shape[1], height / reduced.shape[0]] * 2)
+        faces = np.rint(np.asarray(faces) * scale).astype(int)
+        faces[:, 2] = np.minimum(faces[:, 2], width - faces[:, 0])
+        faces[:, 3] = np.minimum(faces[:, 3], height - faces[:, 1])
+        return None, faces, frame
+    
+    def refresh_if_changed(self):
+        """Rebuild the index if facial_data changed since it was loaded.
+        
+        Called on change notification (POST /reload) and by the optional
+        poller, so every node converges on the same gallery.
+        
+        Returns:
+            True if the index was rebuilt
+        """
+        if self.gallery_source != 'database':
+            return False
+        
+        from database.base import get_session
+        from application.entities2.facial_data import FacialDataModel
+        
+        with get_session() as db_session:
+            version = FacialDataModel(db_session).get_gallery_version()
+        if version == self.gallery_version:
+            return False
+        
+        if self.gallery_shards is not None:
+            self.gallery_shards.invalidate()
+            self.gallery_version = version
+            self.gallery_epoch += 1
+            if self.result_cache is not None:
+                self.result_cache.clear()
+        else:
+            self._load_from_database()
+        self.app.logger.info(f"Face gallery reloaded from database ({self.sample_count} samples)")
+        return True
+    
+    def reload_gallery(self):
+        """Reload the gallery from its source, dropping derived shards
+        
+        Used by pool workers to catch up with enrolments and reloads made
+        in the app process.
+        """
+        if self.gallery_source == 'database':
+            if self.gallery_shards is None:
+                self._load_from_database()
+        else:
+            self._load_from_files(self.app.config.get('FACIAL_DATA_DIR', './AttendanceAI/data/'))
+        if self.gallery_shards is not None:
+            self.gallery_shards.invalidate()
+    
+    def _start_recognition_pool(self, app, workers):
+        """Start the worker processes and wait for their galleries to load"""
+        # Workers get the FACIAL_* settings only, and never start their own
+        # pool or poller
+        config = {key: value for key, value in app.config.items() if key.startswith('FACIAL_')}
+        config.update(FACIAL_RECOGNITION_WORKERS=0, FACIAL_GALLERY_POLL_SECONDS=0)
+        self.recognition_pool = RecognitionPool(
+            config, workers,
+            max_queue=app.config.get('FACIAL_RECOGNITION_QUEUE') or None,
+            timeout=app.config.get('FACIAL_RECOGNITION_TIMEOUT', 10.0),
+            epoch=self.gallery_epoch,
+            logger=app.logger
+        )
+        ready = self.recognition_pool.warm()
+        if ready < workers:
+            app.logger.warning(f"Only {ready} of {workers} recognition workers loaded the face gallery")
+        else:
+            app.logger.info(f"Started {workers} recognition worker processes")
+    
+    def _get_search_index(self, institution_id=None):
+        """Index to search: the institution's shard when sharding, else the whole gallery"""
+        if self.gallery_shards is not None and institution_id is not None:
+            return self.gallery_shards.get(institution_id)
+        return self.gallery_index
+    
+    def _get_class_index(self, class_id, source_index):
+        """Sub-index over the samples of students enrolled in a class.
+        
+        Enrolment is resolved through CourseUser for the class's course and
+        semester. The sub-index is cached until the class ends, or until the
+        source index is replaced or changes.
+        """
+        now = datetime.now()
+        entry = self._class_indexes.get(class_id)
+        if (entry and entry['lineage'] is source_index.lineage and entry['generation'] == source_index.generation
+                and entry['expires_at'] > now):
+            return entry['index']
+        
+        from database.base import get_session
+        from application.entities2.classes import ClassModel
+        
+        with get_session() as db_session:
+            class_model = ClassModel(db_session)
+            class_obj = class_model.get_by_id(class_id)
+            if not class_obj:
+                return None
+            enrolled_ids = class_model.get_enrolled_student_ids(class_id)
+            end_time = class_obj.end_time
+        
+        generation = source_index.generation
+        index = source_index.subset(enrolled_ids)
+        
+        if end_time and end_time > now:
+            expires_at = end_time
+        else:
+            expires_at = now + timedelta(seconds=self.app.config.get('FACIAL_CLASS_INDEX_TTL', 600))
+        entry = {
+            'index': index,
+            'lineage': source_index.lineage,
+            'generation': generation,
+            'expires_at': expires_at
+        }
+        
+        with self._class_indexes_lock:
+            for cached_id in [cid for cid, e in self._class_indexes.items() if e['expires_at'] <= now]:
+                del self._class_indexes[cached_id]
+            self._class_indexes[class_id] = entry
+        return index
+    
+    def _load_from_files(self, data_dir):
+        """Load the memory-mapped gallery, converting the legacy pickles on first start"""
+        self.gallery_store = FaceGalleryStore(
+            data_dir,
+            compact_threshold=self.app.config.get('FACIAL_COMPACT_THRESHOLD', 500),
+            logger=self.app.logger
+        )
+        if not self.gallery_store.exists() and self.gallery_store.has_legacy_pickles():
+            converted = self.gallery_store.convert_legacy()
+            self.app.logger.info(f"Converted legacy face pickles to memory-mapped gallery ({converted} samples)")
+        gallery, pending_faces, pending_labels, pending_user_ids = self.gallery_store.load()
+        
+        # Build the nearest-neighbour index over the mapped matrix, then
+        # add whatever is still waiting in the append segment
+        if self.projection is not None:
+            base, base_sq_norms = self.gallery_store.load_embeddings(self.projection, gallery), None
+        else:
+            base, base_sq_norms = gallery.faces, gallery.sq_norms
+        index = self._new_index(
+            base=base, base_sq_norms=base_sq_norms,
+            names=gallery.names, codes=gallery.codes, user_ids=gallery.user_ids, radii=gallery.radii
+        )
+        index.add(self._embed(pending_faces), pending_labels, pending_user_ids)
+        index.prepare()
+        self._publish(index)
+    
+    def _load_from_database(self):
+        """Build the index from facial_data with one streaming query"""
+        from database.base import get_session
+        from application.entities2.facial_data import FacialDataModel
+        
+        with get_session() as db_session:
+            version = FacialDataModel(db_session).get_gallery_version()
+        self._publish(self._build_index_from_database())
+        self.gallery_version = version
+    
+    def _build_index_from_database(self, institution_id=None):
+        from database.base import get_session
+        from application.entities2.facial_data import FacialDataModel
+        
+        index = self._new_index()
+        with get_session() as db_session:
+            facial_data_model = FacialDataModel(db_session)
+            for user_id, name, face_encoding, _ in facial_data_model.stream_active_encodings(institution_id):
+                samples = decode_face_samples(face_encoding, FACE_DIM)
+                label = f"{name} (ID: {user_id})"
+                index.add(self._embed(samples), [label] * len(samples), [user_id] * len(samples))
+                radius = decode_face_radius(face_encoding)
+                if radius is not None:
+                    index.radii[label] = radius
+        index.prepare()
+        return index
+    
+    def _load_institution_shard(self, institution_id):
+        """Build one institution's shard for the registry
+        
+        In database mode the shard is read straight from facial_data. In file
+        mode it is a subset of the whole gallery, which stays loaded, so
+        shards narrow the search there but do not bound memory.
+        """
+        if self.gallery_source == 'database':
+            index = self._build_index_from_database(institution_id)
+        else:
+            from database.base import get_session
+            from application.entities2.user import UserModel
+            
+            with get_session() as db_session:
+                user_ids = UserModel(db_session).get_ids_by_institution(institution_id)
+            index = self.gallery_index.subset(user_ids, self.index_backend, self.index_options)
+            index.prepare()
+        self.app.logger.info(f"Loaded face gallery shard for institution {institution_id} ({len(index)} samples)")
+        return index
+    
+    def _save_sample_to_database(self, student_id, sample):
+        """Append one sample to the student's compressed facial_data row
+        
+        Returns:
+            The student's gallery label, as _build_index_from_database makes it
+        """
+        from database.base import get_session
+        from application.entities2.facial_data import FacialDataModel
+        from application.entities2.user import UserModel
+        
+        with get_session() as db_session:
+            name = UserModel(db_session).get_names_by_ids([student_id]).get(int(student_id))
+            facial_data_model = FacialDataModel(db_session)
+            record = facial_data_model.get_active_for_user(student_id)
+            samples = sample.reshape(1, FACE_DIM)
+            radius = None
+            if record:
+                samples = np.concatenate([decode_face_samples(record.face_encoding, FACE_DIM), samples])
+                radius = decode_face_radius(record.face_encoding)
+            facial_data_model.save_encoding(student_id, encode_face_samples(samples, radius), len(samples))
+        return f"{name} (ID: {student_id})"
+    
+    def _poll_database(self, poll_seconds):
+        while True:
+            time.sleep(poll_seconds)
+            try:
+                self.refresh_if_changed()
+            except Exception as e:
+                self.app.logger.error(f"Face gallery refresh failed: {e}")
+    
+    def _publish(self, index):
+        """Make index the writer and swap its snapshot in for readers"""
+        with self._write_lock:
+            self._gallery_writer = index
+            self.gallery_index = index.snapshot()
+            self.gallery_epoch += 1
+        if self.result_cache is not None:
+            self.result_cache.clear()
+    
+    def _new_index(self, **kwargs):
+        """Empty or pre-filled GalleryIndex in the space samples are searched in"""
+        kwargs.update(backend=self.index_backend, backend_options=self.index_options)
+        if self.projection is not None:
+            return GalleryIndex(self.projection.dims, dtype=np.float32, **kwargs)
+        return GalleryIndex(FACE_DIM, **kwargs)
+    
+    def _embed(self, samples):
+        """Map raw flattened crops into the index space (identity without a projection)"""
+        if self.projection is not None:
+            return self.projection.transform(samples)
+        return np.asarray(samples, dtype=np.uint8).reshape(-1, FACE_DIM)
+    
+    @property
+    def sample_count(self):
+        if self.gallery_index is not None:
+            return len(self.gallery_index)
+        if self.gallery_shards is not None:
+            return sum(shard['samples'] for shard in self.gallery_shards.stats()['shards'])
+        return 0
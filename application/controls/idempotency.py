@@ -0,0 +1,228 @@
+# application/controls/idempotency.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, jsonify, make_response, request, session
+
+# Response headers replayed along with a stored body
+REPLAYED_HEADERS = ('Location',)
+
+
+class IdempotencyStore:
+    """Responses of requests sent with an Idempotency-Key, for replay on retry.
+
+    An LRU of at most ``max_entries`` responses, each kept for ``ttl``
+    seconds. A key being processed is marked in flight so a retry that
+    arrives meanwhile is refused rather than run a second time. With
+    ``db_backed`` the responses are also written to the idempotency_keys
+    table, so a retry that reaches another app process, or arrives after a
+    restart, is still answered from the first response.
+    """
+
+    def __init__(self, max_entries=10000, ttl=86400, db_backed=False, logger=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_backed = db_backed
+        self.logger = logger
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._replayed = 0
+        self._stored = 0
+        self._last_purge = time.monotonic()
+
+    def begin(self, scope, key, fingerprint):
+        """Claim a key for a new request
+
+        Returns:
+            Tuple of (state, stored response) where state is 'new' (run the
+            request, then call ``complete`` or ``abandon``), 'replay' (with
+            the stored (body, status, headers)), 'mismatch' (key reused for
+            a different request) or 'in_flight'
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((scope, key))
+            if entry is not None and entry['expires_at'] <= now:
+                del self._entries[(scope, key)]
+                entry = None
+            if entry is None and (scope, key) in self._in_flight:
+                return 'in_flight', None
+
+        if entry is None and self.db_backed:
+            entry = self._load(scope, key)
+
+        with self._lock:
+            if entry is None:
+                if (scope, key) in self._in_flight:
+                    return 'in_flight', None
+                self._in_flight[(scope, key)] = fingerprint
+                return 'new', None
+            self._entries[(scope, key)] = entry
+            self._entries.move_to_end((scope, key))
+            if entry['fingerprint'] != fingerprint:
+                return 'mismatch', None
+            self._replayed += 1
+            return 'replay', (entry['body'], entry['status'], entry['headers'])
+
+    def complete(self, scope, key, body, status, headers=None):
+        """Store the response of a request claimed with ``begin``"""
+        with self._lock:
+            fingerprint = self._in_flight.pop((scope, key), None)
+            if fingerprint is None:
+                return
+            self._entries[(scope, key)] = {
+                'fingerprint': fingerprint,
+                'body': body,
+                'status': status,
+                'headers': headers or {},
+                'expires_at': time.monotonic() + self.ttl
+            }
+            self._entries.move_to_end((scope, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._stored += 1
+
+        if self.db_backed:
+            self._save(scope, key, fingerprint, body, status, headers or {})
+
+    def abandon(self, scope, key):
+        """Release a key without storing a response, so a retry runs again"""
+        with self._lock:
+            self._in_flight.pop((scope, key), None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'in_flight': len(self._in_flight),
+                'stored': self._stored,
+                'replayed': self._replayed,
+                'db_backed': self.db_backed
+            }
+
+    def _load(self, scope, key):
+        from database.base import get_session
+        from application.entities2.idempotency_key import IdempotencyKeyModel
+        try:
+            with get_session() as db_session:
+                since = datetime.utcnow() - timedelta(seconds=self.ttl)
+                record = IdempotencyKeyModel(db_session).get_response(scope, key, since)
+                if record is None:
+                    return None
+                age = (datetime.utcnow() - record.created_at).total_seconds()
+                response = record.response
+                return {
+                    'fingerprint': record.fingerprint,
+                    'body': response['body'],
+                    'status': record.status_code,
+                    'headers': response.get('headers', {}),
+                    'expires_at': time.monotonic() + self.ttl - age
+                }
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Error loading idempotency key: {e}")
+            return None
+
+    def _save(self, scope, key, fingerprint, body, status, headers):
+        from database.base import get_session
+        from application.entities2.idempotency_key import IdempotencyKeyModel
+        try:
+            with get_session() as db_session:
+                idempotency_model = IdempotencyKeyModel(db_session)
+                idempotency_model.save_response(
+                    scope, key, fingerprint, status, {'body': body, 'headers': headers}
+                )
+                # Expired rows are cleared at most once per TTL
+                if time.monotonic() - self._last_purge > self.ttl:
+                    self._last_purge = time.monotonic()
+                    idempotency_model.delete_expired(datetime.utcnow() - timedelta(seconds=self.ttl))
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Error saving idempotency key: {e}")
+
+
+def request_fingerprint():
+    """SHA-256 identifying what a request asks for, to catch a reused key
+
+    JSON and form bodies are hashed whole. Image uploads are identified by
+    content type and length only, so the body still streams into a single
+    buffer without an extra copy; multipart boundaries change between
+    retries, so only the type counts there.
+    """
+    digest = hashlib.sha256(f'{request.method} {request.path}?'.encode() + request.query_string)
+    mimetype = request.mimetype
+    if mimetype == 'multipart/form-data':
+        digest.update(mimetype.encode())
+    elif mimetype.startswith('image/') or mimetype == 'application/octet-stream':
+        digest.update(f'{mimetype} {request.content_length}'.encode())
+    else:
+        digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def idempotent(endpoint):
+    """
+    Decorator honouring an Idempotency-Key header on a JSON API route
+    Usage: @idempotent('attendance.mark')
+
+    The first response for a (user, key) is stored and replayed to retries
+    with an ``Idempotent-Replayed: true`` header, without running the route
+    again. Server errors (503 saturation included) are not stored, so those
+    retries run. A key reused for a different request gets 422; a retry while
+    the first request is still running gets 409. Requests without the
+    header, or without a logged-in user, run as usual.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            key = request.headers.get('Idempotency-Key')
+            store = current_app.config.get('idempotency_store')
+            user_id = session.get('user_id')
+            if not key or store is None or user_id is None:
+                return f(*args, **kwargs)
+
+            if len(key) > 255:
+                return jsonify({'success': False, 'error': 'Idempotency-Key is too long'}), 400
+
+            scope = f'{endpoint}:{user_id}'
+            state, stored = store.begin(scope, key, request_fingerprint())
+
+            if state == 'replay':
+                body, status, headers = stored
+                response = make_response(jsonify(body), status)
+                response.headers.update(headers)
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+            if state == 'mismatch':
+                return jsonify({
+                    'success': False,
+                    'error': 'Idempotency-Key was already used for a different request'
+                }), 422
+            if state == 'in_flight':
+                response = jsonify({
+                    'success': False,
+                    'error': 'A request with this Idempotency-Key is still being processed'
+                })
+                response.headers['Retry-After'] = '1'
+                return response, 409
+
+            try:
+                response = make_response(f(*args, **kwargs))
+            except Exception:
+                store.abandon(scope, key)
+                raise
+
+            if response.status_code >= 500 or not response.is_json:
+                store.abandon(scope, key)
+            else:
+                headers = {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers}
+                store.complete(scope, key, response.get_json(), response.status_code, headers)
+            return response
+        return decorated_function
+    return decorator
@@ -0,0 +1,99 @@
+# application/controls/recognition_cache.py
+import itertools
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# Side of the block-mean thumbnail a frame is reduced to
+SIGNATURE_SIZE = 32
+
+
+def frame_signature(image_data):
+    """Perceptual signature of an encoded frame, or None if it does not decode
+
+    The frame is decoded at 1/8 size in grayscale and area-averaged to a
+    32x32 thumbnail, minus its mean so a uniform exposure change does not
+    count. Each cell covers a small patch of the frame, so a different face
+    in front of the same background moves some cells a lot, while a
+    re-encoded or re-posted frame moves none by more than a few levels.
+    """
+    gray = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        return None
+    thumbnail = cv2.resize(gray, (SIGNATURE_SIZE, SIGNATURE_SIZE), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return thumbnail - np.int16(round(float(thumbnail.mean())))
+
+
+class RecognitionResultCache:
+    """TTL + LRU cache of recognition results for near-identical frames.
+
+    Entries are keyed by a context (class, institution and gallery epoch,
+    so an enrolment makes earlier results unreachable) and matched on
+    ``frame_signature``: a frame hits when no thumbnail cell differs from a
+    cached frame's by more than ``tolerance`` grey levels. Results are
+    kept for ``ttl`` seconds and at most ``max_entries`` are held, least
+    recently used first out.
+    """
+
+    def __init__(self, max_entries=256, ttl=30.0, tolerance=16):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.tolerance = tolerance
+        self._entries = OrderedDict()
+        self._keys = itertools.count()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._bytes = 0
+
+    def get(self, context, signature):
+        """Cached result for a near-identical frame in this context, or None"""
+        if signature is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            for key, (entry_context, entry_signature, result, _, _) in reversed(self._entries.items()):
+                if entry_context == context and np.abs(entry_signature - signature).max() <= self.tolerance:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return result
+            self._misses += 1
+            return None
+
+    def put(self, context, signature, result):
+        if signature is None:
+            return
+        size = signature.nbytes + len(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._entries[next(self._keys)] = (context, signature, result, time.monotonic() + self.ttl, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries:
+                self._bytes -= self._entries.popitem(last=False)[1][4]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Hit ratio and approximate memory held, for the /status route"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / lookups, 4) if lookups else None,
+                'bytes': self._bytes
+            }
+
+    def _expire(self, now):
+        """Drop entries past their TTL (caller holds the lock)"""
+        for key in [key for key, entry in self._entries.items() if entry[3] <= now]:
+            self._bytes -= self._entries.pop(key)[4]
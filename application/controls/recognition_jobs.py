@@ -0,0 +1,127 @@
+# application/controls/recognition_jobs.py
+import queue
+import threading
+import time
+import uuid
+
+
+class RecognitionJobQueue:
+    """Bounded in-process queue of recognition jobs served by worker threads.
+
+    ``submit`` stores a callable and returns a job id at once; a worker
+    thread runs it and keeps the ``(payload, http status)`` it returns until
+    ``result_ttl`` seconds after it finished. Clients poll ``get`` or block
+    in ``wait`` (used by the SSE route) instead of holding a WSGI worker for
+    the whole recognition. When the queue is full ``submit`` returns None so
+    the caller can answer 503 straight away.
+    """
+
+    def __init__(self, workers=4, max_queue=256, result_ttl=300, logger=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+        self.logger = logger
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = {}
+        self._changed = threading.Condition()
+        self._completed = 0
+        self._rejected = 0
+        self._threads = [
+            threading.Thread(target=self._work, name=f'recognition-job-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, handler, owner=None):
+        """Queue ``handler()`` and return its job id, or None if the queue is full"""
+        job_id = uuid.uuid4().hex
+        job = {
+            'job_id': job_id,
+            'owner': owner,
+            'status': 'queued',
+            'created_at': time.time(),
+            'finished_at': None,
+            'result': None,
+            'http_status': None
+        }
+        with self._changed:
+            self._expire()
+            self._jobs[job_id] = job
+        try:
+            self._queue.put_nowait((job, handler))
+        except queue.Full:
+            with self._changed:
+                self._jobs.pop(job_id, None)
+                self._rejected += 1
+            return None
+        return job_id
+
+    def get(self, job_id, owner=None):
+        """Copy of the job's state, or None if unknown, expired or not the owner's"""
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None or (owner is not None and job['owner'] != owner):
+                return None
+            return self._public(job)
+
+    def wait(self, job_id, seen_status=None, timeout=None, owner=None):
+        """Block until the job's status differs from ``seen_status`` or timeout
+
+        Returns:
+            Copy of the job's state, or None if unknown or not the owner's
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._changed:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or (owner is not None and job['owner'] != owner):
+                    return None
+                if job['status'] != seen_status:
+                    return self._public(job)
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return self._public(job)
+                self._changed.wait(remaining)
+
+    def stats(self):
+        with self._changed:
+            running = sum(1 for job in self._jobs.values() if job['status'] == 'running')
+            return {
+                'workers': self.workers,
+                'queued': self._queue.qsize(),
+                'running': running,
+                'max_queue': self.max_queue,
+                'completed': self._completed,
+                'rejected': self._rejected
+            }
+
+    def _work(self):
+        while True:
+            job, handler = self._queue.get()
+            self._set(job, status='running')
+            try:
+                payload, http_status = handler()
+                self._set(job, status='done', result=payload, http_status=http_status)
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Recognition job {job['job_id']} failed: {e}")
+                self._set(job, status='failed', result={'success': False, 'error': str(e)}, http_status=500)
+
+    def _set(self, job, **changes):
+        with self._changed:
+            job.update(changes)
+            if job['status'] in ('done', 'failed'):
+                job['finished_at'] = time.time()
+                self._completed += 1
+            self._changed.notify_all()
+
+    def _expire(self):
+        """Drop finished jobs older than result_ttl (caller holds the lock)"""
+        cutoff = time.time() - self.result_ttl
+        for job_id in [jid for jid, job in self._jobs.items() if job['finished_at'] and job['finished_at'] < cutoff]:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _public(job):
+        return {key: value for key, value in job.items() if key != 'owner'}
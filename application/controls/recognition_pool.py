@@ -0,0 +1,182 @@
+# application/controls/recognition_pool.py
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# The worker process's own FacialRecognitionControl and the parent gallery
+# epoch it last loaded
+_worker_control = None
+_worker_epoch = None
+
+
+def _start_worker(config, epoch, ready_queue):
+    """Process initializer: load the gallery once for this worker and report in"""
+    global _worker_control, _worker_epoch
+    from flask import Flask
+    from application.controls.facial_recognition_control import FacialRecognitionControl
+
+    app = Flask('face-recognition-worker')
+    app.config.update(config)
+    _worker_control = FacialRecognitionControl()
+    _worker_control.initialize(app)
+    _worker_epoch = epoch
+    ready_queue.put((os.getpid(), _worker_control.is_initialized))
+
+
+def _noop():
+    return None
+
+
+def _recognize(image_data, class_id, institution_id, epoch):
+    """Run one recognition in a worker, reloading first if the gallery moved on"""
+    global _worker_epoch
+    if not _worker_control.is_initialized:
+        return {'success': False, 'error': _worker_control.status_error or 'Facial recognition not initialized'}
+    if epoch != _worker_epoch:
+        _worker_control.reload_gallery()
+        _worker_epoch = epoch
+    return _worker_control.recognize_in_process(image_data, class_id=class_id, institution_id=institution_id)
+
+
+class RecognitionPool:
+    """Bounded process pool that runs decode, detect and search off the request thread.
+
+    Each worker owns a FacialRecognitionControl built from the app's FACIAL_*
+    settings. File galleries are memory-mapped, so workers share the same
+    page-cache copy of the matrix instead of holding one each; database
+    galleries are loaded per worker. Every task carries the parent's gallery
+    epoch, and a worker reloads its gallery before serving a task from a
+    newer epoch, so enrolments reach the workers on their next request.
+
+    At most ``workers + max_queue`` recognitions are in flight; beyond that
+    ``recognize`` fails fast with ``saturated`` set rather than queueing
+    requests that would time out anyway. Pools are per app process, so with
+    several gunicorn workers size ``workers`` against the cores left over.
+    """
+
+    def __init__(self, config, workers, max_queue=None, timeout=10.0, epoch=0, logger=None):
+        self.config = config
+        self.workers = workers
+        self.max_queue = workers * 4 if max_queue is None else max_queue
+        self.timeout = timeout
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._epoch = epoch
+        self._in_flight = 0
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._failed = 0
+        self._total_ms = 0.0
+        self._context = multiprocessing.get_context('spawn')
+        self._ready_queue = self._context.Queue()
+        self._executor = self._new_executor()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(
+            self.workers, mp_context=self._context,
+            initializer=_start_worker, initargs=(self.config, self._epoch, self._ready_queue)
+        )
+
+    def warm(self, timeout=300):
+        """Start every worker and wait until each has loaded the gallery
+
+        Returns:
+            Number of workers whose gallery loaded
+        """
+        # Processes are spawned on submit while none is idle, so submitting
+        # one task per worker up front starts them all
+        for _ in range(self.workers):
+            self._executor.submit(_noop)
+        deadline = time.monotonic() + timeout
+        ready = 0
+        for _ in range(self.workers):
+            try:
+                _, initialized = self._ready_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            ready += initialized
+        return ready
+
+    def recognize(self, image_data, class_id=None, institution_id=None, epoch=0):
+        """Recognize faces in a worker, waiting at most ``timeout`` seconds
+
+        Returns:
+            The worker's result dict, or a failure with ``saturated`` set when
+            the queue is full or the recognition timed out
+        """
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self._rejected += 1
+                return {'success': False, 'error': 'Recognition queue is full, please retry shortly', 'saturated': True}
+            self._in_flight += 1
+            self._submitted += 1
+            self._epoch = epoch
+            executor = self._executor
+
+        started = time.perf_counter()
+        try:
+            # Buffers and memory maps from the upload do not pickle
+            future = executor.submit(_recognize, bytes(image_data), class_id, institution_id, epoch)
+        except (BrokenProcessPool, RuntimeError) as e:
+            with self._lock:
+                self._in_flight -= 1
+                self._failed += 1
+            self._restart(executor, e)
+            return {'success': False, 'error': 'Recognition worker unavailable, please retry shortly', 'saturated': True}
+        future.add_done_callback(lambda _: self._finished(started))
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            with self._lock:
+                self._timed_out += 1
+            return {'success': False, 'error': 'Recognition timed out, please retry shortly', 'saturated': True}
+        except BrokenProcessPool as e:
+            with self._lock:
+                self._failed += 1
+            self._restart(executor, e)
+            return {'success': False, 'error': 'Recognition worker unavailable, please retry shortly', 'saturated': True}
+
+    def _finished(self, started):
+        with self._lock:
+            self._in_flight -= 1
+            self._completed += 1
+            self._total_ms += (time.perf_counter() - started) * 1000
+
+    def _restart(self, broken_executor, error):
+        """Replace a pool whose worker died; other callers may already have"""
+        with self._lock:
+            if self._executor is not broken_executor:
+                return
+            self._executor = self._new_executor()
+        if self.logger:
+            self.logger.error(f"Recognition worker pool restarted: {error}")
+        broken_executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        """Queue depth and saturation for the /status route"""
+        with self._lock:
+            capacity = self.workers + self.max_queue
+            return {
+                'workers': self.workers,
+                'in_flight': self._in_flight,
+                'queued': max(0, self._in_flight - self.workers),
+                'max_queue': self.max_queue,
+                'saturation': round(self._in_flight / capacity, 3) if capacity else 0.0,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'timed_out': self._timed_out,
+                'failed': self._failed,
+                'mean_ms': round(self._total_ms / self._completed, 1) if self._completed else None
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -5,6 +5,8 @@ from .attendance_record import AttendanceRecordModel
 from .classes import ClassModel
 from .course_user import CourseUserModel
 from .course import CourseModel
+from .facial_data import FacialDataModel
+from .idempotency_key import IdempotencyKeyModel
 from .institution import InstitutionModel
 from .notification import NotificationModel
 from .semester import SemesterModel
@@ -1,7 +1,10 @@
 from .base_entity import BaseEntity
-from database.models import AttendanceRecord, Class, User, Course
-from typing import List, Optional, Dict
+from database.models import AttendanceRecord, Class, User, Course, CourseUser
+from sqlalchemy.orm import aliased
+from typing import List, Optional, Dict, Tuple
 from datetime import datetime, date
+from sqlalchemy import case, func, literal, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 
 class AttendanceRecordModel(BaseEntity[AttendanceRecord]):
     """Entity for AttendanceRecord model with custom methods"""
@@ -92,6 +95,170 @@ class AttendanceRecordModel(BaseEntity[AttendanceRecord]):
         self.session.commit()
         return records
     
+    def bulk_upsert(self, class_id: int, rows: List[Dict], replay: bool = False) -> List[Dict]:
+        """Insert or update many students' attendance for a class in one transaction
+        
+        A single multi-row INSERT ... ON DUPLICATE KEY UPDATE against the
+        (class_id, student_id) unique key, instead of a lookup and a write
+        per student. The class's existing records are locked and read first
+        so each student's outcome is known, and the ids of new records are
+        read in one query afterwards. Notes and the lecturer already on a
+        record are kept when a row has none. A student listed twice keeps the
+        last row.
+        
+        With ``replay`` (journaled check-ins written late) an existing record
+        is left as it is when a lecturer marked it or when it was recorded
+        after the row, so a delayed kiosk check-in never overrides a later
+        correction. Such students are still reported as 'updated'.
+        
+        Args:
+            class_id: The class
+            rows: Dicts with student_id and optionally status, marked_by,
+                lecturer_id, notes and recorded_at
+            replay: Only overwrite older, non-lecturer records
+        
+        Returns:
+            One dict per student written, in order: student_id,
+            attendance_id, status and outcome ('created' or 'updated')
+        """
+        rows = list({row['student_id']: row for row in rows}.values())
+        if not rows:
+            return []
+        existing = dict(
+            self.session.query(AttendanceRecord.student_id, AttendanceRecord.attendance_id)
+            .filter(AttendanceRecord.class_id == class_id)
+            .with_for_update()
+            .all()
+        )
+        recorded_at = datetime.utcnow()
+        values = [
+            {
+                'class_id': class_id,
+                'student_id': row['student_id'],
+                'status': row.get('status', 'present'),
+                'marked_by': row.get('marked_by', 'system'),
+                'lecturer_id': row.get('lecturer_id'),
+                'notes': row.get('notes'),
+                'recorded_at': row.get('recorded_at') or recorded_at
+            }
+            for row in rows
+        ]
+        statement = mysql_insert(AttendanceRecord).values(values)
+        inserted = statement.inserted
+        # MySQL applies the assignments in order, each seeing the ones before
+        # it, so the columns the replay condition reads are assigned last;
+        # once assigned they keep the condition's outcome unchanged
+        updates = [
+            ('status', inserted.status),
+            ('lecturer_id', func.coalesce(inserted.lecturer_id, AttendanceRecord.lecturer_id)),
+            ('notes', func.coalesce(inserted.notes, AttendanceRecord.notes)),
+            ('recorded_at', inserted.recorded_at),
+            ('marked_by', inserted.marked_by)
+        ]
+        if replay:
+            newer = ((AttendanceRecord.marked_by != 'lecturer') &
+                     (inserted.recorded_at >= func.coalesce(AttendanceRecord.recorded_at, inserted.recorded_at)))
+            updates = [(column, case((newer, value), else_=getattr(AttendanceRecord, column)))
+                       for column, value in updates]
+        statement = statement.on_duplicate_key_update(updates)
+        self.session.execute(statement)
+        
+        created = [value['student_id'] for value in values if value['student_id'] not in existing]
+        if created:
+            existing.update(
+                self.session.query(AttendanceRecord.student_id, AttendanceRecord.attendance_id)
+                .filter(AttendanceRecord.class_id == class_id, AttendanceRecord.student_id.in_(created))
+                .all()
+            )
+        self.session.commit()
+        created = set(created)
+        return [
+            {
+                'student_id': value['student_id'],
+                'attendance_id': existing[value['student_id']],
+                'status': value['status'],
+                'outcome': 'created' if value['student_id'] in created else 'updated'
+            }
+            for value in values
+        ]
+    
+    def check_in(self, class_id: int, student_id: int, status: str = 'present',
+                 marked_by: str = 'system') -> Tuple[Optional[int], bool]:
+        """Mark an enrolled student in one INSERT ... SELECT ... ON DUPLICATE KEY UPDATE
+        
+        The SELECT yields a row only when the user is a student in the
+        class's course for its semester, so the enrolment check, the insert
+        and the update of an earlier record on uq_attendance_class_student
+        all happen in a single statement. LAST_INSERT_ID(attendance_id) on the update
+        branch makes lastrowid the record id either way, so nothing is read
+        back.
+        
+        Returns:
+            Tuple of (attendance_id, whether an existing record was updated);
+            attendance_id is None when the student is not enrolled
+        """
+        recorded_at = datetime.utcnow()
+        enrolled = (
+            select(
+                literal(class_id), literal(student_id), literal(status),
+                literal(marked_by), literal(recorded_at)
+            )
+            .select_from(Class)
+            .join(CourseUser, (CourseUser.course_id == Class.course_id) &
+                              (CourseUser.semester_id == Class.semester_id))
+            .join(User, User.user_id == CourseUser.user_id)
+            .where(Class.class_id == class_id, CourseUser.user_id == student_id, User.role == 'student')
+        )
+        statement = mysql_insert(AttendanceRecord).from_select(
+            ['class_id', 'student_id', 'status', 'marked_by', 'recorded_at'], enrolled
+        )
+        statement = statement.on_duplicate_key_update(
+            attendance_id=func.last_insert_id(AttendanceRecord.attendance_id),
+            status=status,
+            marked_by=marked_by,
+            recorded_at=recorded_at
+        )
+        result = self.session.execute(statement)
+        self.session.commit()
+        # Affected rows: 0 = nothing selected, 1 = inserted (or unchanged), 2 = updated
+        if result.rowcount == 0:
+            return None, False
+        return result.lastrowid, result.rowcount == 2
+    
+    def mark_absent_unrecorded(self, class_ids: List[int]) -> int:
+        """Create an absent record for every enrolled student of the classes without one
+        
+        One INSERT ... SELECT from the classes' enrolments (course_users for
+        the course and semester), skipping students that already have a
+        record. A check-in racing the statement keeps its own record through
+        the no-op ON DUPLICATE KEY UPDATE. Does not commit.
+        
+        Returns:
+            Number of absent records created
+        """
+        if not class_ids:
+            return 0
+        existing = aliased(AttendanceRecord)
+        recorded_at = datetime.utcnow()
+        unrecorded = (
+            select(
+                Class.class_id, CourseUser.user_id, literal('absent'),
+                literal('system'), literal(recorded_at)
+            )
+            .select_from(Class)
+            .join(CourseUser, (CourseUser.course_id == Class.course_id) &
+                              (CourseUser.semester_id == Class.semester_id))
+            .join(User, User.user_id == CourseUser.user_id)
+            .outerjoin(existing, (existing.class_id == Class.class_id) &
+                                 (existing.student_id == CourseUser.user_id))
+            .where(Class.class_id.in_(class_ids), User.role == 'student', existing.attendance_id.is_(None))
+        )
+        statement = mysql_insert(AttendanceRecord).from_select(
+            ['class_id', 'student_id', 'status', 'marked_by', 'recorded_at'], unrecorded
+        )
+        statement = statement.on_duplicate_key_update(attendance_id=AttendanceRecord.attendance_id)
+        return self.session.execute(statement).rowcount
+    
     def student_get_attendance_for_appeal(self, attendance_record_id: int):
         """Get attendance record details for appeal"""
         headers = ["student_id", "student_name", "course_name", "course_code", "class_id"]
@@ -1,7 +1,7 @@
 from .base_entity import BaseEntity
 from database.models import Class, Course, Venue, User, CourseUser, AttendanceRecord, Semester, AttendanceAppeal
 from datetime import date, datetime, timedelta
-from sqlalchemy import func, extract, case
+from sqlalchemy import func, extract, case, or_
 from sqlalchemy.orm import aliased
 from collections import defaultdict
 import calendar
@@ -179,6 +179,22 @@ class ClassModel(BaseEntity[Class]):
         )
         return self.add_headers(headers, records)
 
+    def get_enrolled_student_ids(self, class_id):
+        """User ids of students enrolled in the class's course for its semester"""
+        rows = (
+            self.session
+            .query(CourseUser.user_id)
+            .select_from(Class)
+            .join(CourseUser, 
+                  (CourseUser.course_id == Class.course_id) & 
+                  (CourseUser.semester_id == Class.semester_id))
+            .join(User, User.user_id == CourseUser.user_id)
+            .filter(Class.class_id == class_id)
+            .filter(User.role == "student")
+            .all()
+        )
+        return [row[0] for row in rows]
+
     def class_is_institution(self, class_id, institution_id) -> bool:
         return (
             self.session
@@ -519,60 +535,58 @@ class ClassModel(BaseEntity[Class]):
         )
     
     def get_all_classes_with_attendance(self, institution_id):
-        """Get all classes for an institution with attendance statistics"""
+        """Get all classes for an institution with attendance statistics
+        
+        Finalized (completed) classes hold a record for every enrolled
+        student, so their counts come from attendance_records alone; only
+        classes not yet finalized fall back to the enrolment count for
+        ``total`` and ``unmarked``. Both are grouped once and joined, rather
+        than counted per class in correlated subqueries.
+        """
         headers = ["class_id", "module_name", "date", "venue", "lecturer", 
                    "total", "present", "absent", "late", "excused", "unmarked"]
         
-        # Subqueries for attendance counts
-        q_total = (
+        counts = (
             self.session
-            .query(func.count(User.user_id))
-            .select_from(CourseUser)
-            .join(User, User.user_id == CourseUser.user_id)
-            .filter(CourseUser.course_id == Class.course_id)
-            .filter(CourseUser.semester_id == Class.semester_id)
-            .filter(User.role == "student")
-            .correlate(Class)
-            .scalar_subquery()
-        )
-        
-        q_present = (
-            self.session
-            .query(func.count(AttendanceRecord.attendance_id))
-            .filter(AttendanceRecord.class_id == Class.class_id)
-            .filter(AttendanceRecord.status == "present")
-            .correlate(Class)
-            .scalar_subquery()
-        )
-        
-        q_absent = (
-            self.session
-            .query(func.count(AttendanceRecord.attendance_id))
-            .filter(AttendanceRecord.class_id == Class.class_id)
-            .filter(AttendanceRecord.status == "absent")
-            .correlate(Class)
-            .scalar_subquery()
+            .query(
+                AttendanceRecord.class_id.label('class_id'),
+                func.count(AttendanceRecord.attendance_id).label('recorded'),
+                func.sum(case((AttendanceRecord.status == "present", 1), else_=0)).label('present'),
+                func.sum(case((AttendanceRecord.status == "absent", 1), else_=0)).label('absent'),
+                func.sum(case((AttendanceRecord.status == "late", 1), else_=0)).label('late'),
+                func.sum(case((AttendanceRecord.status == "excused", 1), else_=0)).label('excused')
+            )
+            .join(Class, AttendanceRecord.class_id == Class.class_id)
+            .join(Course, Class.course_id == Course.course_id)
+            .filter(Course.institution_id == institution_id)
+            .group_by(AttendanceRecord.class_id)
+            .subquery()
         )
         
-        q_late = (
+        enrolled = (
             self.session
-            .query(func.count(AttendanceRecord.attendance_id))
-            .filter(AttendanceRecord.class_id == Class.class_id)
-            .filter(AttendanceRecord.status == "late")
-            .correlate(Class)
-            .scalar_subquery()
+            .query(
+                CourseUser.course_id.label('course_id'),
+                CourseUser.semester_id.label('semester_id'),
+                func.count(User.user_id).label('students')
+            )
+            .join(User, User.user_id == CourseUser.user_id)
+            .join(Course, Course.course_id == CourseUser.course_id)
+            .filter(Course.institution_id == institution_id)
+            .filter(User.role == "student")
+            .group_by(CourseUser.course_id, CourseUser.semester_id)
+            .subquery()
         )
         
-        q_excused = (
-            self.session
-            .query(func.count(AttendanceRecord.attendance_id))
-            .filter(AttendanceRecord.class_id == Class.class_id)
-            .filter(AttendanceRecord.status == "excused")
-            .correlate(Class)
-            .scalar_subquery()
+        present = func.coalesce(counts.c.present, 0)
+        absent = func.coalesce(counts.c.absent, 0)
+        late = func.coalesce(counts.c.late, 0)
+        excused = func.coalesce(counts.c.excused, 0)
+        total = case(
+            (Class.status == "completed", func.coalesce(counts.c.recorded, 0)),
+            else_=func.coalesce(enrolled.c.students, 0)
         )
         
-        # Main query
         classes = (
             self.session
             .query(
@@ -581,20 +595,63 @@ class ClassModel(BaseEntity[Class]):
                 Class.start_time,
                 Venue.name,
                 User.name,
-                q_total,
-                func.coalesce(q_present, 0),
-                func.coalesce(q_absent, 0),
-                func.coalesce(q_late, 0),
-                func.coalesce(q_excused, 0),
-                (q_total - func.coalesce(q_present, 0) - func.coalesce(q_absent, 0) - 
-                 func.coalesce(q_late, 0) - func.coalesce(q_excused, 0))
+                total,
+                present,
+                absent,
+                late,
+                excused,
+                total - present - absent - late - excused
             )
             .join(Course, Class.course_id == Course.course_id)
             .join(Venue, Class.venue_id == Venue.venue_id)
             .join(User, Class.lecturer_id == User.user_id)
+            .outerjoin(counts, counts.c.class_id == Class.class_id)
+            .outerjoin(enrolled, (enrolled.c.course_id == Class.course_id) &
+                                 (enrolled.c.semester_id == Class.semester_id))
             .filter(Course.institution_id == institution_id)
             .order_by(Class.start_time.desc())
             .all()
         )
         
-        return self.add_headers(headers, classes)
\ No newline at end of file
+        return self.add_headers(headers, classes)
+    
+    def lock_ended_unfinalized(self, ended_before, ended_after, limit=200):
+        """Ids of classes that ended between ``ended_after`` and ``ended_before`` and are not yet completed
+        
+        The rows are locked for the rest of the transaction; rows another
+        process already holds are skipped, so concurrent finalizers split
+        the work instead of waiting on each other.
+        """
+        rows = (
+            self.session
+            .query(Class.class_id)
+            .filter(Class.end_time < ended_before)
+            .filter(Class.end_time > ended_after)
+            .filter(or_(Class.status.in_(("scheduled", "in_progress")), Class.status.is_(None)))
+            .order_by(Class.end_time)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        return [row[0] for row in rows]
+    
+    def get_next_unfinalized_end(self, ended_after):
+        """Earliest end time after ``ended_after`` of a class not yet completed or cancelled, or None"""
+        return (
+            self.session
+            .query(func.min(Class.end_time))
+            .filter(Class.end_time > ended_after)
+            .filter(or_(Class.status.in_(("scheduled", "in_progress")), Class.status.is_(None)))
+            .scalar()
+        )
+    
+    def mark_completed(self, class_ids) -> int:
+        """Set the given classes' status to completed, without committing"""
+        if not class_ids:
+            return 0
+        return (
+            self.session
+            .query(Class)
+            .filter(Class.class_id.in_(class_ids))
+            .update({Class.status: "completed"}, synchronize_session=False)
+        )
\ No newline at end of file
@@ -0,0 +1,64 @@
+from .base_entity import BaseEntity
+from database.models import FacialData, User
+from typing import Iterator, Optional, Tuple
+from sqlalchemy import func
+
+class FacialDataModel(BaseEntity[FacialData]):
+    """Entity for FacialData model with custom methods"""
+    
+    def __init__(self, session):
+        super().__init__(session, FacialData)
+    
+    def stream_active_encodings(self, institution_id: Optional[int] = None,
+                                batch_size: int = 200) -> Iterator[Tuple[int, str, bytes, int]]:
+        """Stream (user_id, name, face_encoding, sample_count) for every active gallery row.
+        
+        Uses a server-side cursor so the whole gallery is never buffered
+        client-side at once. Optionally limited to one institution's users.
+        """
+        query = (
+            self.session
+            .query(FacialData.user_id, User.name, FacialData.face_encoding, FacialData.sample_count)
+            .join(User, User.user_id == FacialData.user_id)
+            .filter(FacialData.is_active == True)
+            .filter(User.is_active == True)
+        )
+        if institution_id is not None:
+            query = query.filter(User.institution_id == institution_id)
+        return query.order_by(FacialData.user_id).yield_per(batch_size)
+    
+    def get_active_for_user(self, user_id: int) -> FacialData:
+        return (
+            self.session
+            .query(FacialData)
+            .filter(FacialData.user_id == user_id)
+            .filter(FacialData.is_active == True)
+            .with_for_update()
+            .first()
+        )
+    
+    def save_encoding(self, user_id: int, face_encoding: bytes, sample_count: int) -> FacialData:
+        """Insert or replace the active encoding for a user"""
+        record = self.get_active_for_user(user_id)
+        if record:
+            record.face_encoding = face_encoding
+            record.sample_count = sample_count
+        else:
+            record = FacialData(user_id=user_id, face_encoding=face_encoding, sample_count=sample_count)
+            self.session.add(record)
+        self.session.commit()
+        return record
+    
+    def get_gallery_version(self) -> Tuple[int, int, str]:
+        """Cheap fingerprint of the active gallery: (rows, total samples, last update)"""
+        rows, samples, updated_at = (
+            self.session
+            .query(
+                func.count(FacialData.facial_data_id),
+                func.coalesce(func.sum(FacialData.sample_count), 0),
+                func.max(FacialData.updated_at)
+            )
+            .filter(FacialData.is_active == True)
+            .one()
+        )
+        return (int(rows), int(samples), updated_at.isoformat() if updated_at else None)
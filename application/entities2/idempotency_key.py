@@ -0,0 +1,49 @@
+from .base_entity import BaseEntity
+from database.models import IdempotencyKey
+from typing import Optional, Dict, Any
+from datetime import datetime
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+class IdempotencyKeyModel(BaseEntity[IdempotencyKey]):
+    """Entity for stored responses of requests sent with an Idempotency-Key"""
+    
+    def __init__(self, session):
+        super().__init__(session, IdempotencyKey)
+    
+    def get_response(self, scope: str, key: str, since: datetime) -> Optional[IdempotencyKey]:
+        """Stored response for a key, if recorded after ``since``"""
+        return (
+            self.session
+            .query(IdempotencyKey)
+            .filter(
+                IdempotencyKey.scope == scope,
+                IdempotencyKey.idempotency_key == key,
+                IdempotencyKey.created_at >= since
+            )
+            .first()
+        )
+    
+    def save_response(self, scope: str, key: str, fingerprint: str,
+                      status_code: int, response: Dict[str, Any]) -> None:
+        """Store a response; a key already stored keeps its first response"""
+        statement = mysql_insert(IdempotencyKey).values(
+            scope=scope,
+            idempotency_key=key,
+            fingerprint=fingerprint,
+            status_code=status_code,
+            response=response,
+            created_at=datetime.utcnow()
+        ).prefix_with('IGNORE')
+        self.session.execute(statement)
+        self.session.commit()
+    
+    def delete_expired(self, before: datetime) -> int:
+        """Delete responses recorded before ``before``"""
+        deleted = (
+            self.session
+            .query(IdempotencyKey)
+            .filter(IdempotencyKey.created_at < before)
+            .delete(synchronize_session=False)
+        )
+        self.session.commit()
+        return deleted
@@ -2,6 +2,7 @@ from .base_entity import BaseEntity
 from database.models import *
 from datetime import datetime
 from sqlalchemy import func
+from typing import Dict
 
 class UserModel(BaseEntity[User]):
     """Specific entity for User model with custom methods"""
@@ -136,5 +137,18 @@ class UserModel(BaseEntity[User]):
             User.institution_id == institution_id,
             User.role == role
         ).all()
-        
-    
\ No newline at end of file
+    
+    def get_ids_by_institution(self, institution_id: int, role: str = "student"):
+        """Get the user IDs of an institution's users with the given role."""
+        rows = self.session.query(User.user_id).filter(
+            User.institution_id == institution_id,
+            User.role == role
+        ).all()
+        return [row[0] for row in rows]
+    
+    def get_names_by_ids(self, user_ids) -> Dict[int, str]:
+        """Map the given user IDs to names in one query."""
+        if not user_ids:
+            return {}
+        rows = self.session.query(User.user_id, User.name).filter(User.user_id.in_(list(user_ids))).all()
+        return {user_id: name for user_id, name in rows}
@@ -298,12 +298,30 @@ class FacialData(Base, BaseMixin):
     facial_data_id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False, index=True)
 
-    face_encoding = Column(LargeBinary, nullable=False)
+    face_encoding = Column(LargeBinary(length=(2**32) - 1), nullable=False)  # LONGBLOB on MySQL
     sample_count = Column(Integer, server_default="1")
     created_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
     updated_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"), onupdate=text("CURRENT_TIMESTAMP"))
     is_active = Column(Boolean, server_default="1")
 
+# =====================
+# IDEMPOTENCY KEYS
+# =====================
+class IdempotencyKey(Base, BaseMixin):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        UniqueConstraint("scope", "idempotency_key", name="uq_idempotency_scope_key"),
+    )
+
+    idempotency_key_id = Column(Integer, primary_key=True)
+    scope = Column(String(100), nullable=False)  # endpoint:user_id
+    idempotency_key = Column(String(255), nullable=False)
+
+    fingerprint = Column(String(64), nullable=False)  # SHA-256 of the request body
+    status_code = Column(Integer, nullable=False)
+    response = Column(JSON, nullable=False)
+    created_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"), index=True)
+
 # =====================
 # PLATFORM ISSUES (USER REPORTS)
 # =====================
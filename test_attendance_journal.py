@@ -0,0 +1,109 @@
+"""
+Tests for the write-behind attendance journal
+"""
+import json
+import os
+import subprocess
+import sys
+
+from application.controls.attendance_journal import AttendanceJournal
+
+def event(class_id, student_id, status='present'):
+    return {
+        'class_id': class_id,
+        'student_id': student_id,
+        'status': status,
+        'marked_by': 'system',
+        'recorded_at': '2026-01-01T09:00:00'
+    }
+
+def write_lines(path, events, torn_tail=''):
+    with open(path, 'w', encoding='utf-8') as f:
+        for e in events:
+            f.write(json.dumps(e) + '\n')
+        f.write(torn_tail)
+
+def exited_pid():
+    """PID of a process that has already exited"""
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+class RecordingWriter:
+    def __init__(self, fail_classes=()):
+        self.batches = []
+        self.fail_classes = set(fail_classes)
+
+    def __call__(self, events):
+        if any(e['class_id'] in self.fail_classes for e in events):
+            return {'success': False, 'error': 'rejected'}
+        self.batches.append(events)
+        return {'success': True}
+
+    @property
+    def events(self):
+        return [e for batch in self.batches for e in batch]
+
+def test_replays_sealed_and_active_segments_after_crash(tmp_path):
+    """Segments sealed before a crash and journals of dead processes are written on start"""
+    write_lines(tmp_path / 'segment-1-111.log', [event(1, 1), event(1, 2, 'late')])
+    # Active journal of a crashed process, its last append torn mid-line
+    write_lines(tmp_path / f'journal-{exited_pid()}.log', [event(1, 3)], torn_tail='{"class_id": 1, "stu')
+    writer = RecordingWriter()
+
+    journal = AttendanceJournal(str(tmp_path), writer, flush_interval=60)
+    journal.start()
+    try:
+        assert [(e['student_id'], e['status']) for e in writer.events] == [(1, 'present'), (2, 'late'), (3, 'present')]
+        # Oldest segment first, so later check-ins win
+        assert [len(batch) for batch in writer.batches] == [2, 1]
+        assert not [name for name in os.listdir(tmp_path) if name.startswith('segment-')]
+    finally:
+        journal.shutdown()
+
+def test_leaves_journal_of_running_process(tmp_path):
+    """Another live process's active journal is not stolen"""
+    other = tmp_path / f'journal-{os.getppid()}.log'
+    write_lines(other, [event(1, 1)])
+    writer = RecordingWriter()
+
+    journal = AttendanceJournal(str(tmp_path), writer, flush_interval=60)
+    journal.start()
+    journal.shutdown()
+
+    assert writer.events == []
+    assert other.exists()
+
+def test_appended_events_survive_until_written(tmp_path):
+    """Appends are on disk before flush, and written once on shutdown"""
+    writer = RecordingWriter()
+    journal = AttendanceJournal(str(tmp_path), writer, flush_interval=60)
+    journal.start()
+    journal.append(2, 5)
+    journal.append(2, 6, status='late')
+
+    with open(tmp_path / f'journal-{os.getpid()}.log', encoding='utf-8') as f:
+        assert [json.loads(line)['student_id'] for line in f] == [5, 6]
+    assert writer.events == []
+
+    journal.shutdown()
+    assert [(e['student_id'], e['status']) for e in writer.events] == [(5, 'present'), (6, 'late')]
+    assert os.listdir(tmp_path) == []
+
+def test_failing_segment_is_dead_lettered(tmp_path):
+    """A segment the writer keeps rejecting is set aside after max_attempts"""
+    write_lines(tmp_path / 'segment-1-111.log', [event(666, 1)])
+    write_lines(tmp_path / 'segment-2-111.log', [event(1, 2)])
+    writer = RecordingWriter(fail_classes=[666])
+    journal = AttendanceJournal(str(tmp_path), writer, flush_interval=60, max_attempts=3)
+
+    journal.start()
+    journal.flush()
+    # Later segments wait while the failing one is retried
+    assert writer.events == []
+    journal.flush()
+
+    assert [e['student_id'] for e in writer.events] == [2]
+    assert sorted(os.listdir(tmp_path)) == ['dead-1-111.log', f'journal-{os.getpid()}.log']
+    assert journal.stats()['dead_lettered'] == 1
+    journal.shutdown()
@@ -0,0 +1,118 @@
+"""
+Tests for writing journaled check-ins that arrive late (needs the configured database)
+"""
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+from database.base import get_session
+from database.models import (
+    AttendanceRecord, Class, Course, CourseUser, Institution, Semester, User, Venue
+)
+from application.controls.attendance_control import AttendanceControl
+
+@pytest.fixture
+def enrolled_class():
+    """A throwaway institution with a lecturer, three enrolled students and one class"""
+    tag = uuid.uuid4().hex[:12]
+    with get_session() as s:
+        institution = Institution(name=f'Replay test {tag}')
+        s.add(institution)
+        s.flush()
+        lecturer = User(institution_id=institution.institution_id, role='lecturer', name='Lecturer',
+                        email=f'lecturer-{tag}@example.com', password_hash='x')
+        students = [
+            User(institution_id=institution.institution_id, role='student', name=f'Student {i}',
+                 email=f'student{i}-{tag}@example.com', password_hash='x')
+            for i in range(3)
+        ]
+        semester = Semester(institution_id=institution.institution_id, name='Replay',
+                            start_date=datetime(2026, 1, 1), end_date=datetime(2026, 12, 31))
+        course = Course(institution_id=institution.institution_id, code=f'R{tag}', name='Replay')
+        venue = Venue(institution_id=institution.institution_id, name='Room')
+        s.add_all([lecturer, *students, semester, course, venue])
+        s.flush()
+        for student in students:
+            s.add(CourseUser(course_id=course.course_id, user_id=student.user_id, semester_id=semester.semester_id))
+        now = datetime.now()
+        class_obj = Class(course_id=course.course_id, semester_id=semester.semester_id, venue_id=venue.venue_id,
+                          lecturer_id=lecturer.user_id, start_time=now - timedelta(hours=1),
+                          end_time=now + timedelta(hours=1))
+        s.add(class_obj)
+        s.flush()
+        ids = {
+            'institution_id': institution.institution_id,
+            'class_id': class_obj.class_id,
+            'lecturer_id': lecturer.user_id,
+            'student_ids': [student.user_id for student in students]
+        }
+
+    yield ids
+
+    with get_session() as s:
+        s.query(AttendanceRecord).filter(AttendanceRecord.class_id == ids['class_id']).delete()
+        s.query(Class).filter(Class.class_id == ids['class_id']).delete()
+        s.query(CourseUser).filter(CourseUser.user_id.in_(ids['student_ids'])).delete(synchronize_session=False)
+        for model in (Course, Semester, Venue, User):
+            s.query(model).filter(model.institution_id == ids['institution_id']).delete()
+        s.query(Institution).filter(Institution.institution_id == ids['institution_id']).delete()
+
+def journal_event(class_id, student_id, recorded_at, status='present'):
+    return {
+        'class_id': class_id,
+        'student_id': student_id,
+        'status': status,
+        'marked_by': 'system',
+        'recorded_at': recorded_at.isoformat()
+    }
+
+def statuses(class_id):
+    with get_session() as s:
+        return {
+            record.student_id: (record.status, record.marked_by)
+            for record in s.query(AttendanceRecord).filter(AttendanceRecord.class_id == class_id)
+        }
+
+def test_late_replay_keeps_newer_records(enrolled_class):
+    """A delayed kiosk check-in never overrides a lecturer's correction or a newer record"""
+    app = Flask(__name__)
+    class_id = enrolled_class['class_id']
+    corrected, newer, older = enrolled_class['student_ids']
+    checked_in_at = datetime.utcnow() - timedelta(minutes=30)
+
+    # While the journal was backing off: a lecturer correction, a newer
+    # system record and an older one
+    AttendanceControl.mark_attendance(app, class_id, corrected, status='excused', marked_by='lecturer',
+                                      lecturer_id=enrolled_class['lecturer_id'])
+    with get_session() as s:
+        s.add(AttendanceRecord(class_id=class_id, student_id=newer, status='late', marked_by='system',
+                               recorded_at=checked_in_at + timedelta(minutes=5)))
+        s.add(AttendanceRecord(class_id=class_id, student_id=older, status='absent', marked_by='system',
+                               recorded_at=checked_in_at - timedelta(minutes=5)))
+
+    result = AttendanceControl.write_journal_events(
+        app, [journal_event(class_id, student_id, checked_in_at) for student_id in (corrected, newer, older)]
+    )
+
+    assert result['success']
+    assert statuses(class_id) == {
+        corrected: ('excused', 'lecturer'),
+        newer: ('late', 'system'),
+        older: ('present', 'system')
+    }
+
+def test_replayed_batches_apply_in_event_order(enrolled_class):
+    """Segments replayed out of order still leave the latest check-in in place"""
+    app = Flask(__name__)
+    class_id = enrolled_class['class_id']
+    student_id = enrolled_class['student_ids'][0]
+    checked_in_at = datetime.utcnow() - timedelta(minutes=30)
+
+    AttendanceControl.write_journal_events(
+        app, [journal_event(class_id, student_id, checked_in_at + timedelta(minutes=10), status='late')]
+    )
+    AttendanceControl.write_journal_events(app, [journal_event(class_id, student_id, checked_in_at)])
+
+    assert statuses(class_id) == {student_id: ('late', 'system')}
@@ -0,0 +1,47 @@
+"""
+Tests for the cached class rosters used to validate journaled check-ins
+"""
+from application.controls.enrolment_cache import EnrolmentCache
+
+class Roster:
+    """Loader over a mutable enrolment table that counts its queries"""
+
+    def __init__(self, enrolled):
+        self.enrolled = enrolled
+        self.queries = 0
+
+    def __call__(self, class_id):
+        self.queries += 1
+        return self.enrolled.get(class_id, [])
+
+def test_roster_is_loaded_once_per_class():
+    roster = Roster({1: [10, 11], 2: [20]})
+    cache = EnrolmentCache(roster)
+
+    assert all(cache.is_enrolled(1, student_id) for student_id in (10, 11, 10, 11))
+    assert cache.is_enrolled(2, 20)
+    assert roster.queries == 2
+
+def test_student_not_in_roster_is_rejected_after_one_reload():
+    roster = Roster({1: [10]})
+    cache = EnrolmentCache(roster)
+    cache.is_enrolled(1, 10)
+
+    assert not cache.is_enrolled(1, 99)
+    assert roster.queries == 2
+
+def test_student_enrolled_after_the_roster_was_loaded_is_accepted():
+    roster = Roster({1: [10]})
+    cache = EnrolmentCache(roster)
+    cache.is_enrolled(1, 10)
+
+    roster.enrolled[1] = [10, 12]
+    assert cache.is_enrolled(1, 12)
+
+def test_expired_roster_is_reloaded():
+    roster = Roster({1: [10]})
+    cache = EnrolmentCache(roster, ttl=0)
+    cache.is_enrolled(1, 10)
+    cache.is_enrolled(1, 10)
+
+    assert roster.queries == 2
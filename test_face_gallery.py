@@ -0,0 +1,40 @@
+"""
+Tests for the memory-mapped face gallery store
+"""
+import multiprocessing
+
+import numpy as np
+
+from application.controls.face_gallery import FaceGalleryStore
+
+DIM = 16
+
+def enrol(data_dir, worker, samples):
+    """Append samples whose pixels encode their label, compacting as the threshold is hit"""
+    store = FaceGalleryStore(data_dir, dim=DIM, compact_threshold=7)
+    for i in range(samples):
+        user_id = worker * 1000 + i
+        store.append(np.full(DIM, user_id % 251, dtype=np.uint8), f'Student {user_id}', user_id)
+        if i % 10 == 9:
+            store.compact()
+
+def test_concurrent_workers_keep_rows_and_labels_paired(tmp_path):
+    """Enrolment and compaction from several processes lose no rows and never mispair labels"""
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=enrol, args=(str(tmp_path), worker, 40)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    store = FaceGalleryStore(str(tmp_path), dim=DIM)
+    gallery, pending_faces, pending_labels, pending_user_ids = store.load()
+    labels = [gallery.names[code] for code in gallery.codes] + pending_labels
+    user_ids = list(gallery.user_ids) + pending_user_ids
+    faces = np.concatenate([np.asarray(gallery.faces), pending_faces])
+
+    assert sorted(user_ids) == sorted(worker * 1000 + i for worker in range(4) for i in range(40))
+    for face, label, user_id in zip(faces, labels, user_ids):
+        assert label == f'Student {user_id}'
+        assert np.all(face == user_id % 251)
@@ -0,0 +1,97 @@
+"""
+Tests for the face gallery nearest-neighbour indexes
+"""
+import threading
+
+import numpy as np
+import pytest
+
+from application.controls.face_index import BruteForceIndex, GalleryIndex, IVFPQIndex, index_report
+
+def make_gallery(samples=5000, queries=200, dim=256, people=60, seed=0):
+    """Clustered uint8 vectors standing in for flattened face crops"""
+    rng = np.random.default_rng(seed)
+    centers = rng.integers(40, 216, (people, dim))
+
+    def draw(count):
+        rows = centers[rng.integers(0, people, count)] + rng.normal(0, 12, (count, dim))
+        return np.clip(rows, 0, 255).astype(np.uint8)
+
+    return draw(samples), draw(queries)
+
+def test_ivfpq_recall_against_brute_force():
+    """IVF-PQ should find nearly all of the exact nearest neighbours"""
+    gallery, queries = make_gallery()
+
+    report = index_report(gallery, queries, [('ivfpq', 'ivfpq', {'nprobe': 8})], k=5)[0]
+
+    assert report['recall'] >= 0.9, report
+
+def test_ivfpq_is_exact_before_training():
+    """Below min_train_size the index falls back to exact search"""
+    gallery, queries = make_gallery(samples=500, queries=20)
+    exact = BruteForceIndex(gallery.shape[1], capacity=0, base=gallery)
+    index = IVFPQIndex(gallery.shape[1], capacity=0, base=gallery, min_train_size=2048)
+    index.prepare()
+
+    assert not index.is_trained
+    _, expected = exact.search(queries, 5)
+    _, found = index.search(queries, 5)
+    assert np.array_equal(np.sort(found, axis=1), np.sort(expected, axis=1))
+
+@pytest.mark.parametrize('backend', ['brute', 'balltree', 'ivfpq'])
+def test_snapshot_isolated_from_writer(backend):
+    """A snapshot keeps seeing the gallery as it was while the writer keeps adding"""
+    gallery, queries = make_gallery(samples=3000, queries=20)
+    writer = GalleryIndex(gallery.shape[1], capacity=16, backend=backend)
+    writer.add(gallery[:2500], [f'Student {i % 50}' for i in range(2500)], [i % 50 for i in range(2500)])
+    writer.radii['Student 0'] = 100.0
+    writer.prepare()
+
+    snapshot = writer.snapshot()
+    _, before = snapshot.search(queries, 5)
+    labels_before = snapshot.vote(before)[0]
+
+    # Enough rows to grow every buffer and, for IVF-PQ, encode a new block
+    writer.add(gallery[2500:], ['Newcomer'] * 500, [999] * 500)
+    writer.radii['Student 0'] = 1.0
+
+    assert len(snapshot) == 2500
+    assert len(snapshot.user_ids) == 2500
+    assert 999 not in snapshot.user_ids
+    assert snapshot.radii['Student 0'] == 100.0
+    _, after = snapshot.search(queries, 5)
+    assert np.array_equal(after, before)
+    assert snapshot.vote(after)[0] == labels_before
+    assert len(writer.snapshot()) == 3000
+
+    with pytest.raises(ValueError):
+        snapshot.add(gallery[:1], ['Intruder'], [None])
+
+def test_snapshot_readers_during_writes():
+    """Readers searching published snapshots never see rows beyond the snapshot"""
+    gallery, queries = make_gallery(samples=3000, queries=10)
+    writer = GalleryIndex(gallery.shape[1], capacity=16)
+    writer.add(gallery[:100], ['Student 0'] * 100, [0] * 100)
+    published = [writer.snapshot()]
+    errors = []
+    done = threading.Event()
+
+    def read():
+        while not done.is_set():
+            snapshot = published[-1]
+            _, indices = snapshot.search(queries, 5)
+            if indices.max() >= len(snapshot):
+                errors.append((indices.max(), len(snapshot)))
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for start in range(100, 3000, 50):
+        writer.add(gallery[start:start + 50], [f'Student {start}'] * 50, [start] * 50)
+        published.append(writer.snapshot())
+    done.set()
+    for reader in readers:
+        reader.join()
+
+    assert errors == []
@@ -0,0 +1,75 @@
+"""
+Tests for the per-institution gallery shard registry
+"""
+import threading
+
+from application.controls.face_shards import GalleryShardRegistry
+
+class FakeIndex:
+    def __init__(self, institution_id, version):
+        self.institution_id = institution_id
+        self.version = version
+        self.nbytes = 100
+
+    def __len__(self):
+        return 1
+
+class BlockingLoader:
+    """Loader whose first load waits until released"""
+
+    def __init__(self):
+        self.loads = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, institution_id):
+        self.loads += 1
+        if self.loads == 1:
+            self.started.set()
+            self.release.wait(10)
+        return FakeIndex(institution_id, self.loads)
+
+def load_in_background(registry, institution_id):
+    found = []
+    thread = threading.Thread(target=lambda: found.append(registry.get(institution_id)))
+    thread.start()
+    return thread, found
+
+def test_lru_eviction_by_count():
+    registry = GalleryShardRegistry(lambda institution_id: FakeIndex(institution_id, 1), max_shards=2)
+    registry.get(1)
+    registry.get(2)
+    registry.get(1)
+    registry.get(3)
+
+    assert registry.peek(2) is None
+    assert registry.peek(1) is not None and registry.peek(3) is not None
+    assert registry.stats()['evictions'] == 1
+
+def test_shard_invalidated_while_loading_is_not_kept():
+    loader = BlockingLoader()
+    registry = GalleryShardRegistry(loader)
+    thread, found = load_in_background(registry, 1)
+    loader.started.wait(10)
+
+    registry.invalidate(1)
+    loader.release.set()
+    thread.join(10)
+
+    assert found[0].version == 1
+    assert registry.peek(1) is None
+    assert registry.get(1).version == 2
+
+def test_invalidate_all_while_loading():
+    loader = BlockingLoader()
+    registry = GalleryShardRegistry(loader)
+    thread, _ = load_in_background(registry, 1)
+    loader.started.wait(10)
+
+    registry.invalidate()
+    loader.release.set()
+    thread.join(10)
+
+    assert registry.peek(1) is None
+    assert registry.get(1).version == 2
+    assert registry.peek(1).version == 2
@@ -0,0 +1,88 @@
+"""
+Tests for Idempotency-Key handling on JSON API routes
+"""
+from flask import Flask, jsonify, request
+
+from application.controls.idempotency import IdempotencyStore, idempotent
+
+def make_app():
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.config['idempotency_store'] = IdempotencyStore(max_entries=100)
+    app.calls = []
+
+    @app.route('/mark', methods=['POST'])
+    @idempotent('test.mark')
+    def mark():
+        data = request.get_json()
+        app.calls.append(data)
+        if data.get('fail'):
+            return jsonify({'success': False, 'error': 'database unavailable'}), 503
+        response = jsonify({'success': True, 'attendance_id': len(app.calls)})
+        response.headers['Location'] = f'/attendance/{len(app.calls)}'
+        return response, 201
+
+    return app
+
+def client_for(app, user_id=1):
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['user_id'] = user_id
+    return client
+
+def test_retry_with_same_key_replays_first_response():
+    app = make_app()
+    client = client_for(app)
+    body = {'class_id': 1, 'student_id': 2, 'status': 'present'}
+
+    first = client.post('/mark', json=body, headers={'Idempotency-Key': 'abc'})
+    retry = client.post('/mark', json=body, headers={'Idempotency-Key': 'abc'})
+
+    assert len(app.calls) == 1
+    assert first.status_code == retry.status_code == 201
+    assert retry.get_json() == first.get_json()
+    assert retry.headers['Location'] == first.headers['Location']
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert 'Idempotent-Replayed' not in first.headers
+
+def test_same_key_with_different_body_is_rejected():
+    app = make_app()
+    client = client_for(app)
+
+    client.post('/mark', json={'class_id': 1, 'student_id': 2}, headers={'Idempotency-Key': 'abc'})
+    reused = client.post('/mark', json={'class_id': 1, 'student_id': 3}, headers={'Idempotency-Key': 'abc'})
+
+    assert reused.status_code == 422
+    assert reused.get_json()['success'] is False
+    assert len(app.calls) == 1
+
+def test_keys_are_scoped_per_user():
+    app = make_app()
+    body = {'class_id': 1, 'student_id': 2}
+
+    client_for(app, user_id=1).post('/mark', json=body, headers={'Idempotency-Key': 'abc'})
+    other = client_for(app, user_id=2).post('/mark', json=body, headers={'Idempotency-Key': 'abc'})
+
+    assert 'Idempotent-Replayed' not in other.headers
+    assert len(app.calls) == 2
+
+def test_server_errors_are_not_stored():
+    app = make_app()
+    client = client_for(app)
+    body = {'class_id': 1, 'student_id': 2, 'fail': True}
+
+    first = client.post('/mark', json=body, headers={'Idempotency-Key': 'abc'})
+    retry = client.post('/mark', json=body, headers={'Idempotency-Key': 'abc'})
+
+    assert first.status_code == retry.status_code == 503
+    assert len(app.calls) == 2
+
+def test_requests_without_key_always_run():
+    app = make_app()
+    client = client_for(app)
+    body = {'class_id': 1, 'student_id': 2}
+
+    client.post('/mark', json=body)
+    client.post('/mark', json=body)
+
+    assert len(app.calls) == 2
@@ -0,0 +1,61 @@
+"""
+Tests for reusing recognition results across near-identical frames
+"""
+import cv2
+import numpy as np
+
+from application.controls.facial_recognition_control import FacialRecognitionControl
+from application.controls.recognition_cache import RecognitionResultCache, frame_signature
+
+def classroom_photo(student):
+    """Wide shot of the same room, with one small seat showing a different student"""
+    rng = np.random.default_rng(0)
+    room = cv2.resize(rng.integers(60, 200, (24, 32, 3), dtype=np.uint8), (1280, 960))
+    room[600:616, 900:916] = 90 + 4 * student
+    ok, encoded = cv2.imencode('.jpg', room, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    assert ok
+    return encoded.tobytes()
+
+class StubRecognizer(FacialRecognitionControl):
+    """Recognizer whose result depends on who is in the frame, without a gallery"""
+
+    def __init__(self):
+        super().__init__()
+        self.is_initialized = True
+        self.result_cache = RecognitionResultCache(max_entries=16, ttl=30.0, tolerance=16)
+        self.calls = 0
+
+    def recognize_in_process(self, image_data, class_id=None, institution_id=None):
+        self.calls += 1
+        student = int(cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_GRAYSCALE)[608, 908] > 100)
+        return {
+            'success': True,
+            'recognitions': [{'name': f'Student {student}', 'student_id': student, 'confidence': 90.0}],
+            'face_count': 1
+        }
+
+def test_near_identical_photos_match_the_cache_signature():
+    first, second = frame_signature(classroom_photo(0)), frame_signature(classroom_photo(5))
+    assert np.abs(first - second).max() <= 16
+
+def test_snapshot_photos_are_not_served_from_the_cache():
+    """A second photo of the same room with a different student is recognized afresh"""
+    recognizer = StubRecognizer()
+
+    first = recognizer.recognize_face_from_image(classroom_photo(0), class_id=1)
+    second = recognizer.recognize_face_from_image(classroom_photo(5), class_id=1)
+
+    assert recognizer.calls == 2
+    assert 'cached' not in second
+    assert first['recognitions'][0]['student_id'] == 0
+    assert second['recognitions'][0]['student_id'] == 1
+
+def test_kiosk_retries_reuse_the_cached_result():
+    recognizer = StubRecognizer()
+    photo = classroom_photo(0)
+
+    recognizer.recognize_face_from_image(photo, class_id=1, use_cache=True)
+    retry = recognizer.recognize_face_from_image(photo, class_id=1, use_cache=True)
+
+    assert recognizer.calls == 1
+    assert retry['cached'] is True
@@ -0,0 +1,63 @@
+"""
+Tests for loading the face gallery in the background, per process
+"""
+import multiprocessing
+import threading
+import time
+
+from application.controls.facial_recognition_control import FacialRecognitionControl
+
+class SlowRecognizer(FacialRecognitionControl):
+    """Recognizer whose gallery load waits until released"""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+        self.loads = 0
+
+    def _load(self, app):
+        self.loads += 1
+        self.release.wait(10)
+        self.is_initialized = True
+        return True
+
+def warm_in_child(recognizer, results):
+    started = recognizer.start_warmup(app=None)
+    recognizer.release.set()
+    deadline = time.monotonic() + 10
+    while recognizer.status == 'warming' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    results.put((started, recognizer.status))
+
+def test_warmup_starts_once_per_process():
+    recognizer = SlowRecognizer()
+
+    assert recognizer.start_warmup(app=None)
+    assert not recognizer.start_warmup(app=None)
+    recognizer.release.set()
+    recognizer._warmup_thread.join(10)
+
+    assert recognizer.status == 'ready'
+    assert recognizer.loads == 1
+    assert not recognizer.start_warmup(app=None)
+
+def test_process_forked_mid_warmup_warms_itself():
+    """A worker forked while the parent was warming does not wait forever for the parent's thread"""
+    recognizer = SlowRecognizer()
+    recognizer.start_warmup(app=None)
+    assert recognizer.status == 'warming'
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    child = context.Process(target=warm_in_child, args=(recognizer, results), daemon=True)
+    child.start()
+    try:
+        started, status = results.get(timeout=20)
+        child.join(10)
+    finally:
+        child.terminate()
+        recognizer.release.set()
+    recognizer._warmup_thread.join(10)
+
+    assert started
+    assert status == 'ready'